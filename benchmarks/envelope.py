@@ -0,0 +1,111 @@
+"""
+Envelope Benchmark
+
+Compares the memory redis uses for a stream of classic entries, which have a
+message field and a response_channel field when a response is expected, with
+the same stream in the compact envelope.  For each format the stream is
+filled with --count entries, --confirmed of them expecting a response, and
+MEMORY USAGE of the whole stream is reported.
+
+    $ python benchmarks/envelope.py redis://localhost --count 1000000
+"""
+from __future__ import annotations
+
+import time
+import asyncio
+import argparse
+
+from typing import Any, Dict, Optional
+
+from redismq import Client
+from redismq.envelope import compact
+
+STREAM = "envelope-benchmark"
+BATCH = 10000
+TIMEOUT = 10.0
+
+
+def entry(mq: Client, i: int, confirmed: bool) -> Dict[str, str]:
+    """
+    Return the classic fields of entry i, like a producer makes them.
+    """
+    payload = {"message": '{"id": %d, "value": "sample"}' % (i,)}
+    if confirmed:
+        payload["response_channel"] = "%s:response.%d" % (mq.namespace, 1000000 + i)
+    return payload
+
+
+async def memory_usage(mq: Client) -> Optional[int]:
+    """
+    Return the bytes used by the stream, None when the server can't say.
+    """
+    try:
+        return await mq.redis.memory_usage(STREAM, samples=0)
+    except Exception:  # pylint: disable=broad-except
+        return None
+
+
+async def run(mq: Client, count: int, confirmed: float, packed: bool) -> Dict[str, Any]:
+    """
+    Fill the stream in one format and measure it.
+    """
+    await mq.redis.delete(STREAM)
+    deadline = time.time() + TIMEOUT
+    every = round(1 / confirmed) if confirmed else 0
+
+    start = time.perf_counter()
+    for first in range(0, count, BATCH):
+        pipe = mq.redis.pipeline(transaction=False)
+        for i in range(first, min(count, first + BATCH)):
+            payload = entry(mq, i, bool(every) and i % every == 0)
+            if packed:
+                payload = compact(payload, mq.namespace, deadline)
+            pipe.xadd(STREAM, payload, maxlen=None)
+        await pipe.execute()
+    add_time = time.perf_counter() - start
+
+    usage = await memory_usage(mq)
+    await mq.redis.delete(STREAM)
+    return {
+        "format": "compact" if packed else "classic",
+        "xadd/s": count / add_time,
+        "bytes": usage,
+        "bytes/entry": usage / count if usage is not None else None,
+    }
+
+
+async def main(address: str, count: int, confirmed: float) -> None:
+    """
+    Measure both formats and print a table.
+    """
+    mq = await Client.connect(address)
+    results = [await run(mq, count, confirmed, packed) for packed in (False, True)]
+    await mq.close()
+
+    columns = list(results[0])
+    print("".join("%14s" % (column,) for column in columns))
+    for result in results:
+        print(
+            "".join(
+                (
+                    "%14.1f" % (value,)
+                    if isinstance(value, float)
+                    else "%14s" % ("n/a" if value is None else value,)
+                )
+                for value in result.values()
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("address", nargs="?", default="redis://localhost")
+    parser.add_argument("--count", type=int, default=1000000)
+    parser.add_argument(
+        "--confirmed",
+        type=float,
+        default=0.5,
+        help="fraction of the entries that expect a response",
+    )
+    args = parser.parse_args()
+    asyncio.run(main(args.address, args.count, args.confirmed))
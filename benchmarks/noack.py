@@ -0,0 +1,105 @@
+"""
+NOACK Benchmark
+
+Compares consuming a stream with the default consumer, which keeps every
+delivered message in the pending list until it is acked, with a noack
+consumer.  For each mode the stream is filled with --count messages, then
+they are all read, then they are all acked, and the rates of each phase are
+reported along with the memory used by the stream when all of the messages
+have been read but not acked.
+
+    $ python benchmarks/noack.py redis://localhost --count 10000
+"""
+from __future__ import annotations
+
+import time
+import asyncio
+import argparse
+
+from typing import Any, Dict, List, Optional
+
+from redismq import Client
+
+STREAM = "noack-benchmark"
+GROUP = "benchmark"
+
+
+async def memory_usage(mq: Client) -> Optional[int]:
+    """
+    Return the bytes used by the stream, None when the server can't say.
+    """
+    try:
+        return await mq.redis.memory_usage(STREAM, samples=0)
+    except Exception:  # pylint: disable=broad-except
+        return None
+
+
+async def run(mq: Client, count: int, noack: bool) -> Dict[str, Any]:
+    """
+    Fill the stream, read it and ack it, timing each phase.
+    """
+    await mq.redis.delete(STREAM)
+    consumer = await mq.consumer(STREAM, GROUP, "consumer1", noack=noack)
+
+    pipe = mq.redis.pipeline(transaction=False)
+    for i in range(count):
+        pipe.xadd(STREAM, {"message": str(i)}, maxlen=None)
+    await pipe.execute()
+    empty = await memory_usage(mq)
+
+    payloads: List[Any] = []
+    start = time.perf_counter()
+    for _ in range(count):
+        payloads.append(await consumer.read())
+    read_time = time.perf_counter() - start
+    in_flight = await memory_usage(mq)
+
+    start = time.perf_counter()
+    for payload in payloads:
+        await payload.ack()
+    ack_time = time.perf_counter() - start
+
+    pending = await mq.redis.xpending(STREAM, GROUP)
+    await mq.redis.delete(STREAM)
+
+    return {
+        "mode": "noack" if noack else "default",
+        "read/s": count / read_time,
+        "ack/s": count / ack_time if ack_time else float("inf"),
+        "total/s": count / (read_time + ack_time),
+        "pel bytes": (
+            in_flight - empty if in_flight is not None and empty is not None else None
+        ),
+        "left pending": pending["pending"],
+    }
+
+
+async def main(address: str, count: int) -> None:
+    """
+    Run both modes and print a table.
+    """
+    mq = await Client.connect(address)
+    results = [await run(mq, count, noack) for noack in (False, True)]
+    await mq.close()
+
+    columns = list(results[0])
+    print("".join("%14s" % (column,) for column in columns))
+    for result in results:
+        print(
+            "".join(
+                (
+                    "%14.0f" % (value,)
+                    if isinstance(value, float)
+                    else "%14s" % ("n/a" if value is None else value,)
+                )
+                for value in result.values()
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("address", nargs="?", default="redis://localhost")
+    parser.add_argument("--count", type=int, default=10000)
+    args = parser.parse_args()
+    asyncio.run(main(args.address, args.count))
@@ -0,0 +1,104 @@
+"""
+Payload Memory Benchmark
+
+Measures the memory a consumer holds for each message it has read and not
+yet acked.  For each kind of message --count entries shaped like the reply
+to an XREADGROUP are wrapped in payloads, the reply is dropped, and the
+memory still allocated (and the peak while wrapping them) is reported per
+payload using tracemalloc.  No messages are sent, the address is only used
+to create the consumer.
+
+    $ python benchmarks/payloads.py memory:// --count 100000
+"""
+from __future__ import annotations
+
+import gc
+import json
+import asyncio
+import argparse
+import tracemalloc
+
+from typing import Any, Dict, List, Tuple
+
+from redismq import Client
+
+STREAM = "payloads-benchmark"
+GROUP = "benchmark"
+
+# the fields of a message of each kind, as the consumer reads them
+KINDS: Dict[str, Dict[str, str]] = {
+    "unconfirmed": {"message": json.dumps({"order": 12345, "item": "widget"})},
+    "confirmed": {
+        "message": json.dumps({"order": 12345, "item": "widget"}),
+        "response_channel": "redismq:response.%d",
+    },
+}
+
+
+def reply(kind: str, count: int) -> List[Tuple[str, Dict[str, str]]]:
+    """
+    Return the entries of an XREADGROUP reply with count messages.
+    """
+    element_list = []
+    for i in range(count):
+        fields = dict(KINDS[kind])
+        if "response_channel" in fields:
+            fields["response_channel"] = fields["response_channel"] % (i,)
+        element_list.append(("1700000000000-%d" % (i,), fields))
+    return element_list
+
+
+async def run(mq: Client, kind: str, count: int) -> Dict[str, Any]:
+    """
+    Wrap count messages of a kind in payloads and measure what they hold.
+    """
+    consumer = await mq.consumer(STREAM, GROUP, "consumer1")
+    gc.collect()
+    tracemalloc.start()
+    element_list = reply(kind, count)
+    payloads = consumer._payloads(element_list)  # pylint: disable=protected-access
+    del element_list
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    for payload in payloads:
+        payload._forget()  # pylint: disable=protected-access
+    return {
+        "kind": kind,
+        "payloads": len(payloads),
+        "bytes/payload": current / count,
+        "peak/payload": peak / count,
+        "MB": current / 1e6,
+    }
+
+
+async def main(address: str, count: int) -> None:
+    """
+    Measure each kind of message and print a table.
+    """
+    mq = await Client.connect(address)
+    await mq.redis.delete(STREAM)
+    try:
+        results = [await run(mq, kind, count) for kind in KINDS]
+    finally:
+        await mq.redis.delete(STREAM)
+        await mq.close()
+
+    columns = list(results[0])
+    print("".join("%14s" % (column,) for column in columns))
+    for result in results:
+        print(
+            "".join(
+                ("%14.1f" % (value,) if isinstance(value, float) else "%14s" % (value,))
+                for value in result.values()
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("address", nargs="?", default="memory://")
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+    asyncio.run(main(args.address, args.count))
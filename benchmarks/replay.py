@@ -0,0 +1,96 @@
+"""
+Replay Benchmark
+
+Measures how fast the history of a stream is read with Client.replay().  The
+stream is filled with --count messages, then read from start to end with
+each of the --page-sizes, once only looking at the IDs and once decoding
+every message, and the entries per second are reported.
+
+    $ python benchmarks/replay.py redis://localhost --count 2000000
+"""
+from __future__ import annotations
+
+import json
+import time
+import asyncio
+import argparse
+
+from typing import Any, Dict, List
+
+from redismq import Client
+
+STREAM = "replay-benchmark"
+BATCH = 10000
+
+
+async def fill(mq: Client, count: int) -> None:
+    """
+    Add count messages to the stream, like a producer makes them.
+    """
+    await mq.redis.delete(STREAM)
+    for first in range(0, count, BATCH):
+        pipe = mq.redis.pipeline(transaction=False)
+        for i in range(first, min(count, first + BATCH)):
+            message = json.dumps({"id": i, "value": "sample"})
+            pipe.xadd(STREAM, {"message": message}, maxlen=None)
+        await pipe.execute()
+
+
+async def run(mq: Client, count: int, page_size: int, decode: bool) -> Dict[str, Any]:
+    """
+    Read the whole stream once.
+    """
+    seen = 0
+    start = time.perf_counter()
+    async for entry in mq.replay(STREAM, page_size=page_size):
+        if decode:
+            entry.message  # pylint: disable=pointless-statement
+        seen += 1
+    elapsed = time.perf_counter() - start
+    assert seen == count, "read %d of %d" % (seen, count)
+
+    return {
+        "page size": page_size,
+        "decode": "yes" if decode else "no",
+        "entries/s": count / elapsed,
+        "seconds": elapsed,
+    }
+
+
+async def main(address: str, count: int, page_sizes: List[int]) -> None:
+    """
+    Fill the stream, read it with each page size and print a table.
+    """
+    mq = await Client.connect(address)
+    await fill(mq, count)
+    results = [
+        await run(mq, count, page_size, decode)
+        for page_size in page_sizes
+        for decode in (False, True)
+    ]
+    await mq.redis.delete(STREAM)
+    await mq.close()
+
+    columns = list(results[0])
+    print("".join("%14s" % (column,) for column in columns))
+    for result in results:
+        print(
+            "".join(
+                ("%14.1f" % (value,) if isinstance(value, float) else "%14s" % (value,))
+                for value in result.values()
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("address", nargs="?", default="redis://localhost")
+    parser.add_argument("--count", type=int, default=2000000)
+    parser.add_argument(
+        "--page-sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=[100, 1000, 10000],
+        help="comma separated page sizes",
+    )
+    args = parser.parse_args()
+    asyncio.run(main(args.address, args.count, args.page_sizes))
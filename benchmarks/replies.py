@@ -0,0 +1,125 @@
+"""
+Reply Benchmark
+
+Measures how many confirmed requests a client completes per second with its
+replies spread over each of the --shards numbers of pubsub connections.
+The consumers serve the stream in --workers processes of their own, so the
+client only sends requests and reads replies, --concurrency at a time.
+
+    $ python benchmarks/replies.py redis://localhost --shards 1,2,4,8
+"""
+from __future__ import annotations
+
+import time
+import asyncio
+import argparse
+import multiprocessing
+
+from typing import Any, Dict, List
+
+from redismq import Client
+
+STREAM = "replies-benchmark"
+GROUP = "benchmark"
+
+
+def serve(address: str, name: str) -> None:
+    """
+    Answer every request with its message, until terminated.
+    """
+
+    async def echo(payload: Any) -> Any:
+        return payload.message
+
+    async def _serve() -> None:
+        mq = await Client.connect(address)
+        consumer = await mq.consumer(STREAM, GROUP, name)
+        await consumer.serve(echo, concurrency=64)
+
+    asyncio.run(_serve())
+
+
+async def run(
+    address: str, shards: int, concurrency: int, count: int
+) -> Dict[str, Any]:
+    """
+    Send count confirmed requests, concurrency of them at a time.
+    """
+    mq = await Client.connect(address, pubsub_shards=shards)
+    producer = await mq.producer(STREAM, maxlen=10000)
+    remaining = count
+
+    async def _send() -> None:
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            response = await producer.addConfirmedMessage("ping")
+            assert response["message"] == "ping", response
+
+    # warm up the connections first
+    await asyncio.gather(*[producer.addConfirmedMessage("ping") for _ in range(64)])
+    start = time.perf_counter()
+    await asyncio.gather(*[_send() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    await mq.close()
+
+    return {
+        "shards": shards,
+        "concurrency": concurrency,
+        "replies/s": count / elapsed,
+        "seconds": elapsed,
+    }
+
+
+async def main(
+    address: str, shards: List[int], concurrency: int, count: int, workers: int
+) -> None:
+    """
+    Start the consumers, run with each number of shards and print a table.
+    """
+    mq = await Client.connect(address)
+    await mq.redis.delete(STREAM)
+    await mq.consumer(STREAM, GROUP, "setup")
+
+    processes = [
+        multiprocessing.Process(target=serve, args=(address, "worker%d" % (i,)))
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        results = [await run(address, shard, concurrency, count) for shard in shards]
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+        await mq.redis.delete(STREAM)
+        await mq.close()
+
+    columns = list(results[0])
+    print("".join("%14s" % (column,) for column in columns))
+    for result in results:
+        print(
+            "".join(
+                ("%14.1f" % (value,) if isinstance(value, float) else "%14s" % (value,))
+                for value in result.values()
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("address", nargs="?", default="redis://localhost")
+    parser.add_argument(
+        "--shards",
+        type=lambda value: [int(shard) for shard in value.split(",")],
+        default=[1, 2, 4, 8],
+        help="comma separated numbers of pubsub connections",
+    )
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+    asyncio.run(
+        main(args.address, args.shards, args.concurrency, args.count, args.workers)
+    )
@@ -109,7 +109,8 @@ async def main() -> None:
 
     mq = await Client.connect(f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}")
     consumer = await mq.consumer("fibStream", "fibGroup", consumer_name)
-    producer = await mq.producer("fibStream")
+    # identical sub-problems share one request
+    producer = await mq.producer("fibStream", single_flight=True)
     while True:
         payload = await consumer.read()
         main.log_debug("    - payload: %r", payload)  # type: ignore[attr-defined]
@@ -14,7 +14,29 @@ from .debugging import create_log_handler
 create_log_handler(_log, level=os.getenv("REDISMQ", logging.WARNING))
 
 from .client import Client
-from .producer import Producer
+from .producer import Producer, BackpressureError, StreamError
 from .consumer import Consumer
+from .cache import ResponseCache
+from .tracing import Tracer
+from .spool import Spool, SpoolFullError
+from .limiter import AdaptiveLimiter
+from .archive import Archiver, ArchiveReader
+from .hedging import HedgePolicy
+from .dedup import Deduplicator
 
-__all__ = ["Client", "Producer", "Consumer"]
+__all__ = [
+    "Client",
+    "Producer",
+    "Consumer",
+    "ResponseCache",
+    "BackpressureError",
+    "StreamError",
+    "Tracer",
+    "Spool",
+    "SpoolFullError",
+    "AdaptiveLimiter",
+    "Archiver",
+    "ArchiveReader",
+    "HedgePolicy",
+    "Deduplicator",
+]
@@ -0,0 +1,40 @@
+"""
+Command Line for RedisMQ
+
+    python -m redismq worker module:handler redis://localhost mystream mygroup
+    python -m redismq top redis://localhost mystream
+    python -m redismq archive redis://localhost mystream /var/lib/mystream
+"""
+from __future__ import annotations
+
+import sys
+import importlib
+
+from typing import List, Optional
+
+# command name -> module with a main(argv) function
+COMMANDS = {
+    "worker": "redismq.worker",
+    "top": "redismq.top",
+    "archive": "redismq.archive",
+}
+
+USAGE = "usage: python -m redismq {%s} ..." % (",".join(COMMANDS),)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Run a command.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv or argv[0] not in COMMANDS:
+        sys.stderr.write(USAGE + "\n")
+        sys.exit(2)
+
+    module = importlib.import_module(COMMANDS[argv[0]])
+    module.main(argv[1:])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,515 @@
+"""
+Stream Archive for RedisMQ
+"""
+from __future__ import annotations
+
+import os
+import json
+import mmap
+import zlib
+import bisect
+import struct
+import asyncio
+import argparse
+
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .debugging import debugging
+from .client import Client
+from .replay import MAX_SEQ, Entry, Position, next_id, stream_id
+from .resilience import Backoff, RETRY_ERRORS
+
+__all__ = ["Archiver", "ArchiveReader"]
+
+# archiver default settings
+SEGMENT_SIZE = 64 * 1024 * 1024
+BLOCK_SIZE = 1000
+BLOCK_MS = 1000
+LEVEL = 6
+
+# each block is its length and crc32 followed by the zlib compressed JSON
+# list of [id, fields] entries
+HEADER = struct.Struct("<II")
+
+# each index record is the ID of the first entry of a block and its offset
+INDEX = struct.Struct("<QQQ")
+
+SEGMENT_SUFFIX = ".arc"
+INDEX_SUFFIX = ".idx"
+
+StreamID = Tuple[int, int]
+
+
+def _parse_id(msg_id: str, end: bool = False) -> StreamID:
+    """
+    Return a stream ID as a tuple that sorts like it, "-" and "+" are the
+    ends of the stream and a missing sequence number is the first one (or
+    the last one for the end of a range).
+    """
+    if msg_id == "-":
+        return (0, 0)
+    if msg_id == "+":
+        return (2**64 - 1, MAX_SEQ)
+    ms, _, seq = msg_id.partition("-")
+    if not seq:
+        return (int(ms), MAX_SEQ if end else 0)
+    return (int(ms), int(seq))
+
+
+def _format_id(msg_id: StreamID) -> str:
+    return "%d-%d" % msg_id
+
+
+def _segment_ids(directory: str) -> List[StreamID]:
+    """
+    Return the IDs of the first entries of the segments in the directory,
+    which are their names, in order.
+    """
+    ids = []
+    for name in os.listdir(directory):
+        if not name.endswith(SEGMENT_SUFFIX):
+            continue
+        try:
+            ids.append(_parse_id(name[: -len(SEGMENT_SUFFIX)]))
+        except ValueError:
+            continue
+    return sorted(ids)
+
+
+def _segment_path(directory: str, first: StreamID, suffix: str) -> str:
+    return os.path.join(directory, "%020d-%020d%s" % (first + (suffix,)))
+
+
+def _blocks(data: Any, offset: int = 0) -> Iterator[Tuple[int, int, bytes]]:
+    """
+    Yield the (offset, next_offset, compressed) of the valid blocks in data
+    from offset, stopping at the first one that was not completely written.
+    """
+    size = len(data)
+    while offset + HEADER.size <= size:
+        length, crc = HEADER.unpack_from(data, offset)
+        start = offset + HEADER.size
+        if not length or start + length > size:
+            return
+        block = data[start : start + length]
+        if zlib.crc32(block) != crc:
+            return
+        yield offset, start + length, block
+        offset = start + length
+
+
+def _entries(block: bytes) -> List[List[Any]]:
+    return json.loads(zlib.decompress(block))  # type: ignore[no-any-return]
+
+
+def _read_index(path: str) -> List[Tuple[StreamID, int]]:
+    """
+    Return the (first ID, offset) of the blocks in an index file, which may
+    be missing or behind its segment.
+    """
+    try:
+        with open(path, "rb") as index_file:
+            data = index_file.read()
+    except OSError:
+        return []
+    return [
+        ((ms, seq), offset)
+        for ms, seq, offset in INDEX.iter_unpack(
+            data[: len(data) - len(data) % INDEX.size]
+        )
+    ]
+
+
+@debugging
+class Archiver:
+    """
+    Copies the entries of a stream to compressed, append-only segment files
+    in a directory, following the stream with XREAD rather than a consumer
+    group.  Each batch of entries is one zlib compressed block, which is on
+    the disk before the stream is trimmed up to it (when trim is set, and
+    never past an entry a consumer group has not delivered or acked), and
+    a segment is closed and a new one started when it is segment_size bytes.
+    The index file next to each segment has the first ID and offset of every
+    block, so an ArchiveReader can start reading anywhere.
+    """
+
+    client: Any
+    stream_name: str
+    directory: str
+    segment_size: int
+    block_size: int
+    block_ms: int
+    level: int
+    trim: bool
+
+    last_id: str
+    segment_file: Optional[Any]
+    index_file: Optional[Any]
+    segment_bytes: int
+    counters: Dict[str, int]
+
+    stopping: bool
+    backoff: Backoff
+
+    log_debug: Callable[..., None]
+
+    def __init__(
+        self,
+        client: Any,
+        stream_name: str,
+        directory: str,
+        segment_size: int = SEGMENT_SIZE,
+        block_size: int = BLOCK_SIZE,
+        block_ms: int = BLOCK_MS,
+        level: int = LEVEL,
+        trim: bool = False,
+    ) -> None:
+        """
+        default constructor, picks up after the last archived entry
+        """
+        Archiver.log_debug("__init__ %r %r", stream_name, directory)
+        if block_size < 1:
+            raise ValueError("block_size must be positive")
+
+        self.client = client
+        self.stream_name = stream_name
+        self.directory = directory
+        self.segment_size = segment_size
+        self.block_size = block_size
+        self.block_ms = block_ms
+        self.level = level
+        self.trim = trim
+
+        self.last_id = "0-0"
+        self.segment_file = None
+        self.index_file = None
+        self.segment_bytes = 0
+        self.counters = {"archived": 0, "blocks": 0, "segments": 0, "trimmed": 0}
+
+        self.stopping = False
+        self.backoff = Backoff()
+
+        os.makedirs(directory, exist_ok=True)
+        self.recover()
+
+    def recover(self) -> None:
+        """
+        Find the last archived entry in the last segment, cutting off a block
+        that was not completely written and rebuilding the index of the
+        segment, which may be behind.
+        """
+        segment_ids = _segment_ids(self.directory)
+        self.counters["segments"] = len(segment_ids)
+        if not segment_ids:
+            return
+
+        first = segment_ids[-1]
+        path = _segment_path(self.directory, first, SEGMENT_SUFFIX)
+        index_path = _segment_path(self.directory, first, INDEX_SUFFIX)
+        with open(path, "rb") as segment_file:
+            data = segment_file.read()
+
+        index = []
+        end = 0
+        last: Optional[str] = None
+        for offset, end, block in _blocks(data):
+            entries = _entries(block)
+            index.append(INDEX.pack(*_parse_id(entries[0][0]), offset))
+            last = entries[-1][0]
+
+        if last is None:
+            # created but never written
+            Archiver.log_debug("    - removing empty %r", path)
+            os.remove(path)
+            if os.path.exists(index_path):
+                os.remove(index_path)
+            self.counters["segments"] -= 1
+            if len(segment_ids) > 1:
+                self.last_id = self._last_in(segment_ids[-2])
+            return
+
+        if end < len(data):
+            Archiver.log_debug("    - torn block at %r in %r", end, path)
+            with open(path, "r+b") as segment_file:
+                segment_file.truncate(end)
+        with open(index_path, "wb") as index_file:
+            index_file.write(b"".join(index))
+
+        self.last_id = last
+        self.segment_file = open(path, "ab")
+        self.index_file = open(index_path, "ab")
+        self.segment_bytes = end
+        Archiver.log_debug("    - last archived %r", self.last_id)
+
+    def _last_in(self, first: StreamID) -> str:
+        """
+        Return the ID of the last entry of a closed segment.
+        """
+        path = _segment_path(self.directory, first, SEGMENT_SUFFIX)
+        with open(path, "rb") as segment_file:
+            data = segment_file.read()
+        last = _format_id(first)
+        for _, _, block in _blocks(data):
+            last = _entries(block)[-1][0]
+        return last
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return the counters and the last archived ID.
+        """
+        stats: Dict[str, Any] = dict(self.counters)
+        stats["last_id"] = self.last_id
+        return stats
+
+    def _start_segment(self, first: str) -> None:
+        """
+        Close the current segment and start a new one named by the ID of its
+        first entry.
+        """
+        self._close_segment()
+        msg_id = _parse_id(first)
+        Archiver.log_debug("    - new segment %r", first)
+        self.segment_file = open(
+            _segment_path(self.directory, msg_id, SEGMENT_SUFFIX), "ab"
+        )
+        self.index_file = open(
+            _segment_path(self.directory, msg_id, INDEX_SUFFIX), "ab"
+        )
+        self.segment_bytes = 0
+        self.counters["segments"] += 1
+
+        # make the new files part of the directory
+        directory_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+    def _close_segment(self) -> None:
+        for archive_file in (self.segment_file, self.index_file):
+            if archive_file is not None:
+                archive_file.close()
+        self.segment_file = self.index_file = None
+
+    def write_block(self, entries: List[Any]) -> None:
+        """
+        Append a block of entries to the archive and wait for it to be on the
+        disk.
+        """
+        block = zlib.compress(json.dumps(entries).encode(), self.level)
+        if self.segment_file is None or self.segment_bytes >= self.segment_size:
+            self._start_segment(entries[0][0])
+        assert self.segment_file is not None and self.index_file is not None
+
+        offset = self.segment_bytes
+        self.segment_file.write(HEADER.pack(len(block), zlib.crc32(block)) + block)
+        self.segment_file.flush()
+        os.fsync(self.segment_file.fileno())
+        # the index is only a hint, it is rebuilt if it falls behind
+        self.index_file.write(INDEX.pack(*_parse_id(entries[0][0]), offset))
+        self.index_file.flush()
+
+        self.segment_bytes += HEADER.size + len(block)
+        self.last_id = entries[-1][0]
+        self.counters["archived"] += len(entries)
+        self.counters["blocks"] += 1
+
+    async def run_once(self, block_ms: Optional[int] = None) -> int:
+        """
+        Archive the next block of entries, waiting up to block_ms for them,
+        and trim the stream up to it.  Returns the number archived.
+        """
+        streams = await self.client.redis.xread(
+            {self.stream_name: self.last_id},
+            count=self.block_size,
+            block=self.block_ms if block_ms is None else block_ms,
+        )
+        if not streams:
+            return 0
+        entries = [[msg_id, fields] for msg_id, fields in streams[0][1]]
+        if not entries:
+            return 0
+
+        self.write_block(entries)
+        if self.trim:
+            trimmed = await self.client.redis.xtrim(
+                self.stream_name, minid=await self._trim_id(), approximate=True
+            )
+            self.counters["trimmed"] += trimmed
+        Archiver.log_debug("    - archived %d to %r", len(entries), self.last_id)
+        return len(entries)
+
+    async def _trim_id(self) -> str:
+        """
+        Return the oldest ID to keep in the stream, the one after the last
+        archived entry unless a consumer group has yet to deliver an entry
+        before it, or has one pending.
+        """
+        redis = self.client.redis
+        trim_id = next_id(self.last_id)
+        group_info = await redis.xinfo_groups(self.stream_name)
+        pending_groups = [info["name"] for info in group_info if info["pending"]]
+        pipe = redis.pipeline(transaction=False)
+        for group_name in pending_groups:
+            pipe.xpending(self.stream_name, group_name)
+        pending = await pipe.execute() if pending_groups else []
+
+        keep = [next_id(info["last-delivered-id"]) for info in group_info]
+        keep.extend(summary["min"] for summary in pending if summary["min"])
+        for msg_id in keep:
+            if _parse_id(msg_id) < _parse_id(trim_id):
+                trim_id = msg_id
+        Archiver.log_debug("    - trim_id: %r", trim_id)
+        return trim_id
+
+    async def run(self) -> None:
+        """
+        Archive the stream until stop() is called, waiting with backoff while
+        redis is unavailable.
+        """
+        Archiver.log_debug("run")
+        self.stopping = False
+        while not self.stopping:
+            try:
+                await self.run_once()
+            except RETRY_ERRORS as err:
+                Archiver.log_debug("    - run exception: %r", err)
+                self.client.connection_lost(err)
+                await self.backoff.wait()
+                continue
+            if self.backoff.attempts:
+                self.backoff.reset()
+                self.client.connection_restored()
+
+    def stop(self) -> None:
+        """
+        Stop run() after the block it is waiting for.
+        """
+        self.stopping = True
+
+    def close(self) -> None:
+        """
+        Close the segment files.
+        """
+        Archiver.log_debug("close")
+        self.stopping = True
+        self._close_segment()
+
+
+@debugging
+class ArchiveReader:
+    """
+    Reads the entries in the segment files of an Archiver, memory-mapping
+    the segments and using their indexes to start at the block with the
+    first entry of a range.
+    """
+
+    directory: str
+    namespace: str
+
+    log_debug: Callable[..., None]
+
+    def __init__(self, directory: str, namespace: str = "rmq") -> None:
+        """
+        default constructor
+        """
+        self.directory = directory
+        self.namespace = namespace
+
+    def read(self, start: Position = "-", end: Position = "+") -> Iterator[Entry]:
+        """
+        Yield the archived entries from start to end, inclusive, which are
+        IDs, times in seconds since the epoch or datetimes like the positions
+        of Client.replay().
+        """
+        low = _parse_id(stream_id(start))
+        high = _parse_id(stream_id(end, end=True), end=True)
+        ArchiveReader.log_debug("read %r %r", low, high)
+
+        segment_ids = _segment_ids(self.directory)
+        first_segment = max(0, bisect.bisect_right(segment_ids, low) - 1)
+        for first in segment_ids[first_segment:]:
+            if first > high:
+                return
+            path = _segment_path(self.directory, first, SEGMENT_SUFFIX)
+            index = _read_index(_segment_path(self.directory, first, INDEX_SUFFIX))
+            position = bisect.bisect_right([block_id for block_id, _ in index], low)
+            offset = index[position - 1][1] if position else 0
+
+            with open(path, "rb") as segment_file:
+                if not os.fstat(segment_file.fileno()).st_size:
+                    continue
+                data = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for _, _, block in _blocks(data, offset):
+                    for msg_id, fields in _entries(block):
+                        parsed = _parse_id(msg_id)
+                        if parsed > high:
+                            return
+                        if parsed >= low:
+                            yield Entry(msg_id, fields, self.namespace)
+            finally:
+                data.close()
+
+
+async def archive(
+    address: str, stream_name: str, directory: str, **options: Any
+) -> None:
+    """
+    Connect and archive the stream until interrupted.
+    """
+    client = await Client.connect(address)
+    archiver = Archiver(client, stream_name, directory, **options)
+    try:
+        await archiver.run()
+    finally:
+        archiver.close()
+        await client.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Parse the command line and run the archiver.
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m redismq archive", description="archive a RedisMQ stream"
+    )
+    parser.add_argument("address", help="redis URL, for example redis://localhost")
+    parser.add_argument("stream", help="stream name")
+    parser.add_argument("directory", help="directory for the segment files")
+    parser.add_argument(
+        "--trim",
+        action="store_true",
+        help="trim the stream up to the archived entries",
+    )
+    parser.add_argument(
+        "--segment-size",
+        type=int,
+        default=SEGMENT_SIZE,
+        help="bytes in a segment file (default %(default)s)",
+    )
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=BLOCK_SIZE,
+        help="entries in a compressed block (default %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(
+            archive(
+                args.address,
+                args.stream,
+                args.directory,
+                segment_size=args.segment_size,
+                block_size=args.block_size,
+                trim=args.trim,
+            )
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
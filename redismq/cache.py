@@ -0,0 +1,186 @@
+"""
+Response Cache for RedisMQ
+"""
+from __future__ import annotations
+
+import json
+import time
+import hashlib
+from collections import OrderedDict
+
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .debugging import debugging
+
+__all__ = ["ResponseCache"]
+
+# cache default settings
+MAXSIZE = 1024
+TTL = 60.0
+
+
+@debugging
+class ResponseCache:
+    """
+    Caches the responses to confirmed messages that the consumer marked as
+    cacheable.  The local tier is a bounded LRU, the optional shared tier is
+    kept in redis under the client namespace so other producers can use it.
+    """
+
+    maxsize: int
+    ttl: float
+    shared: bool
+
+    # encoded message -> (expires, response)
+    entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]"
+    counters: Dict[str, int]
+
+    log_debug: Callable[..., None]
+
+    def __init__(
+        self, maxsize: int = MAXSIZE, ttl: float = TTL, shared: bool = False
+    ) -> None:
+        """
+        default constructor
+        """
+        ResponseCache.log_debug("__init__ %r %r %r", maxsize, ttl, shared)
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive")
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared = shared
+
+        self.entries = OrderedDict()
+        self.counters = {
+            "hits": 0,
+            "shared_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "errors": 0,
+        }
+
+    @staticmethod
+    def shared_key(prefix: str, json_message: str) -> str:
+        """
+        Return the redis key of a message in the shared tier.
+        """
+        digest = hashlib.sha1(json_message.encode()).hexdigest()
+        return "%s:%s" % (prefix, digest)
+
+    def get(self, json_message: str) -> Optional[Dict[str, Any]]:
+        """
+        Return a copy of the locally cached response or None.
+        """
+        entry = self.entries.get(json_message, None)
+        if entry is None:
+            return None
+
+        expires, response = entry
+        if expires <= time.monotonic():
+            ResponseCache.log_debug("get %r expired", json_message)
+            del self.entries[json_message]
+            self.counters["expirations"] += 1
+            return None
+
+        self.entries.move_to_end(json_message)
+        return dict(response)
+
+    def put(
+        self, json_message: str, response: Dict[str, Any], ttl: Optional[float] = None
+    ) -> None:
+        """
+        Add a response to the local tier, evicting the least recently used
+        entries when it is full.
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+
+        self.entries[json_message] = (time.monotonic() + ttl, dict(response))
+        self.entries.move_to_end(json_message)
+        while len(self.entries) > self.maxsize:
+            evicted, _ = self.entries.popitem(last=False)
+            ResponseCache.log_debug("put - evicted %r", evicted)
+            self.counters["evictions"] += 1
+
+    async def lookup(
+        self, redis: Any, prefix: str, json_message: str
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Look for a response in the local tier, then in the shared tier.  A
+        shared tier that can't be read is a miss.
+        """
+        ResponseCache.log_debug("lookup %r", json_message)
+
+        response = self.get(json_message)
+        if response is not None:
+            self.counters["hits"] += 1
+            return response
+
+        if self.shared:
+            try:
+                shared_value = await redis.get(self.shared_key(prefix, json_message))
+            except Exception as err:  # pylint: disable=broad-except
+                ResponseCache.log_debug("    - shared tier exception: %r", err)
+                self.counters["errors"] += 1
+                shared_value = None
+            ResponseCache.log_debug("    - shared_value: %r", shared_value)
+            if shared_value is not None:
+                expires, response = json.loads(shared_value)
+                self.counters["shared_hits"] += 1
+                self.put(json_message, response, expires - time.time())
+                return dict(response)
+
+        self.counters["misses"] += 1
+        return None
+
+    async def store(
+        self,
+        redis: Any,
+        prefix: str,
+        json_message: str,
+        response: Dict[str, Any],
+        ttl: Optional[float] = None,
+    ) -> None:
+        """
+        Save a response in the local tier and the shared tier, when it can
+        be written.
+        """
+        ResponseCache.log_debug("store %r %r", json_message, response)
+
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self.put(json_message, response, ttl)
+
+        if self.shared and ttl > 0:
+            shared_value = json.dumps([time.time() + ttl, response])
+            try:
+                await redis.set(
+                    self.shared_key(prefix, json_message),
+                    shared_value,
+                    px=max(1, int(ttl * 1000)),
+                )
+            except Exception as err:  # pylint: disable=broad-except
+                ResponseCache.log_debug("    - shared tier exception: %r", err)
+                self.counters["errors"] += 1
+
+    def clear(self) -> None:
+        """
+        Drop everything in the local tier.
+        """
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return a snapshot of the cache counters and the hit ratio.
+        """
+        stats: Dict[str, Any] = dict(self.counters)
+        lookups = stats["hits"] + stats["shared_hits"] + stats["misses"]
+        stats["size"] = len(self.entries)
+        stats["maxsize"] = self.maxsize
+        stats["ttl"] = self.ttl
+        stats["hit_ratio"] = (
+            (stats["hits"] + stats["shared_hits"]) / lookups if lookups else 0.0
+        )
+        return stats
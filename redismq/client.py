@@ -4,14 +4,32 @@ Client for RedisMQ
 
 from __future__ import annotations
 
+import time
+import zlib
+import inspect
 import asyncio
+from collections import OrderedDict
 from redis import asyncio as aioredis  # type: ignore[attr-defined]
 
-from typing import Any, Callable, Dict, Set, Optional
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Set,
+    Tuple,
+    Optional,
+)
 
 from .debugging import debugging
 from .producer import Producer
 from .consumer import Consumer
+from .resilience import Backoff, RETRY_ERRORS
+from .memory import MemoryRedis
+from . import sentinel
+from .replay import PAGE_SIZE, Entry, Position, replay as replay_stream
 
 __all__ = ["Client"]
 
@@ -20,6 +38,21 @@ __all__ = ["Client"]
 MAXLEN = 100
 TIMEOUT = 10.0
 
+# seconds that stream statistics are reused
+STATS_TTL = 1.0
+
+# seconds between health check pings
+HEALTH_CHECK_INTERVAL = 5.0
+
+# cancelled requests remembered in case they are read later
+CANCELLED_SIZE = 1024
+
+# pooled connections for commands, on top of one for each pubsub shard
+MAX_CONNECTIONS = 10
+
+# pubsub connections the subscribed channels are spread over
+PUBSUB_SHARDS = 1
+
 
 @debugging
 class Client:
@@ -29,17 +62,39 @@ class Client:
 
     log_debug: Callable[..., None]
 
+    # factories of redis compatible connections for URL schemes other
+    # than redis:// and rediss://
+    backends: Dict[str, Callable[[str], Any]] = {
+        "memory": MemoryRedis.from_url,
+        sentinel.SCHEME: sentinel.from_url,
+    }
+
     status: str
     namespace: str
     redis: Any
+    replica: Any
     pubsub: Any
-    sub_task: Any
+    pubsubs: List[Any]
+    sub_tasks: List[Any]
+    health_task: Any
+    failover_task: Any
+
+    health_check_interval: float
+    state_callbacks: List[Callable[[str, str], Any]]
 
     payloads: Set[Any]
     payloads_updated: asyncio.Condition
 
     producer_registry: Dict[str, Producer]
 
+    requests: Dict[str, List[Any]]
+    cancelled_requests: "OrderedDict[str, None]"
+    cancel_subscribed: bool
+
+    stats_ttl: float
+    stats_cache: Dict[str, Tuple[float, Dict[str, Any]]]
+    stats_groups: Dict[str, List[str]]
+
     def __init__(self) -> None:
         """
         default constructor - use connect() instead
@@ -50,47 +105,269 @@ class Client:
         self.producer_registry = {}
         self.status = "wait"
 
+        # called with the old and new status when it changes
+        self.health_check_interval = HEALTH_CHECK_INTERVAL
+        self.state_callbacks = []
+
+        # recent stream statistics and the group names seen in each stream
+        self.stats_ttl = STATS_TTL
+        self.stats_cache = {}
+        self.stats_groups = {}
+
+        # payloads being handled by their response channel, more than one
+        # when the copies of a hedged request are read here, and the requests
+        # cancelled by their producers before they were read
+        self.requests = {}
+        self.cancelled_requests = OrderedDict()
+        self.cancel_subscribed = False
+
         # keep track of the un-acked payloads
         self.payloads = set()
         self.payloads_event = asyncio.Event()
         self.payloads_event.set()
 
     @classmethod
-    async def connect(cls, address: str, namespace: Optional[str] = None) -> "Client":
+    async def connect(
+        cls,
+        address: str,
+        namespace: Optional[str] = None,
+        health_check_interval: float = HEALTH_CHECK_INTERVAL,
+        on_state_change: Optional[Callable[[str, str], Any]] = None,
+        pubsub_shards: int = PUBSUB_SHARDS,
+        read_from_replicas: bool = False,
+    ) -> "Client":
         """
-        Call to create a connection pool.
+        Call to create a connection pool.  The connection is checked every
+        health_check_interval seconds and the subscriptions are restored when
+        it is lost, on_state_change is called with the old and new status.
+        The reply channels are spread over pubsub_shards connections, each
+        read by a task of its own.  With a redis+sentinel:// address the
+        primary is found by the sentinels and the connections move to a new
+        one as soon as it is announced, and read_from_replicas sends the
+        monitoring commands of stats() to the replicas.
         """
         Client.log_debug("connect %s", address)
+        if pubsub_shards < 1:
+            raise ValueError("pubsub_shards must be positive")
 
         # create a Client instance or one of its subclasses
         client = cls()
+        client.health_check_interval = health_check_interval
+        if on_state_change is not None:
+            client.state_callbacks.append(on_state_change)
 
         # set the namespace
         if namespace:
             cls.namespace = namespace
 
         # we are 'connecting' but not really until the PING
-        client.status = "connecting"
+        client.set_status("connecting")
 
-        # create a blocking connection pool to wait for a connection to become available
-        # rather than raising an exception
-        # see https://aioredis.readthedocs.io/en/latest/api/low-level/#aioredis.connection.BlockingConnectionPool
-        pool = aioredis.BlockingConnectionPool.from_url(
-            address, max_connections=10, decode_responses=True
-        )
-        client.redis = aioredis.Redis(connection_pool=pool)
+        scheme = address.split("://", 1)[0]
+        if scheme in cls.backends:
+            client.redis = cls.backends[scheme](address)
+        else:
+            # create a blocking connection pool to wait for a connection to become available
+            # rather than raising an exception
+            # see https://aioredis.readthedocs.io/en/latest/api/low-level/#aioredis.connection.BlockingConnectionPool
+            pool = aioredis.BlockingConnectionPool.from_url(
+                address,
+                max_connections=MAX_CONNECTIONS + pubsub_shards,
+                decode_responses=True,
+            )
+            client.redis = aioredis.Redis(connection_pool=pool)
         Client.log_debug("    - redis: %s", client.redis)
+        client.replica = client.redis
+        if read_from_replicas:
+            client.replica = sentinel.replica_for(client.redis)
 
         # try to ping it
         rslt = await client.redis.ping()
         Client.log_debug("    - ping: %r", rslt)
 
-        client.pubsub = client.redis.pubsub(ignore_subscribe_messages=True)
-        client.sub_task = asyncio.get_running_loop().create_task(client.pubsub.run())
-        client.status = "ready"
+        # connect now, a subscribe racing the first connect in run_pubsub
+        # would get a connection of its own that is never read
+        client.pubsubs = [
+            client.redis.pubsub(ignore_subscribe_messages=True)
+            for _ in range(pubsub_shards)
+        ]
+        client.pubsub = client.pubsubs[0]
+        for pubsub in client.pubsubs:
+            await pubsub.connect()
+        loop = asyncio.get_running_loop()
+        client.sub_tasks = [
+            loop.create_task(client.run_pubsub(pubsub)) for pubsub in client.pubsubs
+        ]
+        client.health_task = loop.create_task(client.health_check())
+        client.failover_task = None
+        if sentinel.managed(client.redis):
+            client.failover_task = loop.create_task(
+                sentinel.watch_failover(client.redis, client.failed_over)
+            )
+        client.set_status("ready")
 
         return client
 
+    def on_state_change(self, callback: Callable[[str, str], Any]) -> None:
+        """
+        Add a function (or coroutine function) to call with the old and new
+        status when the status changes.
+        """
+        self.state_callbacks.append(callback)
+
+    def set_status(self, status: str) -> None:
+        """
+        Change the status and tell the callbacks.
+        """
+        old_status, self.status = self.status, status
+        if old_status == status:
+            return
+        Client.log_debug("set_status %s -> %s", old_status, status)
+
+        for callback in self.state_callbacks:
+            try:
+                rslt = callback(old_status, status)
+                if inspect.isawaitable(rslt):
+                    asyncio.ensure_future(rslt)
+            except Exception as err:  # pylint: disable=broad-except
+                Client.log_debug("    - callback %r error: %r", callback, err)
+
+    def connection_lost(self, err: BaseException) -> None:
+        """
+        Called when a connection error is seen.
+        """
+        Client.log_debug("connection_lost %r", err)
+        if self.status == "ready":
+            self.set_status("disconnected")
+
+    def connection_restored(self) -> None:
+        """
+        Called when a command succeeds after a connection error.
+        """
+        if self.status == "disconnected":
+            Client.log_debug("connection_restored")
+            self.set_status("ready")
+
+    def pubsub_for(self, channel: str) -> Any:
+        """
+        Return the pubsub connection a channel is subscribed on, picked by
+        its hash so replies are spread over the shards.
+        """
+        if len(self.pubsubs) == 1:
+            return self.pubsub
+        return self.pubsubs[zlib.crc32(channel.encode()) % len(self.pubsubs)]
+
+    async def failed_over(self, address: str) -> None:
+        """
+        Called when the sentinels announce a new primary, drops the
+        connections to the old one so the commands and subscriptions move
+        over now rather than when they time out.
+        """
+        Client.log_debug("failed_over %s", address)
+        await self.redis.connection_pool.disconnect()
+        if self.replica is not self.redis:
+            await self.replica.connection_pool.disconnect()
+
+    @property
+    def cancel_channel(self) -> str:
+        """
+        The channel producers use to cancel their requests.
+        """
+        return "%s:cancel" % (self.namespace,)
+
+    async def listen_for_cancel(self) -> None:
+        """
+        Subscribe to the cancel channel, once.
+        """
+        if self.cancel_subscribed:
+            return
+        self.cancel_subscribed = True
+        await self.pubsub_for(self.cancel_channel).subscribe(
+            **{self.cancel_channel: self._cancel_handler}
+        )
+
+    def _cancel_handler(self, message: Dict[str, Any]) -> None:
+        """
+        Cancel the payloads of a request, or remember the request in case it
+        has not been read yet.
+        """
+        request_id = message["data"]
+        Client.log_debug("_cancel_handler %r", request_id)
+        payloads = self.requests.get(request_id, None)
+        if payloads:
+            for payload in list(payloads):
+                payload.cancel()
+            return
+        self.cancelled_requests[request_id] = None
+        while len(self.cancelled_requests) > CANCELLED_SIZE:
+            self.cancelled_requests.popitem(last=False)
+
+    def track_request(self, payload: Any) -> bool:
+        """
+        Keep a payload with a response channel so it can be cancelled,
+        returns True when its request has already been cancelled.
+        """
+        if payload.response_channel in self.cancelled_requests:
+            del self.cancelled_requests[payload.response_channel]
+            return True
+        self.requests.setdefault(payload.response_channel, []).append(payload)
+        return False
+
+    def untrack_request(self, payload: Any) -> None:
+        """
+        Forget a payload that has been acked or nacked.
+        """
+        payloads = self.requests.get(payload.response_channel, None)
+        if payloads is None:
+            return
+        for i, tracked in enumerate(payloads):
+            if tracked is payload:
+                del payloads[i]
+                break
+        if not payloads:
+            del self.requests[payload.response_channel]
+
+    async def run_pubsub(self, pubsub: Any = None) -> None:
+        """
+        Dispatch the messages on the channels subscribed on a pubsub
+        connection, the first one by default, reconnecting with backoff when
+        the connection is lost.  The channels are subscribed again when the
+        connection is restored.
+        """
+        if pubsub is None:
+            pubsub = self.pubsub
+        backoff = Backoff()
+        while True:
+            try:
+                await pubsub.connect()
+                if backoff.attempts:
+                    self.connection_restored()
+                    backoff.reset()
+                await pubsub.run()
+            except asyncio.CancelledError:
+                raise
+            except RETRY_ERRORS as err:
+                Client.log_debug("run_pubsub connection error: %r", err)
+                self.connection_lost(err)
+                await backoff.wait()
+
+    async def health_check(self) -> None:
+        """
+        Ping the server every health_check_interval seconds.
+        """
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            try:
+                await asyncio.wait_for(
+                    self.redis.ping(), timeout=self.health_check_interval
+                )
+                self.connection_restored()
+            except asyncio.CancelledError:
+                raise
+            except (asyncio.TimeoutError,) + RETRY_ERRORS as err:
+                Client.log_debug("health_check failed: %r", err)
+                self.connection_lost(err)
+
     async def close(self) -> None:
         """
         Call to wait for all of the active payloads to complete.
@@ -98,39 +375,67 @@ class Client:
         Client.log_debug("close")
         if self.status in ["closed", "closing"]:
             raise RuntimeError("Client.close() has already been called")
-        if self.status != "ready":
+        if self.status not in ["ready", "disconnected"]:
             raise RuntimeError("Client is not ready to close")
 
-        self.status = "closing"
+        self.set_status("closing")
 
         # wait for the event that says no more pending
         Client.log_debug(f"    - payloads: {self.payloads}")
         await self.payloads_event.wait()
-        self.sub_task.cancel()
-        try:
-            await self.sub_task
-        except asyncio.CancelledError:
-            Client.log_debug(f"    - sub_task cancelled")
-        await self.pubsub.close()
+
+        # stop the producers, so their spools stop replaying before the
+        # connection is closed
+        producers = list(self.producer_registry.values())
+        self.producer_registry = {}
+        tasks = []
+        for producer in producers:
+            replay_task = producer.spool.replay_task if producer.spool else None
+            if replay_task is not None and not replay_task.done():
+                tasks.append(replay_task)
+            producer.destroy()
+
+        tasks += [self.health_task] + self.sub_tasks
+        if self.failover_task is not None:
+            tasks.append(self.failover_task)
+        for task in tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                Client.log_debug("    - %r cancelled", task)
+        for pubsub in self.pubsubs:
+            await pubsub.close()
         Client.log_debug(f"    - pubsub closed")
         await self.redis.close()
         Client.log_debug(f"    - redis closed")
         await self.redis.connection_pool.disconnect()
         Client.log_debug(f"    - connection_pool disconnected")
+        if self.replica is not self.redis:
+            await self.replica.close()
+            await self.replica.connection_pool.disconnect()
+        if sentinel.managed(self.redis):
+            for sentinel_redis in self.redis.connection_pool.sentinel_manager.sentinels:
+                await sentinel_redis.connection_pool.disconnect()
 
-        self.status = "closed"
+        self.set_status("closed")
 
     async def producer(
-        self, stream_name: str, maxlen: int = MAXLEN, timeout: float = TIMEOUT
+        self,
+        stream_name: str,
+        maxlen: Optional[int] = MAXLEN,
+        timeout: float = TIMEOUT,
+        **options: Any,
     ) -> Producer:
         """
-        Use this to get a Producer
+        Use this to get a Producer, the options are passed to the Producer
+        when it is created.
         """
         Client.log_debug("producer %s", stream_name)
         if stream_name not in self.producer_registry:
             Client.log_debug("    - adding producer %s to registry", stream_name)
             self.producer_registry[stream_name] = Producer(
-                self, stream_name, maxlen, timeout
+                self, stream_name, maxlen, timeout, **options
             )
         else:
             Client.log_debug("    - producer %s found in registry", stream_name)
@@ -156,9 +461,16 @@ class Client:
         scan_pending_on_start: bool = True,
         claim_stale_messages: bool = True,
         min_idle_time: int = 60000,
+        noack: bool = False,
+        **options: Any,
     ) -> Consumer:
         """
-        Use this to get a Consumer
+        Use this to get a Consumer, the options are passed to the Consumer
+        when it is created.  A noack consumer reads messages without adding
+        them to the pending list, so they are delivered at most once.  When
+        claim_stale_messages is False, the consumer doesn't claim the
+        messages of other consumers on start or every claim_interval, until
+        it retries messages, which are delivered again by claiming them.
         """
         Client.log_debug("consumer %s ...", stream_name)
 
@@ -177,6 +489,12 @@ class Client:
                 "    - added group %s to stream %s ", group_name, stream_name
             )
 
+        # requests can be cancelled while they are being handled
+        await self.listen_for_cancel()
+
+        if not claim_stale_messages:
+            options["claim_interval"] = None
+
         # create a consumer
         consumer = Consumer(
             self,
@@ -184,6 +502,8 @@ class Client:
             group_name,
             consumer_id,
             min_idle_time,
+            noack=noack,
+            **options,
         )
 
         try:
@@ -198,7 +518,8 @@ class Client:
             Client.log_debug("    - no existing stream: %r", err)
             stream_info = []
 
-        if scan_pending_on_start:
+        # a noack consumer never has pending messages
+        if scan_pending_on_start and not noack:
             rslt = await self.redis.xpending(stream_name, group_name)
             Client.log_debug(f"    - xpending: %r", rslt)
 
@@ -257,3 +578,169 @@ class Client:
                         consumer.check_backlog = True
 
         return consumer
+
+    def replay(
+        self,
+        stream_name: str,
+        start: Position = "-",
+        end: Position = "+",
+        page_size: int = PAGE_SIZE,
+    ) -> AsyncIterator[Entry]:
+        """
+        Return an async iterator of the entries of a stream between two IDs
+        or times (seconds since the epoch or datetimes), inclusive, for
+        reprocessing.  Entries are read page_size at a time, the next page
+        while the last one is being used, and only decoded when their
+        attributes are used.
+        """
+        Client.log_debug("replay %s", stream_name)
+        return replay_stream(self, stream_name, start, end, page_size)
+
+    async def stats(self, stream_name: str) -> Dict[str, Any]:
+        """
+        Return the length of a stream and for each consumer group its lag,
+        pending count, age of the oldest pending message and the idle time of
+        each consumer.  Results are reused for stats_ttl seconds.
+        """
+        Client.log_debug("stats %s", stream_name)
+        return (await self.stats_many([stream_name]))[stream_name]
+
+    async def stats_many(
+        self, stream_names: Iterable[str]
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Return the statistics for a collection of streams, the ones that are
+        not cached are gathered together in one pipeline.
+        """
+        Client.log_debug("stats_many %r", stream_names)
+
+        now = time.monotonic()
+        results: Dict[str, Dict[str, Any]] = {}
+        stale: List[str] = []
+        for stream_name in stream_names:
+            cached = self.stats_cache.get(stream_name, None)
+            if cached and (now - cached[0] < self.stats_ttl):
+                results[stream_name] = cached[1]
+            elif stream_name not in stale:
+                stale.append(stream_name)
+        Client.log_debug("    - stale: %r", stale)
+
+        if stale:
+            fresh = await self._gather_stats(stale)
+            for stream_name, stream_stats in fresh.items():
+                self.stats_cache[stream_name] = (now, stream_stats)
+            results.update(fresh)
+
+        return results
+
+    async def _gather_stats(self, stream_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Query the streams and the groups they had the last time, groups that
+        are new since then need another round trip.
+        """
+        layout = {name: list(self.stats_groups.get(name, [])) for name in stream_names}
+        replies = await self._stats_pipeline(layout, True)
+
+        new_layout: Dict[str, List[str]] = {}
+        for stream_name in stream_names:
+            group_info = replies[stream_name]["group_info"]
+            if isinstance(group_info, Exception):
+                group_info = []
+            group_names = [group["name"] for group in group_info]
+            self.stats_groups[stream_name] = group_names
+
+            new_groups = [
+                name for name in group_names if name not in layout[stream_name]
+            ]
+            if new_groups:
+                new_layout[stream_name] = new_groups
+
+        if new_layout:
+            Client.log_debug("    - new groups: %r", new_layout)
+            new_replies = await self._stats_pipeline(new_layout, False)
+            for stream_name, reply in new_replies.items():
+                replies[stream_name]["group_replies"].update(reply["group_replies"])
+
+        now_ms = time.time() * 1000.0
+        return {
+            stream_name: self._build_stats(stream_name, replies[stream_name], now_ms)
+            for stream_name in stream_names
+        }
+
+    async def _stats_pipeline(
+        self, layout: Dict[str, List[str]], with_streams: bool
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Send the XLEN, XINFO GROUPS, XPENDING and XINFO CONSUMERS commands for
+        the streams and groups in one pipeline.
+        """
+        pipe = self.replica.pipeline(transaction=False)
+        for stream_name, group_names in layout.items():
+            if with_streams:
+                pipe.xlen(stream_name)
+                pipe.xinfo_groups(stream_name)
+            for group_name in group_names:
+                pipe.xpending(stream_name, group_name)
+                pipe.xinfo_consumers(stream_name, group_name)
+
+        rslt = iter(await pipe.execute(raise_on_error=False))
+        Client.log_debug("    - pipeline complete")
+
+        replies: Dict[str, Dict[str, Any]] = {}
+        for stream_name, group_names in layout.items():
+            reply: Dict[str, Any] = {"group_replies": {}}
+            if with_streams:
+                reply["length"] = next(rslt)
+                reply["group_info"] = next(rslt)
+            for group_name in group_names:
+                reply["group_replies"][group_name] = (next(rslt), next(rslt))
+            replies[stream_name] = reply
+
+        return replies
+
+    @staticmethod
+    def _build_stats(
+        stream_name: str, reply: Dict[str, Any], now_ms: float
+    ) -> Dict[str, Any]:
+        """
+        Collect the pipeline replies for one stream.
+        """
+        length = reply["length"]
+        group_info = reply["group_info"]
+        if isinstance(group_info, Exception):
+            group_info = []
+
+        groups: Dict[str, Any] = {}
+        for info in group_info:
+            group_name = info["name"]
+            pending_info, consumer_info = reply["group_replies"].get(
+                group_name, (None, None)
+            )
+
+            # the age of the oldest pending message comes from its ID
+            oldest_pending_age = None
+            if isinstance(pending_info, dict) and pending_info["min"]:
+                min_ms = int(str(pending_info["min"]).split("-")[0])
+                oldest_pending_age = max(0.0, (now_ms - min_ms) / 1000.0)
+
+            consumers: Dict[str, Any] = {}
+            if isinstance(consumer_info, list):
+                for consumer in consumer_info:
+                    consumers[consumer["name"]] = {
+                        "pending": consumer["pending"],
+                        "idle": consumer["idle"] / 1000.0,
+                    }
+
+            groups[group_name] = {
+                "lag": info.get("lag", None),
+                "pending": info["pending"],
+                "last_delivered_id": info["last-delivered-id"],
+                "oldest_pending_age": oldest_pending_age,
+                "consumers": consumers,
+            }
+
+        return {
+            "stream": stream_name,
+            "length": 0 if isinstance(length, Exception) else length,
+            "groups": groups,
+        }
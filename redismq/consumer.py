@@ -4,28 +4,129 @@ Consumer for RedisMQ
 from __future__ import annotations
 
 import asyncio
+import inspect
 import json
+import time
+from collections import deque
 from functools import partial
 
-from typing import TYPE_CHECKING, Any, Dict, TypedDict, Callable, Optional
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Deque,
+    Dict,
+    List,
+    Set,
+    Tuple,
+    TypedDict,
+    Callable,
+    Optional,
+    Union,
+)
 from redis import Connection # type: ignore[attr-defined]
 
 from .debugging import debugging
+from . import envelope
+from .limiter import AdaptiveLimiter
+from .dedup import Deduplicator
+from .replay import next_id
+from .resilience import Backoff, RETRY_ERRORS
+from .tracing import Tracer, child_traceparent
 Client = TypedDict('Client', redis=Connection)
 
+# attempts to ack and publish the response while the connection is down
+ACK_ATTEMPTS = 10
+
+# most seconds between checks for nacked messages to deliver again, when a
+# consumer that retries messages has no claim_interval
+RETRY_CLAIM_INTERVAL = 1.0
+
+# seconds a message is kept from other consumers when it is neither acked,
+# nacked nor extended by its handler
+MAX_LEASE = 3600.0
+
+# most messages a lease renewal reads from the pending list or claims with
+# one command
+LEASE_CHUNK = 1000
+
+# seconds to wait for the reader of a streaming response to take more chunks
+CHUNK_TIMEOUT = 10.0
+
+# seconds between checks for more credit, growing to the cap, so waiting
+# senders don't hold on to connections of the shared pool
+CREDIT_POLL = 0.005
+CREDIT_POLL_CAP = 0.1
+
+# messages held per handler by serve() when they are handled in order
+ORDERED_BUFFER = 4
+
+# most messages in a batch, and milliseconds to wait for the first of them
+# and then for the batch to fill
+BATCH_SIZE = 100
+BATCH_WAIT = 50
+
+# the error a copy of a confirmed request gets when the response to the
+# first one is no longer known
+DUPLICATE_ERROR = "duplicate"
+
 @debugging
 class Consumer:  # pylint: disable=too-few-public-methods
     """
     Consumes messages from a stream
     """
 
+    __slots__ = (
+        "client",
+        "stream_name",
+        "group_name",
+        "consumer_name",
+        "latest_id",
+        "check_backlog",
+        "noack",
+        "min_idle_time",
+        "xread_timeout",
+        "backoff",
+        "tracer",
+        "claim_interval",
+        "next_claim",
+        "retry_backoff",
+        "max_deliveries",
+        "lease_interval",
+        "max_lease",
+        "in_flight",
+        "lease_task",
+        "dedup",
+        "dedup_prefix",
+        "stopping",
+        "read_result",
+    )
+
     client: Client
     stream_name: str
     group_name: str
     consumer_name: str
     latest_id: bytes
     check_backlog: bool
+    noack: bool
     min_idle_time: int
+    backoff: Backoff
+    tracer: Optional[Tracer]
+
+    claim_interval: Optional[float]
+    next_claim: float
+    retry_backoff: Optional[Backoff]
+    max_deliveries: Optional[int]
+
+    lease_interval: float
+    max_lease: Optional[float]
+    in_flight: Dict[str, float]
+    lease_task: Optional[asyncio.Task]
+
+    dedup: Optional[Deduplicator]
+    dedup_prefix: str
+
+    stopping: bool
+    read_result: Optional[asyncio.Future]
 
     log_debug: Callable[..., None]
 
@@ -38,6 +139,14 @@ class Consumer:  # pylint: disable=too-few-public-methods
         # scan_pending_on_start: bool = True,
         # claim_stale_messages: bool = True,
         min_idle_time: int = 60000,
+        tracer: Optional[Tracer] = None,
+        claim_interval: Optional[float] = None,
+        retry_backoff: Optional[Backoff] = None,
+        max_deliveries: Optional[int] = None,
+        lease_interval: Optional[float] = None,
+        max_lease: Optional[float] = MAX_LEASE,
+        noack: bool = False,
+        dedup: Optional[Deduplicator] = None,
     ) -> None:
         """
         default constructor
@@ -54,11 +163,66 @@ class Consumer:  # pylint: disable=too-few-public-methods
         # self.claim_stale_messages = claim_stale_messages
         self.min_idle_time = min_idle_time
 
+        # at-most-once delivery, messages are not added to the pending list
+        # so there is nothing to ack, claim or keep the lease on
+        self.noack = noack
+        if noack:
+            claim_interval = None
+            lease_interval = 0.0
+
         # by default just read new messages that haven't been delivered
         self.latest_id = b">"
         self.check_backlog = False
         self.xread_timeout = 10000  # milliseconds
 
+        # wait between attempts to read when the connection is down
+        self.backoff = Backoff()
+
+        # traced messages are passed to the tracer when they are acked
+        self.tracer = tracer
+
+        # every claim_interval seconds, claim the messages of the group that
+        # have been pending for min_idle_time, which includes nacked ones,
+        # None turns it off until a message is nacked, consumers that retry
+        # messages need it to get them back
+        if claim_interval is None and not noack:
+            if retry_backoff is not None:
+                claim_interval = min(RETRY_CLAIM_INTERVAL, retry_backoff.cap)
+            elif max_deliveries is not None:
+                claim_interval = RETRY_CLAIM_INTERVAL
+        self.claim_interval = claim_interval
+        self.next_claim = 0.0
+
+        # the delay before a nacked message is delivered again and the number
+        # of deliveries before it is given up
+        self.retry_backoff = retry_backoff
+        self.max_deliveries = max_deliveries
+
+        # the messages being handled are claimed again every lease_interval
+        # seconds so they don't look idle to other consumers, the default is
+        # a third of min_idle_time and zero turns it off, for up to max_lease
+        # seconds after they are read or extended
+        if lease_interval is None:
+            lease_interval = min_idle_time / 3000.0
+        self.lease_interval = lease_interval
+        self.max_lease = max_lease
+        # message ID -> when the lease is given up
+        self.in_flight = {}
+        self.lease_task = None
+
+        # messages with the idempotency key of one the group has handled are
+        # acked and skipped
+        self.dedup = dedup
+        self.dedup_prefix = "%s:dedup:%s:%s" % (
+            client.namespace,
+            stream_name,
+            group_name,
+        )
+
+        # set by stop() to end serve()
+        self.stopping = False
+        self.read_result = None
+
     def read(self) -> PayloadFuture:
         """
         Read a message from the stream.
@@ -81,6 +245,449 @@ class Consumer:  # pylint: disable=too-few-public-methods
 
         return read_result
 
+    async def serve(
+        self,
+        handler: Callable[[Payload], Any],
+        concurrency: int = 1,
+        ordered: bool = False,
+        buffer: Optional[int] = None,
+        limiter: Optional[AdaptiveLimiter] = None,
+    ) -> None:
+        """
+        Read messages and pass them to the handler (a function or coroutine
+        function), up to concurrency at a time, until stop() is called.  The
+        message is acked with what the handler returns unless the handler
+        acked or nacked it.  When the handler raises an exception the message
+        is nacked if there is a retry_backoff, otherwise it is acked with the
+        error.  The running handlers are finished before this returns.
+
+        When ordered, messages with the same ordering key are handled one at
+        a time in the order they were read, and a failed message is retried
+        in place so the ones after it wait.  No more than buffer messages
+        (default ORDERED_BUFFER per handler) are read ahead and held.  The
+        order is only kept within this call, not across consumers or for
+        messages nacked or claimed back from the pending list.
+
+        With a limiter, the number of handlers running at once is adapted to
+        their latency and errors instead of being concurrency, and buffer
+        is based on its max_limit.
+        """
+        Consumer.log_debug("serve(%s) %r %r", self.consumer_name, handler, concurrency)
+        if concurrency < 1:
+            raise ValueError("concurrency must be positive")
+        if limiter is not None:
+            concurrency = limiter.min_limit
+        if buffer is None:
+            buffer = concurrency if limiter is None else limiter.max_limit
+            if ordered:
+                buffer *= ORDERED_BUFFER
+        if buffer < concurrency:
+            raise ValueError("buffer must be at least concurrency")
+
+        self.stopping = False
+        slots = asyncio.Semaphore(buffer)
+        workers: Union[asyncio.Semaphore, AdaptiveLimiter] = (
+            limiter if limiter is not None else asyncio.Semaphore(concurrency)
+        )
+        queues: Dict[str, Deque[Payload]] = {}
+        running: Set[asyncio.Future] = set()
+        try:
+            while not self.stopping:
+                await slots.acquire()
+                self.read_result = self.read()
+                try:
+                    payload = await self.read_result
+                except asyncio.CancelledError:
+                    slots.release()
+                    if self.stopping:
+                        break
+                    raise
+                finally:
+                    self.read_result = None
+                if payload.done:
+                    # it could not be decoded
+                    slots.release()
+                    continue
+
+                key = payload.ordering_key if ordered else None
+                if key is None:
+                    task = asyncio.ensure_future(
+                        self._handle(handler, payload, workers)
+                    )
+                    task.add_done_callback(lambda _: slots.release())
+                elif key in queues:
+                    # a message with the same key is being handled
+                    queues[key].append(payload)
+                    continue
+                else:
+                    queues[key] = deque()
+                    task = asyncio.ensure_future(
+                        self._handle_key(handler, payload, workers, slots, queues)
+                    )
+                running.add(task)
+                task.add_done_callback(running.discard)
+        finally:
+            if running:
+                Consumer.log_debug("    - finishing %d handlers", len(running))
+                await asyncio.gather(*running, return_exceptions=True)
+        Consumer.log_debug("    - stopped")
+
+    async def _handle_key(
+        self,
+        handler: Callable[[Payload], Any],
+        payload: Payload,
+        workers: Union[asyncio.Semaphore, AdaptiveLimiter],
+        slots: asyncio.Semaphore,
+        queues: Dict[str, Deque[Payload]],
+    ) -> None:
+        """
+        Handle the messages with the ordering key of the payload one after
+        another for serve(), including the ones queued while they run.  When
+        this ends early, the queued messages are nacked and their slots are
+        released.
+        """
+        key = payload.ordering_key
+        assert key is not None
+        queue = queues[key]
+        try:
+            while True:
+                try:
+                    await self._handle(handler, payload, workers, ordered=True)
+                finally:
+                    slots.release()
+                if not queue:
+                    break
+                payload = queue.popleft()
+        finally:
+            del queues[key]
+            if queue:
+                Consumer.log_debug("    - giving back %d queued", len(queue))
+                left = list(queue)
+                queue.clear()
+                try:
+                    if self.noack:
+                        for queued in left:
+                            queued._forget()  # pylint: disable=protected-access
+                    else:
+                        await self.nack_batch(left, [None] * len(left))
+                except Exception as err:  # pylint: disable=broad-except
+                    Consumer.log_debug("    - nack exception: %r", err)
+                finally:
+                    for _ in left:
+                        slots.release()
+
+    async def _handle(
+        self,
+        handler: Callable[[Payload], Any],
+        payload: Payload,
+        workers: Union[asyncio.Semaphore, AdaptiveLimiter],
+        ordered: bool = False,
+    ) -> None:
+        """
+        Run the handler for serve() and ack or nack the message, or retry it
+        in place when it is handled in order.  An adaptive limiter is told
+        how long it took and whether it failed.
+        """
+        await workers.acquire()
+        start = time.monotonic()
+        succeeded = False
+        try:
+            succeeded = await self._run_handler(handler, payload, ordered)
+        except Exception as err:  # pylint: disable=broad-except
+            Consumer.log_debug("    - ack exception: %r", err)
+        finally:
+            if isinstance(workers, AdaptiveLimiter):
+                workers.release(time.monotonic() - start, not succeeded)
+            else:
+                workers.release()
+
+    async def _run_handler(
+        self, handler: Callable[[Payload], Any], payload: Payload, ordered: bool
+    ) -> bool:
+        """
+        Call the handler, retrying in place when ordered, and ack the result.
+        Returns False when the handler failed.
+        """
+        if payload.cancelled:
+            Consumer.log_debug("    - cancelled before it started")
+            await payload.ack(error="cancelled")
+            return True
+        task = payload.task = asyncio.current_task()
+        payload.start()
+        attempts = 0
+        delay: Optional[float] = None
+        while True:
+            try:
+                if delay is not None:
+                    # nacking would let the next message of the key go first
+                    await asyncio.sleep(delay)
+                rslt = handler(payload)
+                if inspect.isawaitable(rslt):
+                    rslt = await rslt
+                break
+            except asyncio.CancelledError:
+                if not payload.cancelled:
+                    raise
+                Consumer.log_debug("    - cancelled by the producer")
+                # the task goes on to the next message of its key
+                if hasattr(task, "uncancel"):
+                    task.uncancel()  # type: ignore[union-attr]
+                if not payload.done:
+                    await payload.ack(error="cancelled")
+                return True
+            except Exception as err:  # pylint: disable=broad-except
+                Consumer.log_debug("    - handler exception: %r", err)
+                if payload.done:
+                    return False
+                attempts += 1
+                if self.retry_backoff is None or (
+                    ordered
+                    and self.max_deliveries is not None
+                    and attempts >= self.max_deliveries
+                ):
+                    await payload.ack(error=str(err))
+                    return False
+                if not ordered:
+                    await payload.nack()
+                    return False
+                delay = self.retry_backoff.delay(attempts - 1)
+        if not payload.done:
+            await payload.ack(rslt)
+        return True
+
+    async def serve_batch(
+        self,
+        handler: Callable[[List[Payload]], Any],
+        max_batch: int = BATCH_SIZE,
+        max_wait_ms: int = BATCH_WAIT,
+    ) -> None:
+        """
+        Read batches of up to max_batch messages and pass each list to the
+        handler (a function or coroutine function), until stop() is called.
+        A batch is handed over when it is full or max_wait_ms after its
+        first message was read.
+        The handler returns a list with a result for each payload, or an
+        exception for the ones that failed, and the batch is acked in one
+        pipeline.  When the handler raises an exception, or returns one for a
+        payload, the payloads are nacked if there is a retry_backoff,
+        otherwise they are acked with the error.
+        """
+        Consumer.log_debug(
+            "serve_batch(%s) %r %r", self.consumer_name, handler, max_batch
+        )
+        if max_batch < 1:
+            raise ValueError("max_batch must be positive")
+
+        self.stopping = False
+        while not self.stopping:
+            self.read_result = asyncio.ensure_future(
+                self.read_batch(max_batch, max_wait_ms)
+            )
+            try:
+                payloads = await self.read_result
+            except asyncio.CancelledError:
+                if self.stopping:
+                    break
+                raise
+            finally:
+                self.read_result = None
+            # leave out the ones that could not be decoded
+            payloads = [payload for payload in payloads if not payload.done]
+            if not payloads:
+                continue
+
+            for payload in payloads:
+                payload.start()
+            try:
+                results = handler(payloads)
+                if inspect.isawaitable(results):
+                    results = await results
+                if len(results) != len(payloads):
+                    raise ValueError(
+                        "%d results for %d messages" % (len(results), len(payloads))
+                    )
+            except Exception as err:  # pylint: disable=broad-except
+                Consumer.log_debug("    - handler exception: %r", err)
+                results = [err] * len(payloads)
+
+            try:
+                if self.retry_backoff is not None:
+                    failed = [
+                        (payload, result)
+                        for payload, result in zip(payloads, results)
+                        if isinstance(result, Exception)
+                    ]
+                    if failed:
+                        await self.nack_batch(
+                            [payload for payload, _ in failed],
+                            [result for _, result in failed],
+                        )
+                # the nacked ones are done and left out
+                await self.ack_batch(payloads, results)
+            except Exception as err:  # pylint: disable=broad-except
+                Consumer.log_debug("    - ack exception: %r", err)
+        Consumer.log_debug("    - stopped")
+
+    async def ack_batch(self, payloads: List[Payload], results: List[Any]) -> None:
+        """
+        Ack the payloads that are not done in one call and publish their
+        responses in the same pipeline, a result that is an exception is sent
+        as the error.
+        """
+        Consumer.log_debug("ack_batch(%s) %d", self.consumer_name, len(payloads))
+        acked = []
+        for payload, result in zip(payloads, results):
+            if payload.done:
+                continue
+            payload._forget()  # pylint: disable=protected-access
+            if payload.trace is not None:
+                payload.trace["timeline"]["handler_end"] = time.time()
+            acked.append((payload, result))
+
+        msg_ids = [payload.msg_id for payload, _ in acked]
+        responses = {}
+        for payload, result in acked:
+            if payload.response_channel is None:
+                continue
+            if isinstance(result, Exception):
+                responses[payload] = payload.response(error=str(result))
+            else:
+                responses[payload] = payload.response(result)
+
+        backoff = Backoff()
+        if self.dedup is not None:
+            handled = {
+                payload.idempotency_key: payload
+                for payload, result in acked
+                if payload.idempotency_key is not None
+                and not isinstance(result, Exception)
+            }
+            await backoff.call(
+                self.dedup.add,
+                self.client.redis,
+                self.dedup_prefix,
+                handled,
+                {
+                    key: responses[payload]
+                    for key, payload in handled.items()
+                    if payload in responses
+                },
+                max_attempts=ACK_ATTEMPTS,
+            )
+
+        async def _execute() -> List[Any]:
+            # a pipeline is emptied when it is executed, even when it fails
+            pipe = self.client.redis.pipeline(transaction=False)
+            if msg_ids and not self.noack:
+                pipe.xack(self.stream_name, self.group_name, *msg_ids)
+            for payload, response in responses.items():
+                pipe.publish(payload.response_channel, response)
+            return await pipe.execute()
+
+        await backoff.call(_execute, max_attempts=ACK_ATTEMPTS)
+        Consumer.log_debug("    - acked %d", len(acked))
+
+        if self.tracer is not None:
+            for payload, _ in acked:
+                if payload.trace is not None:
+                    self.tracer.finish(payload.trace)
+
+    async def nack_batch(self, payloads: List[Payload], errors: List[Any]) -> None:
+        """
+        Nack the payloads that are not done, each delivered again after the
+        delay the retry_backoff gives for its number of deliveries (right
+        away without one), in two pipelines.  The ones that have been
+        delivered max_deliveries times are acked with their errors instead.
+        """
+        Consumer.log_debug("nack_batch(%s) %d", self.consumer_name, len(payloads))
+        if self.noack:
+            raise RuntimeError("noack consumers can't nack messages")
+        failed = [
+            (payload, error)
+            for payload, error in zip(payloads, errors)
+            if not payload.done
+        ]
+        if not failed:
+            return
+
+        redis = self.client.redis
+        backoff = Backoff()
+
+        async def _delivery_counts() -> List[Any]:
+            pipe = redis.pipeline(transaction=False)
+            for payload, _ in failed:
+                pipe.xpending_range(
+                    self.stream_name,
+                    self.group_name,
+                    min=payload.msg_id,
+                    max=payload.msg_id,
+                    count=1,
+                )
+            return await pipe.execute()
+
+        pending = await backoff.call(_delivery_counts, max_attempts=ACK_ATTEMPTS)
+        given_up: List[Tuple[Payload, Any]] = []
+        retried: List[Tuple[Payload, float]] = []
+        for (payload, error), info in zip(failed, pending):
+            deliveries = info[0]["times_delivered"] if info else 0
+            if self.max_deliveries is not None and deliveries >= self.max_deliveries:
+                if not isinstance(error, Exception):
+                    error = RuntimeError(
+                        error or "delivered %d times" % (deliveries,)
+                    )
+                given_up.append((payload, error))
+                continue
+            delay = 0.0
+            if self.retry_backoff is not None:
+                delay = self.retry_backoff.delay(max(0, deliveries - 1))
+            retried.append((payload, delay))
+
+        if given_up:
+            await self.ack_batch(
+                [payload for payload, _ in given_up], [error for _, error in given_up]
+            )
+        if not retried:
+            return
+
+        # make the messages look like they have been idle long enough to be
+        # claimed when their delays are over, as in Payload.nack()
+        for payload, _ in retried:
+            payload._forget()  # pylint: disable=protected-access
+
+        async def _execute() -> List[Any]:
+            pipe = redis.pipeline(transaction=False)
+            for payload, delay in retried:
+                pipe.xclaim(
+                    self.stream_name,
+                    self.group_name,
+                    self.consumer_name,
+                    0,
+                    [payload.msg_id],
+                    idle=max(0, self.min_idle_time - int(delay * 1000) + 1),
+                    justid=True,
+                )
+            return await pipe.execute()
+
+        await backoff.call(_execute, max_attempts=ACK_ATTEMPTS)
+        Consumer.log_debug("    - nacked %d", len(retried))
+
+        # look for them again when the first is ready
+        ready = time.monotonic() + min(delay for _, delay in retried)
+        if self.claim_interval is None:
+            self.claim_interval = RETRY_CLAIM_INTERVAL
+            self.next_claim = ready
+        else:
+            self.next_claim = min(self.next_claim, ready)
+
+    def stop(self) -> None:
+        """
+        Stop serve() from reading more messages.
+        """
+        Consumer.log_debug("stop(%s)", self.consumer_name)
+        self.stopping = True
+        if self.read_result is not None and not self.read_result.done():
+            self.read_result.cancel()
+
     def _get_message_task_callback(self, *args):
         """
         Callback function for getting a message from the stream, used for
@@ -113,56 +720,340 @@ class Consumer:  # pylint: disable=too-few-public-methods
         """
         Consumer.log_debug("get_message(%s) %r", self.consumer_name, read_result)
 
-        while True:
-            # if we are checking the backlog, get the next message otherwise
-            # get the next one that hasn't been delivered to antoher consumer
-            if self.check_backlog:
-                latest_id = self.latest_id
+        payloads: List[Payload] = []
+        while not payloads:
+            element_list = await self._read_entries(1, self._block_time())
+            # build a Payload wrapper around the message
+            payloads = await self._skip_duplicates(self._payloads(element_list))
+        payload = payloads[0]
+        Consumer.log_debug("    - payload: %r", payload)
+
+        # return this payload back to the application
+        read_result.set_result(payload)
+
+    async def _read_entries(self, count: int, block: int) -> List[Any]:
+        """
+        Make one attempt at reading up to count entries, waiting up to block
+        milliseconds for new ones, and return them (none after a timeout or
+        a connection error).
+        """
+        # messages that are ready to be delivered again come first
+        if self.claim_interval is not None and not self.check_backlog:
+            element_list = await self._autoclaim(count)
+            if element_list:
+                return element_list
+
+        # if we are checking the backlog, get the next message otherwise
+        # get the next one that hasn't been delivered to antoher consumer
+        if self.check_backlog:
+            latest_id = self.latest_id
+        else:
+            latest_id = b">"
+        Consumer.log_debug("    - latest_id: %r", latest_id)
+
+        args = {
+            "groupname": self.group_name,
+            "consumername": self.consumer_name,
+            "count": count,
+            "block": block,
+            "streams": {self.stream_name: latest_id},
+        }
+        if self.noack:
+            args["noack"] = True
+        messages = None
+        try:
+            messages = await self.client.redis.xreadgroup(**args)
+            Consumer.log_debug("    - messages: %r", messages)
+        except Exception as err:
+            Consumer.log_debug("    - xreadgroup exception: %r", err)
+            if isinstance(err, RETRY_ERRORS):
+                self.client.connection_lost(err)
+            await self.backoff.wait()
+            return []
+
+        if self.backoff.attempts:
+            self.backoff.reset()
+            self.client.connection_restored()
+
+        if not messages:
+            Consumer.log_debug("    - timeout")
+            return []
+
+        # no more messages means we have completely consumed the backlog
+        _, element_list = messages[0]
+        if not element_list:
+            self.check_backlog = False
+        return list(element_list)
+
+    def _payloads(self, element_list: List[Any]) -> List[Payload]:
+        """
+        Wrap the entries that were read in payloads.
+        """
+        payloads = []
+        for msg_id, fields in element_list:
+            # the fields are only read, so the reply isn't copied
+            Consumer.log_debug("    - id %s, fields %s", msg_id, fields)
+
+            # save the message ID so the next time this is entered it gets
+            # the next message in the backlog
+            self.latest_id = msg_id
+            payloads.append(Payload(self, msg_id, fields))
+        return payloads
+
+    async def read_batch(
+        self, max_batch: int = BATCH_SIZE, max_wait_ms: int = BATCH_WAIT
+    ) -> List[Payload]:
+        """
+        Read up to max_batch messages, waiting up to max_wait_ms for the
+        first of them, the list is empty when none came.  Once some are
+        read, more are read until there are max_batch of them or max_wait_ms
+        have passed since the first.
+        """
+        Consumer.log_debug("read_batch(%s) %r", self.consumer_name, max_batch)
+        element_list = await self._read_entries(
+            max_batch, min(max_wait_ms, self._block_time())
+        )
+        payloads = self._payloads(element_list)
+        if payloads:
+            deadline = time.monotonic() + max_wait_ms / 1000.0
+            while len(payloads) < max_batch:
+                wait = int((deadline - time.monotonic()) * 1000)
+                if wait <= 0:
+                    break
+                element_list = await self._read_entries(
+                    max_batch - len(payloads), min(wait, self._block_time())
+                )
+                payloads += self._payloads(element_list)
+        return await self._skip_duplicates(payloads)
+
+    async def _skip_duplicates(self, payloads: List[Payload]) -> List[Payload]:
+        """
+        Ack the payloads with the idempotency key of a message that has been
+        handled and return the others.  When the keys can't be checked the
+        messages are handled, rather than lost.
+        """
+        if self.dedup is None:
+            return payloads
+        keys = [
+            payload.idempotency_key
+            for payload in payloads
+            if payload.idempotency_key is not None and not payload.done
+        ]
+        if not keys:
+            return payloads
+        try:
+            seen = await self.dedup.seen(self.client.redis, self.dedup_prefix, keys)
+        except RETRY_ERRORS as err:
+            Consumer.log_debug("    - dedup exception: %r", err)
+            return payloads
+        if not seen:
+            return payloads
+
+        fresh = []
+        duplicates = []
+        for payload in payloads:
+            if not payload.done and payload.idempotency_key in seen:
+                payload._forget()  # pylint: disable=protected-access
+                duplicates.append(payload)
             else:
-                latest_id = b">"
-            Consumer.log_debug("    - latest_id: %r", latest_id)
-
-            args = {
-                "groupname": self.group_name,
-                "consumername": self.consumer_name,
-                "count": 1,
-                "block": self.xread_timeout,
-                "streams": {self.stream_name: latest_id},
-            }
-            messages = None
+                fresh.append(payload)
+        Consumer.log_debug("    - duplicates: %r", duplicates)
+
+        # a copy of a confirmed request is answered with the response to the
+        # first one, or with an error when it is no longer known
+        backoff = Backoff()
+        responses: Dict[str, str] = {}
+        confirmed = [
+            payload.idempotency_key
+            for payload in duplicates
+            if payload.response_channel is not None
+        ]
+        if confirmed:
             try:
-                messages = await self.client.redis.xreadgroup(**args)
-                Consumer.log_debug("    - messages: %r", messages)
-            except Exception as err:
-                Consumer.log_debug("    - xreadgroup exception: %r", err)
+                responses = await self.dedup.responses(
+                    self.client.redis, self.dedup_prefix, confirmed
+                )
+            except RETRY_ERRORS as err:
+                Consumer.log_debug("    - dedup responses exception: %r", err)
 
-            if not messages:
-                Consumer.log_debug("    - timeout")
-                continue
+        async def _execute() -> List[Any]:
+            pipe = self.client.redis.pipeline(transaction=False)
+            if not self.noack:
+                pipe.xack(
+                    self.stream_name,
+                    self.group_name,
+                    *[payload.msg_id for payload in duplicates],
+                )
+            for payload in duplicates:
+                if payload.response_channel is None:
+                    continue
+                response = responses.get(payload.idempotency_key, None)
+                if response is None:
+                    response = payload.response(error=DUPLICATE_ERROR)
+                pipe.publish(payload.response_channel, response)
+            return await pipe.execute()
 
-            # no more messages means we have completely consumed the backlog
-            stream, element_list = messages[0]
-            if not element_list:
-                self.check_backlog = False
-            else:
+        await backoff.call(_execute, max_attempts=ACK_ATTEMPTS)
+        return fresh
+
+    def track(self, payload: Payload) -> None:
+        """
+        Keep the lease on a message until it is acked or nacked, or for
+        max_lease seconds.
+        """
+        if self.lease_interval <= 0:
+            return
+        if self.max_lease is None:
+            self.in_flight[payload.msg_id] = float("inf")
+        else:
+            self.in_flight[payload.msg_id] = time.monotonic() + self.max_lease
+        if self.lease_task is None or self.lease_task.done():
+            self.lease_task = asyncio.ensure_future(self.renew_leases())
+
+    def untrack(self, payload: Payload) -> None:
+        """
+        Stop keeping the lease on a message.
+        """
+        self.in_flight.pop(payload.msg_id, None)
+
+    async def renew_leases(self) -> None:
+        """
+        Every lease_interval seconds, renew the leases on the messages being
+        handled, until there are none.  Messages held for longer than
+        max_lease are given up, so they can be claimed by other consumers.
+        """
+        Consumer.log_debug("renew_leases(%s)", self.consumer_name)
+        while self.in_flight:
+            await asyncio.sleep(self.lease_interval)
+            now = time.monotonic()
+            for msg_id, expires in list(self.in_flight.items()):
+                if expires <= now:
+                    Consumer.log_debug("    - lease expired: %r", msg_id)
+                    del self.in_flight[msg_id]
+            msg_ids = list(self.in_flight)
+            if not msg_ids:
                 break
+            try:
+                claimed = await self.renew(msg_ids)
+            except Exception as err:  # pylint: disable=broad-except
+                Consumer.log_debug("    - renew exception: %r", err)
+                continue
+            Consumer.log_debug("    - renewed %r of %r", claimed, msg_ids)
+        Consumer.log_debug("    - no messages in flight")
 
-        msg_id, payload = element_list[0]
-        payload_dict = dict(payload)
-        Consumer.log_debug(
-            "    - stream %s, id %s, payload_dict %s", stream, msg_id, payload_dict
+    async def renew(self, msg_ids: List[str]) -> List[str]:
+        """
+        Reset the idle time of the messages that are still pending for this
+        consumer and return their IDs, the others are no longer in flight.
+        The pending list of the consumer is read and the messages claimed
+        LEASE_CHUNK at a time.  Messages delivered in the last half
+        lease_interval don't need it yet and are skipped, and the others are
+        only claimed if they are still as idle, so one that another consumer
+        claims in between is not taken back.
+        """
+        if not msg_ids:
+            return []
+        redis = self.client.redis
+        wanted = set(msg_ids)
+        ordered_ids = sorted(
+            wanted, key=lambda msg_id: tuple(map(int, msg_id.split("-")))
         )
+        start, end = ordered_ids[0], ordered_ids[-1]
 
-        # save the message ID so the next time this is entered it gets the
-        # next message in the backlog
-        self.latest_id = msg_id
+        # the messages in the range that are still pending for this consumer
+        owned: Dict[str, int] = {}
+        while True:
+            pending = await redis.xpending_range(
+                self.stream_name,
+                self.group_name,
+                min=start,
+                max=end,
+                count=LEASE_CHUNK,
+                consumername=self.consumer_name,
+            )
+            for info in pending:
+                if info["message_id"] in wanted:
+                    owned[info["message_id"]] = info["time_since_delivered"]
+            if len(pending) < LEASE_CHUNK or pending[-1]["message_id"] == end:
+                break
+            start = next_id(pending[-1]["message_id"])
+        for msg_id in wanted.difference(owned):
+            self.in_flight.pop(msg_id, None)
 
-        # build a Payload wrapper around the message
-        payload = Payload(self, msg_id, payload_dict)
-        Consumer.log_debug("    - payload: %r", payload)
+        fresh = int(self.lease_interval * 500)
+        stale = [msg_id for msg_id, idle in owned.items() if idle >= fresh]
+        if not stale:
+            return list(owned)
+        pipe = redis.pipeline(transaction=False)
+        for i in range(0, len(stale), LEASE_CHUNK):
+            chunk = stale[i : i + LEASE_CHUNK]
+            pipe.xclaim(
+                self.stream_name,
+                self.group_name,
+                self.consumer_name,
+                min(owned[msg_id] for msg_id in chunk),
+                chunk,
+                justid=True,
+            )
+        claimed = set()
+        for rslt in await pipe.execute():
+            claimed.update(rslt)
+        for msg_id in stale:
+            if msg_id not in claimed:
+                del owned[msg_id]
+                self.in_flight.pop(msg_id, None)
+        return list(owned)
 
-        # return this payload back to the application
-        read_result.set_result(payload)
+    def _block_time(self) -> int:
+        """
+        Return the milliseconds to wait for new messages, no longer than
+        the next check for messages to claim.
+        """
+        if self.claim_interval is None or self.check_backlog:
+            return self.xread_timeout
+        wait = self.next_claim - time.monotonic()
+        return max(1, min(self.xread_timeout, int(wait * 1000)))
+
+    async def _autoclaim(self, count: int) -> List[Any]:
+        """
+        Claim up to count messages that have been pending for min_idle_time,
+        when it is time to check.  The server finds them in the whole
+        pending list, and they are claimed only if they are still idle.
+        """
+        now = time.monotonic()
+        if now < self.next_claim:
+            return []
+
+        redis = self.client.redis
+        try:
+            pending = await redis.xpending_range(
+                self.stream_name,
+                self.group_name,
+                min="-",
+                max="+",
+                count=count,
+                idle=self.min_idle_time,
+            )
+            if not pending:
+                # nothing is ready, look again in claim_interval
+                self.next_claim = now + self.claim_interval
+                return []
+            messages = await redis.xclaim(
+                self.stream_name,
+                self.group_name,
+                self.consumer_name,
+                self.min_idle_time,
+                [info["message_id"] for info in pending],
+            )
+        except Exception as err:  # pylint: disable=broad-except
+            # reading will fail too, and wait for the connection
+            Consumer.log_debug("    - autoclaim exception: %r", err)
+            self.next_claim = now + self.claim_interval
+            return []
+        Consumer.log_debug("    - claimed: %r", messages)
+
+        # deleted messages are skipped, older servers return them as None
+        return [entry for entry in messages if entry and entry[1]]
 
 
 @debugging
@@ -172,10 +1063,41 @@ class Payload:
     function.
     """
 
+    # there can be tens of thousands of these in flight, so they have no
+    # __dict__
+    __slots__ = (
+        "consumer",
+        "msg_id",
+        "response_channel",
+        "ordering_key",
+        "idempotency_key",
+        "deadline",
+        "message",
+        "trace",
+        "done",
+        "window",
+        "credit",
+        "reader_gone",
+        "cancelled",
+        "task",
+    )
+
     consumer: Consumer
     msg_id: str
     response_channel: Optional[str]
+    ordering_key: Optional[str]
+    idempotency_key: Optional[str]
+    deadline: Optional[float]
     message: Dict[str, Any]
+    trace: Optional[Dict[str, Any]]
+    done: bool
+
+    window: int
+    credit: int
+    reader_gone: bool
+
+    cancelled: bool
+    task: Optional[asyncio.Future]
 
     log_debug: Callable[..., None]
 
@@ -183,14 +1105,49 @@ class Payload:
         self, consumer: Consumer, msg_id: str, payload_dict: Dict[str, Any]
     ) -> None:
         Payload.log_debug("__init__ %r %r", msg_id, payload_dict)
+        try:
+            payload_dict = envelope.expand(payload_dict, consumer.client.namespace)
+        except ValueError as err:
+            Payload.log_debug("    - unable to read the envelope: %r", err)
+            payload_dict = {}
 
         self.consumer = consumer
         self.msg_id = msg_id
+        self.done = False
         self.response_channel = payload_dict.get("response_channel", None)
+        self.ordering_key = payload_dict.get("key", None)
+
+        # copies of the same message, sent again by the producer, share a key
+        self.idempotency_key = payload_dict.get("idempotency_key", None)
+
+        # when the producer stops waiting for the response, if it said
+        self.deadline = payload_dict.get("deadline", None)
+
+        # a streaming response can be window chunks ahead of the reader
+        self.window = int(payload_dict.get("window", 0) or 0)
+        self.credit = self.window
+        self.reader_gone = False
+
+        # set when the producer stops waiting for the response, and the task
+        # handling the message that is cancelled then
+        self.cancelled = False
+        self.task = None
+        if self.response_channel is not None:
+            self.cancelled = consumer.client.track_request(self)
+
+        # continue the trace of a sampled message in a new span
+        self.trace = Tracer.decode(payload_dict.get("trace", None))
+        if self.trace is not None:
+            self.trace["traceparent"] = child_traceparent(self.trace["traceparent"])
+            self.trace["timeline"]["delivered"] = time.time()
+
         try:
             self.message = json.loads(payload_dict["message"])
-        except json.decoder.JSONDecodeError:
+        except (KeyError, json.decoder.JSONDecodeError):
             Payload.log_debug("    - unable to decode message, log this event")
+            self._forget()
+            if consumer.noack:
+                return
             asyncio.ensure_future(
                 self.consumer.client.redis.xack(
                     self.consumer.stream_name, self.consumer.group_name, self.msg_id
@@ -198,27 +1155,263 @@ class Payload:
             )
             return
 
-    async def ack(self, response: Any = None, error: Any = None) -> None:
+        consumer.track(self)
+
+    @property
+    def traceparent(self) -> Optional[str]:
+        """
+        The traceparent of this delivery when the message is traced, for
+        joining the work of the handler to the trace.
+        """
+        return self.trace["traceparent"] if self.trace is not None else None
+
+    def start(self) -> None:
+        """
+        Note the time the handler started working on the message, when it
+        is traced.
+        """
+        if self.trace is not None:
+            self.trace["timeline"]["handler_start"] = time.time()
+
+    def cancel(self) -> None:
+        """
+        Called when the producer no longer wants the response, cancels the
+        task handling the message if there is one.
+        """
+        Payload.log_debug("cancel %r", self.msg_id)
+        self.cancelled = True
+        if self.done:
+            # too late, it is being acked
+            return
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
+    def _forget(self) -> None:
+        """
+        Stop tracking the message once it is acked or nacked.
+        """
+        self.done = True
+        self.consumer.untrack(self)
+        if self.response_channel is not None:
+            self.consumer.client.untrack_request(self)
+
+    async def send_chunk(self, chunk: Any) -> bool:
+        """
+        Publishes part of the response to a streaming request, waiting while
+        the reader is window chunks behind.  Finish with ack(), the response
+        passed to it is the last chunk when it is not None.  Returns False
+        without sending the chunk when the reader has gone away, or when
+        there is no response channel.
+        """
+        Payload.log_debug("send_chunk %r", chunk)
+        if self.response_channel is None or self.reader_gone or self.cancelled:
+            return False
+
+        redis = self.consumer.client.redis
+        while self.window and self.credit <= 0:
+            credit = await self._wait_for_credit()
+            Payload.log_debug("    - credit: %r", credit)
+            if credit is None or credit <= 0:
+                self.reader_gone = True
+                return False
+            self.credit += credit
+
+        await Backoff().call(
+            redis.publish,
+            self.response_channel,
+            json.dumps({"chunk": chunk}),
+            max_attempts=ACK_ATTEMPTS,
+        )
+        self.credit -= 1
+        return True
+
+    async def _wait_for_credit(self) -> Optional[int]:
+        """
+        Return the credit the reader gives next, None when none comes for
+        CHUNK_TIMEOUT seconds.  The credit list is polled rather than
+        blocked on, which would take a connection for as long as it waits.
+        """
+        redis = self.consumer.client.redis
+        credit_key = "%s:credit" % (self.response_channel,)
+        poll = Backoff(base=CREDIT_POLL, cap=CREDIT_POLL_CAP, jitter=False)
+        deadline = time.monotonic() + CHUNK_TIMEOUT
+        while True:
+            credit = await redis.lpop(credit_key)
+            if credit is not None:
+                return int(credit)
+            if time.monotonic() >= deadline:
+                return None
+            await poll.wait()
+
+    async def delivery_count(self) -> int:
+        """
+        Return the number of times this message has been delivered, zero
+        when it is no longer pending.
+        """
+        pending = await self.consumer.client.redis.xpending_range(
+            self.consumer.stream_name,
+            self.consumer.group_name,
+            min=self.msg_id,
+            max=self.msg_id,
+            count=1,
+        )
+        Payload.log_debug("    - xpending_range: %r", pending)
+        return pending[0]["times_delivered"] if pending else 0
+
+    async def extend(self) -> bool:
+        """
+        Reset the idle time of the message so it isn't claimed by another
+        consumer, and start its max_lease over.  Returns False when it is no
+        longer pending for this consumer, it has been acked or claimed by
+        another one.
+        """
+        Payload.log_debug("extend %r", self.msg_id)
+        if not await self.consumer.renew([self.msg_id]):
+            return False
+        if self.msg_id in self.consumer.in_flight:
+            self.consumer.track(self)
+        return True
+
+    async def nack(self, delay: Optional[float] = None, error: Any = None) -> bool:
+        """
+        Hands the message back to the group to be delivered again to this or
+        any other consumer after delay seconds, no longer than the
+        min_idle_time of the consumer.  Without a delay the retry_backoff of
+        the consumer decides from the number of deliveries, otherwise it is
+        right away.  Once it has been delivered max_deliveries times it is
+        acked with the error instead, and this returns False.  A consumer
+        without a claim_interval starts checking for messages to claim every
+        RETRY_CLAIM_INTERVAL seconds.
+        """
+        Payload.log_debug("nack delay=%r error=%r", delay, error)
+        consumer = self.consumer
+        if consumer.noack:
+            raise RuntimeError("noack consumers can't nack messages")
+
+        if consumer.max_deliveries is not None or (
+            delay is None and consumer.retry_backoff is not None
+        ):
+            deliveries = await self.delivery_count()
+            Payload.log_debug("    - deliveries: %r", deliveries)
+            if consumer.max_deliveries is not None:
+                if deliveries >= consumer.max_deliveries:
+                    if error is None:
+                        error = "delivered %d times" % (deliveries,)
+                    await self.ack(error=error)
+                    return False
+            if delay is None and consumer.retry_backoff is not None:
+                delay = consumer.retry_backoff.delay(max(0, deliveries - 1))
+        if delay is None:
+            delay = 0.0
+        self._forget()
+
+        # make the message look like it has been idle long enough to be
+        # claimed when the delay is over, a millisecond early so the server
+        # rounding its idle time down doesn't leave it for another interval
+        idle = max(0, consumer.min_idle_time - int(delay * 1000) + 1)
+        backoff = Backoff()
+        await backoff.call(
+            consumer.client.redis.xclaim,
+            consumer.stream_name,
+            consumer.group_name,
+            consumer.consumer_name,
+            0,
+            [self.msg_id],
+            idle=idle,
+            justid=True,
+            max_attempts=ACK_ATTEMPTS,
+        )
+        Payload.log_debug("    - xclaim complete, idle %r", idle)
+
+        # look for it again when it is ready
+        ready = time.monotonic() + max(0.0, delay)
+        if consumer.claim_interval is None:
+            consumer.claim_interval = RETRY_CLAIM_INTERVAL
+            consumer.next_claim = ready
+        else:
+            consumer.next_claim = min(consumer.next_claim, ready)
+        return True
+
+    def response(
+        self,
+        response: Any = None,
+        error: Any = None,
+        cacheable: bool = False,
+        ttl: Optional[float] = None,
+    ) -> str:
+        """
+        Return the JSON encoded response to publish, with the trace when the
+        message is traced.
+        """
+        m_response = {"message": response, "error": error}
+        if cacheable and error is None:
+            m_response["cacheable"] = True
+            if ttl is not None:
+                m_response["ttl"] = ttl
+        if self.trace is not None:
+            self.trace["timeline"]["publish"] = time.time()
+            m_response["trace"] = self.trace
+        return json.dumps(m_response)
+
+    async def ack(
+        self,
+        response: Any = None,
+        error: Any = None,
+        cacheable: bool = False,
+        ttl: Optional[float] = None,
+    ) -> None:
         """
         Acks the message on the stream and publishes the response on the
-        responseChannel, if provided.
+        responseChannel, if provided.  A cacheable response may be reused by
+        producers with a cache for identical messages, for up to ttl seconds.
         """
-        Payload.log_debug("ack response=%r error=%r", response, error)
+        Payload.log_debug(
+            "ack response=%r error=%r cacheable=%r", response, error, cacheable
+        )
 
         Payload.log_debug("    - msg_id: %r", self.msg_id)
-        await self.consumer.client.redis.xack(
-            self.consumer.stream_name, self.consumer.group_name, self.msg_id
-        )
-        Payload.log_debug("    - xack complete")
+        self._forget()
+        if self.trace is not None:
+            self.trace["timeline"]["handler_end"] = time.time()
+
+        redis = self.consumer.client.redis
+        backoff = Backoff()
+        m_response = None
+        if self.response_channel is not None:
+            m_response = self.response(response, error, cacheable, ttl)
+        dedup = self.consumer.dedup
+        if dedup is not None and self.idempotency_key is not None and error is None:
+            await backoff.call(
+                dedup.add,
+                redis,
+                self.consumer.dedup_prefix,
+                [self.idempotency_key],
+                {self.idempotency_key: m_response} if m_response else None,
+                max_attempts=ACK_ATTEMPTS,
+            )
+        if not self.consumer.noack:
+            await backoff.call(
+                redis.xack,
+                self.consumer.stream_name,
+                self.consumer.group_name,
+                self.msg_id,
+                max_attempts=ACK_ATTEMPTS,
+            )
+            Payload.log_debug("    - xack complete")
 
         if self.response_channel is not None:
             Payload.log_debug("    - response channel: %r", self.response_channel)
-            m_response = {"message": response, "error": error}
-            await self.consumer.client.redis.publish(
-                self.response_channel, json.dumps(m_response)
+            await backoff.call(
+                redis.publish,
+                self.response_channel,
+                m_response,
+                max_attempts=ACK_ATTEMPTS,
             )
             Payload.log_debug("    - published json")
 
+        if self.trace is not None and self.consumer.tracer is not None:
+            self.consumer.tracer.finish(self.trace)
+
 if TYPE_CHECKING:
     # class is declared as generic in stubs but not at runtime
     PayloadFuture = asyncio.Future[Payload] # type: ignore
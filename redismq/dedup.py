@@ -0,0 +1,188 @@
+"""
+Deduplication for RedisMQ
+"""
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from .debugging import debugging
+
+__all__ = ["Deduplicator"]
+
+# deduplicator default settings
+MAXSIZE = 10000
+TTL = 3600.0
+
+
+@debugging
+class Deduplicator:
+    """
+    Remembers the idempotency keys of the messages a consumer group has
+    handled, so the copies of a message that come later (a producer trying
+    again after a network error, a hedged request or a redelivery) are
+    acked and skipped before they reach the handler.  The local tier is a
+    bounded LRU of the keys handled by this process, the shared tier is a
+    set per ttl seconds in redis, kept for two periods, so a key is
+    remembered by the whole group for between ttl and twice ttl seconds.
+    Keys are added once the handler is done with a message, so a copy read
+    while the first one is still being handled is not skipped.  The response
+    to a confirmed message is kept in the shared tier for as long as its key,
+    so a copy of the request is answered with it.
+    """
+
+    maxsize: int
+    ttl: float
+    shared: bool
+
+    # idempotency key -> when it is forgotten
+    entries: "OrderedDict[str, float]"
+    counters: Dict[str, int]
+
+    log_debug: Callable[..., None]
+
+    def __init__(
+        self, maxsize: int = MAXSIZE, ttl: float = TTL, shared: bool = True
+    ) -> None:
+        """
+        default constructor
+        """
+        Deduplicator.log_debug("__init__ %r %r %r", maxsize, ttl, shared)
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive")
+        if ttl <= 0:
+            raise ValueError("ttl must be positive")
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared = shared
+
+        self.entries = OrderedDict()
+        self.counters = {
+            "checked": 0,
+            "duplicates": 0,
+            "shared_duplicates": 0,
+            "added": 0,
+            "evictions": 0,
+        }
+
+    def shared_keys(self, prefix: str) -> List[str]:
+        """
+        Return the redis keys of the sets for this period and the last one.
+        """
+        period = int(time.time() // self.ttl)
+        return ["%s:%d" % (prefix, period), "%s:%d" % (prefix, period - 1)]
+
+    def response_key(self, prefix: str, key: str) -> str:
+        """
+        Return the redis key of the response to the message with a key.
+        """
+        return "%s:response:%s" % (prefix, key)
+
+    def __contains__(self, key: str) -> bool:
+        expires = self.entries.get(key, None)
+        if expires is None:
+            return False
+        if expires <= time.monotonic():
+            del self.entries[key]
+            return False
+        self.entries.move_to_end(key)
+        return True
+
+    def put(self, key: str) -> None:
+        """
+        Remember a key locally, evicting the least recently used ones.
+        """
+        self.entries[key] = time.monotonic() + self.ttl
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    async def seen(self, redis: Any, prefix: str, keys: Iterable[str]) -> Set[str]:
+        """
+        Return the keys that have already been handled, the ones not known
+        locally are looked up in the shared tier in one pipeline.
+        """
+        keys = list(keys)
+        self.counters["checked"] += len(keys)
+        duplicates = {key for key in keys if key in self}
+        unknown = [key for key in dict.fromkeys(keys) if key not in duplicates]
+
+        if unknown and self.shared:
+            shared_keys = self.shared_keys(prefix)
+            pipe = redis.pipeline(transaction=False)
+            for key in unknown:
+                for shared_key in shared_keys:
+                    pipe.sismember(shared_key, key)
+            replies = iter(await pipe.execute())
+            for key in unknown:
+                if any([next(replies) for _ in shared_keys]):
+                    duplicates.add(key)
+                    self.counters["shared_duplicates"] += 1
+                    self.put(key)
+
+        self.counters["duplicates"] += sum(1 for key in keys if key in duplicates)
+        Deduplicator.log_debug("seen %r of %r", duplicates, keys)
+        return duplicates
+
+    async def add(
+        self,
+        redis: Any,
+        prefix: str,
+        keys: Iterable[str],
+        responses: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """
+        Remember the keys of messages that have been handled, and the
+        responses published for the confirmed ones.
+        """
+        keys = list(keys)
+        if not keys:
+            return
+        for key in keys:
+            self.put(key)
+        self.counters["added"] += len(keys)
+
+        if self.shared:
+            expire = int(self.ttl * 2) + 1
+            shared_key = self.shared_keys(prefix)[0]
+            pipe = redis.pipeline(transaction=False)
+            pipe.sadd(shared_key, *keys)
+            pipe.expire(shared_key, expire)
+            for key, response in (responses or {}).items():
+                pipe.set(self.response_key(prefix, key), response, ex=expire)
+            await pipe.execute()
+
+    async def responses(
+        self, redis: Any, prefix: str, keys: Iterable[str]
+    ) -> Dict[str, str]:
+        """
+        Return the responses that were published for the keys, the ones
+        that are not known are left out.
+        """
+        keys = list(keys)
+        if not keys or not self.shared:
+            return {}
+        pipe = redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.get(self.response_key(prefix, key))
+        replies = await pipe.execute()
+        return {key: reply for key, reply in zip(keys, replies) if reply is not None}
+
+    def clear(self) -> None:
+        """
+        Forget the local keys.
+        """
+        self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return a snapshot of the counters.
+        """
+        stats: Dict[str, Any] = dict(self.counters)
+        stats["size"] = len(self.entries)
+        stats["maxsize"] = self.maxsize
+        return stats
@@ -0,0 +1,122 @@
+"""
+Message Envelopes for RedisMQ
+"""
+from __future__ import annotations
+
+import json
+import base64
+import struct
+
+from typing import Any, Dict, Optional
+
+__all__ = ["compact", "expand"]
+
+# the compact envelope has the same two fields in every entry, a header and
+# the encoded message, so a listpack stores the field names once
+HEADER_FIELD = "h"
+MESSAGE_FIELD = "m"
+
+# version, flags, codec, correlation ID, deadline in milliseconds and window,
+# the zero bytes at the end are left out so a plain message has a tiny header
+VERSION = 1
+HEADER = struct.Struct("<BBBQQH")
+
+# the response goes to the "{namespace}:response.{correlation ID}" channel
+FLAG_REPLY = 0x01
+
+# how the message field is encoded
+CODEC_JSON = 0
+
+# separates the header from the fields that don't fit in it
+EXTRA_SEPARATOR = "."
+
+
+def _reply_id(response_channel: str, namespace: str) -> Optional[int]:
+    """
+    Return the correlation ID of a response channel made by a producer in
+    the namespace, None for any other channel.
+    """
+    prefix = "%s:response." % (namespace,)
+    if not response_channel.startswith(prefix):
+        return None
+    uid = response_channel[len(prefix) :]
+    if not uid.isdigit() or str(int(uid)) != uid or int(uid) >= 2**64:
+        return None
+    return int(uid)
+
+
+def compact(
+    payload: Dict[str, str], namespace: str, deadline: Optional[float] = None
+) -> Dict[str, str]:
+    """
+    Return the compact form of the fields of a classic envelope, with the
+    time the producer stops waiting for the response when there is one.
+    """
+    flags = 0
+    correlation_id = 0
+    extra: Dict[str, str] = {}
+    response_channel = payload.get("response_channel", None)
+    if response_channel is not None:
+        reply_id = _reply_id(response_channel, namespace)
+        if reply_id is None:
+            extra["reply"] = response_channel
+        else:
+            flags |= FLAG_REPLY
+            correlation_id = reply_id
+    for name in ("key", "trace", "idempotency_key"):
+        if name in payload:
+            extra[name] = payload[name]
+
+    header = HEADER.pack(
+        VERSION,
+        flags,
+        CODEC_JSON,
+        correlation_id,
+        int(deadline * 1000) if deadline else 0,
+        int(payload.get("window", 0) or 0),
+    ).rstrip(b"\0")
+    value = base64.urlsafe_b64encode(header).decode().rstrip("=")
+    if extra:
+        value += EXTRA_SEPARATOR + json.dumps(extra, separators=(",", ":"))
+    return {HEADER_FIELD: value, MESSAGE_FIELD: payload["message"]}
+
+
+def expand(fields: Dict[str, str], namespace: str) -> Dict[str, Any]:
+    """
+    Return the fields of a classic envelope for the fields of a stream
+    entry in either format, with a "deadline" in seconds when the compact
+    envelope has one.  Raises ValueError when the entry can't be read.
+    """
+    if HEADER_FIELD not in fields:
+        return fields
+
+    value, _, extra = fields[HEADER_FIELD].partition(EXTRA_SEPARATOR)
+    try:
+        header = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+    except (TypeError, ValueError) as err:
+        raise ValueError("bad envelope header: %r" % (value,)) from err
+    if not header or len(header) > HEADER.size:
+        raise ValueError("bad envelope header: %r" % (value,))
+    version, flags, codec, correlation_id, deadline, window = HEADER.unpack(
+        header.ljust(HEADER.size, b"\0")
+    )
+    if version != VERSION:
+        raise ValueError("unknown envelope version %d" % (version,))
+    if codec != CODEC_JSON:
+        raise ValueError("unknown message codec %d" % (codec,))
+
+    payload: Dict[str, Any] = json.loads(extra) if extra else {}
+    if not isinstance(payload, dict):
+        raise ValueError("bad envelope fields: %r" % (extra,))
+    if "reply" in payload:
+        payload["response_channel"] = payload.pop("reply")
+    if flags & FLAG_REPLY:
+        payload["response_channel"] = "%s:response.%d" % (namespace, correlation_id)
+    if deadline:
+        payload["deadline"] = deadline / 1000.0
+    if window:
+        payload["window"] = str(window)
+    if MESSAGE_FIELD not in fields:
+        raise ValueError("no message in the envelope")
+    payload["message"] = fields[MESSAGE_FIELD]
+    return payload
@@ -0,0 +1,124 @@
+"""
+Hedged Requests for RedisMQ
+"""
+from __future__ import annotations
+
+from collections import deque
+
+from typing import Any, Callable, Deque, Dict, Optional
+
+from .debugging import debugging
+
+__all__ = ["HedgePolicy"]
+
+# hedging default settings
+PERCENTILE = 95.0
+MAX_RATIO = 0.05
+BURST = 10.0
+MIN_SAMPLES = 20
+HISTORY = 1000
+
+
+@debugging
+class HedgePolicy:
+    """
+    Decides when a producer sends a second copy of a confirmed request that
+    has not been answered, taking whichever response comes first.  The copy
+    is sent after delay seconds, or when there is no delay after the
+    percentile of the latencies of the last history responses (once there
+    are min_samples of them).  Every request earns max_ratio of a hedge, up
+    to burst of them, so no more than that share of the requests are sent
+    twice however slow the consumers get.
+    """
+
+    fixed_delay: Optional[float]
+    percentile: float
+    max_ratio: float
+    burst: float
+    min_samples: int
+
+    budget: float
+    latencies: Deque[float]
+    samples: int
+    learned_delay: Optional[float]
+    counters: Dict[str, int]
+
+    log_debug: Callable[..., None]
+
+    def __init__(
+        self,
+        delay: Optional[float] = None,
+        percentile: float = PERCENTILE,
+        max_ratio: float = MAX_RATIO,
+        burst: float = BURST,
+        min_samples: int = MIN_SAMPLES,
+        history: int = HISTORY,
+    ) -> None:
+        """
+        default constructor
+        """
+        if not 0.0 < percentile < 100.0:
+            raise ValueError("percentile must be between 0 and 100")
+        if not 0.0 <= max_ratio <= 1.0:
+            raise ValueError("max_ratio must be between 0 and 1")
+        if min_samples < 1:
+            raise ValueError("min_samples must be positive")
+
+        self.fixed_delay = delay
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.burst = max(1.0, burst)
+        self.min_samples = min_samples
+
+        self.budget = 0.0
+        self.latencies = deque(maxlen=history)
+        self.learned_delay = None
+        self.samples = 0
+        self.counters = {"requests": 0, "hedged": 0, "denied": 0}
+
+    def delay(self) -> Optional[float]:
+        """
+        Called for each request, returns the seconds to wait for a response
+        before sending the copy, None until enough have been seen.
+        """
+        self.counters["requests"] += 1
+        self.budget = min(self.burst, self.budget + self.max_ratio)
+        if self.fixed_delay is not None:
+            return self.fixed_delay
+        return self.learned_delay
+
+    def allow(self) -> bool:
+        """
+        Returns True and spends the budget for a copy when there is enough.
+        """
+        if self.budget < 1.0:
+            self.counters["denied"] += 1
+            return False
+        self.budget -= 1.0
+        self.counters["hedged"] += 1
+        return True
+
+    def record(self, latency: float) -> None:
+        """
+        Remember how long a request took to be answered, and learn the delay
+        again every min_samples responses.
+        """
+        self.latencies.append(latency)
+        self.samples += 1
+        if self.samples % self.min_samples:
+            return
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100.0))
+        self.learned_delay = ordered[index]
+        HedgePolicy.log_debug("    - delay %r", self.learned_delay)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return a snapshot of the delay and counters.
+        """
+        stats: Dict[str, Any] = dict(self.counters)
+        stats["delay"] = (
+            self.fixed_delay if self.fixed_delay is not None else self.learned_delay
+        )
+        stats["budget"] = self.budget
+        return stats
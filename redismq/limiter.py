@@ -0,0 +1,213 @@
+"""
+Adaptive Concurrency for RedisMQ
+"""
+from __future__ import annotations
+
+import time
+import asyncio
+from collections import deque
+
+from typing import Any, Callable, Deque, Dict, Optional
+
+from .debugging import debugging
+
+__all__ = ["AdaptiveLimiter"]
+
+# limiter default settings
+INITIAL_LIMIT = 4
+MIN_LIMIT = 1
+MAX_LIMIT = 64
+TOLERANCE = 2.0
+DECREASE = 0.75
+MAX_ERROR_RATE = 0.1
+MIN_SAMPLES = 10
+HISTORY = 100
+
+# how quickly the no-load latency follows a lasting rise in latency
+BASELINE_DRIFT = 0.05
+
+
+@debugging
+class AdaptiveLimiter:
+    """
+    Limits the number of handlers running at once, finding the limit from
+    how they do (AIMD).  Once per window of samples (at least min_samples
+    and the current limit) the average latency is compared with the lowest
+    seen, the no-load baseline: when it is more than tolerance times the
+    baseline, or more than max_error_rate of the handlers failed, the limit
+    is multiplied by decrease, otherwise it goes up by one if it was reached
+    during the window.
+    """
+
+    limit: int
+    min_limit: int
+    max_limit: int
+    tolerance: float
+    decrease: float
+    max_error_rate: float
+    min_samples: int
+
+    in_flight: int
+    waiters: Deque[asyncio.Future]
+
+    # the current window
+    samples: int
+    total_latency: float
+    errors: int
+    saturated: bool
+
+    baseline: Optional[float]
+    latency: Optional[float]
+    error_rate: float
+    counters: Dict[str, int]
+    history: Deque[Dict[str, Any]]
+
+    log_debug: Callable[..., None]
+
+    def __init__(
+        self,
+        initial_limit: int = INITIAL_LIMIT,
+        min_limit: int = MIN_LIMIT,
+        max_limit: int = MAX_LIMIT,
+        tolerance: float = TOLERANCE,
+        decrease: float = DECREASE,
+        max_error_rate: float = MAX_ERROR_RATE,
+        min_samples: int = MIN_SAMPLES,
+        history: int = HISTORY,
+    ) -> None:
+        """
+        default constructor
+        """
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError("limits must be 1 <= min <= initial <= max")
+        if not 0.0 < decrease < 1.0:
+            raise ValueError("decrease must be between 0 and 1")
+
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.decrease = decrease
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+
+        self.in_flight = 0
+        self.waiters = deque()
+
+        self.samples = 0
+        self.total_latency = 0.0
+        self.errors = 0
+        self.saturated = False
+
+        self.baseline = None
+        self.latency = None
+        self.error_rate = 0.0
+        self.counters = {"increases": 0, "decreases": 0, "handled": 0, "failed": 0}
+
+        # the limit after each window, for dashboards
+        self.history = deque(maxlen=history)
+
+    async def acquire(self) -> None:
+        """
+        Wait until fewer than limit handlers are running and count one more.
+        """
+        while self.in_flight >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+                elif not waiter.cancelled():
+                    # it was woken, let someone else have the turn
+                    self._wake()
+                raise
+        self.in_flight += 1
+        if self.in_flight >= self.limit:
+            self.saturated = True
+
+    def release(self, latency: float, error: bool = False) -> None:
+        """
+        Count a handler that finished after latency seconds, and adjust the
+        limit at the end of a window.
+        """
+        self.in_flight -= 1
+        self.samples += 1
+        self.total_latency += latency
+        self.counters["handled"] += 1
+        if error:
+            self.errors += 1
+            self.counters["failed"] += 1
+        if self.samples >= max(self.min_samples, self.limit):
+            self._adjust()
+        self._wake()
+
+    def _wake(self) -> None:
+        """
+        Let waiters go while there is room under the limit.
+        """
+        room = self.limit - self.in_flight
+        while room > 0 and self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                room -= 1
+
+    def _adjust(self) -> None:
+        """
+        Change the limit from the latency and errors of the last window and
+        start a new one.
+        """
+        latency = self.total_latency / self.samples
+        error_rate = self.errors / self.samples
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        else:
+            self.baseline += (latency - self.baseline) * BASELINE_DRIFT
+
+        old_limit = self.limit
+        if error_rate > self.max_error_rate or latency > self.baseline * self.tolerance:
+            self.limit = max(self.min_limit, int(self.limit * self.decrease))
+            if self.limit < old_limit:
+                self.counters["decreases"] += 1
+        elif self.saturated and self.limit < self.max_limit:
+            self.limit += 1
+            self.counters["increases"] += 1
+        if self.limit != old_limit:
+            AdaptiveLimiter.log_debug(
+                "limit %d -> %d, latency %r, baseline %r, errors %r",
+                old_limit,
+                self.limit,
+                latency,
+                self.baseline,
+                error_rate,
+            )
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.history.append(
+            {
+                "time": time.time(),
+                "limit": self.limit,
+                "latency": latency,
+                "error_rate": error_rate,
+            }
+        )
+        self.samples = 0
+        self.total_latency = 0.0
+        self.errors = 0
+        self.saturated = self.in_flight >= self.limit
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return a snapshot of the limit and counters.
+        """
+        stats: Dict[str, Any] = dict(self.counters)
+        stats["limit"] = self.limit
+        stats["in_flight"] = self.in_flight
+        stats["waiting"] = len(self.waiters)
+        stats["latency"] = self.latency
+        stats["baseline"] = self.baseline
+        stats["error_rate"] = self.error_rate
+        return stats
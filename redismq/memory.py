@@ -0,0 +1,1018 @@
+"""
+In-process memory:// backend for RedisMQ
+
+This implements the part of the redis asyncio client that RedisMQ uses, with
+the same reply formats, so that a Client connected to "memory://" gives the
+same Producer, Consumer and Payload semantics without a redis server.  All
+of the clients connected to the same URL share the same data.
+"""
+
+from __future__ import annotations
+
+import time
+import bisect
+import asyncio
+import inspect
+from collections import deque
+
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple, Union
+
+from redis.exceptions import ResponseError  # type: ignore[attr-defined]
+
+from .debugging import debugging
+
+__all__ = ["MemoryRedis", "MemoryPubSub", "MemoryServer"]
+
+StreamID = Tuple[int, int]
+Entry = Tuple[str, Optional[Dict[str, str]]]
+
+
+def _now() -> float:
+    return time.time()
+
+
+def _now_ms() -> int:
+    return int(_now() * 1000)
+
+
+def _parse_id(value: Any, default_seq: int = 0) -> StreamID:
+    """
+    Turn "1234-5", "1234", "-", "+" (or bytes) into an ID tuple.
+    """
+    if isinstance(value, bytes):
+        value = value.decode()
+    value = str(value)
+    if value == "-":
+        return (0, 0)
+    if value == "+":
+        return (2**64 - 1, 2**64 - 1)
+    if "-" in value:
+        ms, seq = value.split("-", 1)
+        return (int(ms), int(seq))
+    return (int(value), default_seq)
+
+
+def _format_id(stream_id: StreamID) -> str:
+    return "%d-%d" % stream_id
+
+
+def _wake(waiters: List["asyncio.Future[None]"]) -> None:
+    """
+    Wake up the tasks waiting for something to change.
+    """
+    for waiter in waiters:
+        if not waiter.done():
+            try:
+                waiter.set_result(None)
+            except RuntimeError:
+                # the loop the waiter belonged to is gone
+                pass
+
+
+async def _wait(
+    waiter_lists: List[List["asyncio.Future[None]"]], timeout: Optional[float]
+) -> None:
+    """
+    Wait until woken up or the timeout (None is forever) runs out.
+    """
+    waiter = asyncio.get_running_loop().create_future()
+    for waiters in waiter_lists:
+        waiters.append(waiter)
+    try:
+        await asyncio.wait_for(waiter, timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        for waiters in waiter_lists:
+            waiters.remove(waiter)
+
+
+class _List:
+    """
+    The items of a list and the tasks blocked popping from it.
+    """
+
+    def __init__(self) -> None:
+        self.items: Deque[str] = deque()
+        self.waiters: List["asyncio.Future[None]"] = []
+
+
+class _Consumer:
+    """
+    A consumer in a group.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.seen_time = _now_ms()
+        self.active_time = -1
+
+
+class _Group:
+    """
+    A consumer group, its pending entries list is message ID ->
+    [consumer name, delivery time in ms, delivery count].
+    """
+
+    def __init__(self, name: str, last_id: StreamID) -> None:
+        self.name = name
+        self.last_id = last_id
+        self.entries_read: Optional[int] = None
+        self.pel: Dict[StreamID, List[Any]] = {}
+        self.consumers: Dict[str, _Consumer] = {}
+
+    def consumer(self, name: str) -> _Consumer:
+        consumer = self.consumers.get(name, None)
+        if consumer is None:
+            consumer = self.consumers[name] = _Consumer(name)
+        consumer.seen_time = _now_ms()
+        return consumer
+
+    def pending_ids(self) -> List[StreamID]:
+        return sorted(self.pel)
+
+
+class _Stream:
+    """
+    A stream, the entry IDs are kept sorted next to the field dictionaries.
+    """
+
+    def __init__(self) -> None:
+        self.ids: List[StreamID] = []
+        self.fields: Dict[StreamID, Dict[str, str]] = {}
+        self.last_id: StreamID = (0, 0)
+        self.entries_added = 0
+        self.max_deleted_id: StreamID = (0, 0)
+        self.groups: Dict[str, _Group] = {}
+        self.waiters: List["asyncio.Future[None]"] = []
+
+    def next_id(self, requested: Any) -> StreamID:
+        if requested in (None, "*", b"*"):
+            ms = _now_ms()
+            if ms > self.last_id[0]:
+                return (ms, 0)
+            return (self.last_id[0], self.last_id[1] + 1)
+        new_id = _parse_id(requested)
+        if new_id <= self.last_id:
+            raise ResponseError(
+                "The ID specified in XADD is equal or smaller than the target "
+                "stream top item"
+            )
+        return new_id
+
+    def entry(self, stream_id: StreamID) -> Entry:
+        return (_format_id(stream_id), self.fields.get(stream_id, None))
+
+    def after(self, stream_id: StreamID, count: Optional[int]) -> List[StreamID]:
+        start = bisect.bisect_right(self.ids, stream_id)
+        if count:
+            return self.ids[start : start + count]
+        return self.ids[start:]
+
+    def between(self, min_id: StreamID, max_id: StreamID) -> List[StreamID]:
+        return self.ids[
+            bisect.bisect_left(self.ids, min_id) : bisect.bisect_right(self.ids, max_id)
+        ]
+
+    def remove_before(self, index: int) -> int:
+        """
+        Trim the oldest entries up to the index.
+        """
+        if index <= 0:
+            return 0
+        for stream_id in self.ids[:index]:
+            del self.fields[stream_id]
+        self.max_deleted_id = max(self.max_deleted_id, self.ids[index - 1])
+        del self.ids[:index]
+        return index
+
+    def trim(self, maxlen: Optional[int] = None, minid: Any = None) -> int:
+        if maxlen is not None:
+            return self.remove_before(len(self.ids) - int(maxlen))
+        if minid is not None:
+            return self.remove_before(bisect.bisect_left(self.ids, _parse_id(minid)))
+        return 0
+
+    def lag(self, group: _Group) -> int:
+        return len(self.ids) - bisect.bisect_right(self.ids, group.last_id)
+
+
+@debugging
+class MemoryServer:
+    """
+    The shared data behind every MemoryRedis connected to the same URL.
+    """
+
+    servers: Dict[str, "MemoryServer"] = {}
+
+    keys: Dict[str, Any]
+    expires: Dict[str, float]
+    subscribers: Dict[str, Set["MemoryPubSub"]]
+
+    log_debug: Callable[..., None]
+
+    def __init__(self, name: str) -> None:
+        MemoryServer.log_debug("__init__ %r", name)
+        self.name = name
+        self.keys = {}
+        self.expires = {}
+        self.subscribers = {}
+
+    @classmethod
+    def get(cls, name: str) -> "MemoryServer":
+        """
+        Return the server with this name, creating it when needed.
+        """
+        server = cls.servers.get(name, None)
+        if server is None:
+            server = cls.servers[name] = cls(name)
+        return server
+
+    def lookup(self, name: str, kind: Optional[type] = None) -> Any:
+        """
+        Return the value of a key (or None), checking its type and expiry.
+        """
+        expires = self.expires.get(name, None)
+        if expires is not None and expires <= _now():
+            del self.expires[name]
+            del self.keys[name]
+        value = self.keys.get(name, None)
+        if value is not None and kind is not None and not isinstance(value, kind):
+            raise ResponseError(
+                "WRONGTYPE Operation against a key holding the wrong kind of value"
+            )
+        return value
+
+
+class _MemoryConnectionPool:
+    """
+    Stands in for the connection pool, there is nothing to disconnect.
+    """
+
+    async def disconnect(self) -> None:
+        pass
+
+
+class _MemoryConnection:
+    """
+    Stands in for the pubsub connection.
+    """
+
+    is_connected = True
+
+    async def connect(self) -> None:
+        pass
+
+    async def disconnect(self) -> None:
+        pass
+
+
+class MemoryPipeline:
+    """
+    Collects commands and runs them one after the other when executed.
+    """
+
+    def __init__(self, redis: "MemoryRedis") -> None:
+        self.redis = redis
+        self.commands: List[Tuple[str, Tuple[Any, ...], Dict[str, Any]]] = []
+
+    def __getattr__(self, command: str) -> Callable[..., "MemoryPipeline"]:
+        if not hasattr(self.redis, command):
+            raise AttributeError(command)
+
+        def _queue(*args: Any, **kwargs: Any) -> "MemoryPipeline":
+            self.commands.append((command, args, kwargs))
+            return self
+
+        return _queue
+
+    async def execute(self, raise_on_error: bool = True) -> List[Any]:
+        results: List[Any] = []
+        commands, self.commands = self.commands, []
+        for command, args, kwargs in commands:
+            try:
+                results.append(await getattr(self.redis, command)(*args, **kwargs))
+            except ResponseError as err:
+                if raise_on_error:
+                    raise
+                results.append(err)
+        return results
+
+    async def __aenter__(self) -> "MemoryPipeline":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        self.commands = []
+
+
+@debugging
+class MemoryPubSub:
+    """
+    Subscribes to channels of a MemoryServer and calls the handlers.
+    """
+
+    channels: Dict[str, Optional[Callable[..., Any]]]
+    messages: Deque[Dict[str, Any]]
+
+    log_debug: Callable[..., None]
+
+    def __init__(
+        self, server: MemoryServer, ignore_subscribe_messages: bool = False
+    ) -> None:
+        self.server = server
+        self.ignore_subscribe_messages = ignore_subscribe_messages
+        self.channels = {}
+        self.messages = deque()
+        self.waiters: List["asyncio.Future[None]"] = []
+        self.connection = _MemoryConnection()
+
+    @property
+    def subscribed(self) -> bool:
+        return bool(self.channels)
+
+    async def connect(self) -> None:
+        pass
+
+    async def subscribe(self, *args: str, **kwargs: Callable[..., Any]) -> None:
+        channels: Dict[str, Optional[Callable[..., Any]]] = dict.fromkeys(args)
+        channels.update(kwargs)
+        for channel, handler in channels.items():
+            self.channels[channel] = handler
+            self.server.subscribers.setdefault(channel, set()).add(self)
+
+    async def unsubscribe(self, *args: str) -> None:
+        for channel in args or list(self.channels):
+            self.channels.pop(channel, None)
+            subscribers = self.server.subscribers.get(channel, None)
+            if subscribers is not None:
+                subscribers.discard(self)
+                if not subscribers:
+                    del self.server.subscribers[channel]
+
+    def deliver(self, channel: str, data: Any) -> None:
+        """
+        Called by publish to queue a message.
+        """
+        self.messages.append(
+            {"type": "message", "pattern": None, "channel": channel, "data": data}
+        )
+        _wake(self.waiters)
+
+    async def get_message(
+        self, ignore_subscribe_messages: bool = False, timeout: Optional[float] = 0.0
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Return the next message, or call its handler and return None.
+        """
+        if not self.messages and timeout != 0.0:
+            await _wait([self.waiters], timeout)
+        if not self.messages:
+            return None
+
+        message = self.messages.popleft()
+        channel = message["channel"]
+        if channel not in self.channels:
+            return None
+        handler = self.channels[channel]
+        if handler is None:
+            return message
+        if inspect.iscoroutinefunction(handler):
+            await handler(message)
+        else:
+            handler(message)
+        return None
+
+    async def run(
+        self,
+        *,
+        exception_handler: Optional[Callable[..., Any]] = None,
+        poll_timeout: float = 1.0,
+    ) -> None:
+        """
+        Call the handlers as messages arrive, like PubSub.run().
+        """
+        while True:
+            try:
+                await self.get_message(timeout=poll_timeout)
+            except asyncio.CancelledError:
+                raise
+            except BaseException as err:  # pylint: disable=broad-except
+                if exception_handler is None:
+                    raise
+                rslt = exception_handler(err, self)
+                if inspect.isawaitable(rslt):
+                    await rslt
+            await asyncio.sleep(0)
+
+    async def reset(self) -> None:
+        await self.unsubscribe()
+        self.messages.clear()
+
+    close = reset
+    aclose = reset
+
+
+@debugging
+class MemoryRedis:
+    """
+    The commands RedisMQ uses, working on a MemoryServer.
+    """
+
+    log_debug: Callable[..., None]
+
+    def __init__(self, server: MemoryServer) -> None:
+        self.server = server
+        self.connection_pool = _MemoryConnectionPool()
+
+    @classmethod
+    def from_url(cls, address: str, **kwargs: Any) -> "MemoryRedis":
+        """
+        memory://name connects to the server with that name.
+        """
+        MemoryRedis.log_debug("from_url %r", address)
+        if not address.startswith("memory://"):
+            raise ValueError("not a memory:// URL: %r" % (address,))
+        return cls(MemoryServer.get(address[len("memory://") :].strip("/")))
+
+    def pubsub(self, **kwargs: Any) -> MemoryPubSub:
+        return MemoryPubSub(self.server, **kwargs)
+
+    def pipeline(self, transaction: bool = True) -> MemoryPipeline:
+        return MemoryPipeline(self)
+
+    async def close(self) -> None:
+        pass
+
+    aclose = close
+
+    # generic commands
+
+    async def ping(self) -> bool:
+        return True
+
+    async def flushall(self) -> bool:
+        self.server.keys.clear()
+        self.server.expires.clear()
+        return True
+
+    async def delete(self, *names: str) -> int:
+        count = 0
+        for name in names:
+            if self.server.lookup(name) is not None:
+                del self.server.keys[name]
+                self.server.expires.pop(name, None)
+                count += 1
+        return count
+
+    async def exists(self, *names: str) -> int:
+        return sum(1 for name in names if self.server.lookup(name) is not None)
+
+    async def expire(self, name: str, time: Union[int, float]) -> bool:
+        if self.server.lookup(name) is None:
+            return False
+        self.server.expires[name] = _now() + float(time)
+        return True
+
+    async def publish(self, channel: str, message: Any) -> int:
+        subscribers = list(self.server.subscribers.get(channel, ()))
+        for pubsub in subscribers:
+            pubsub.deliver(channel, message)
+        return len(subscribers)
+
+    # string commands
+
+    async def get(self, name: str) -> Optional[str]:
+        return self.server.lookup(name, str)
+
+    async def set(
+        self,
+        name: str,
+        value: Any,
+        ex: Optional[float] = None,
+        px: Optional[int] = None,
+        nx: bool = False,
+    ) -> Optional[bool]:
+        if nx and self.server.lookup(name) is not None:
+            return None
+        self.server.keys[name] = str(value)
+        self.server.expires.pop(name, None)
+        if ex is not None:
+            self.server.expires[name] = _now() + float(ex)
+        elif px is not None:
+            self.server.expires[name] = _now() + px / 1000.0
+        return True
+
+    async def incr(self, name: str, amount: int = 1) -> int:
+        value = int(self.server.lookup(name, str) or 0) + amount
+        self.server.keys[name] = str(value)
+        return value
+
+    # list commands
+
+    def _list(self, name: str, create: bool = False) -> Optional[_List]:
+        items = self.server.lookup(name, _List)
+        if items is None and create:
+            items = self.server.keys[name] = _List()
+        return items
+
+    def _pop(self, name: str) -> Optional[str]:
+        items = self._list(name)
+        if items is None or not items.items:
+            return None
+        value = items.items.popleft()
+        if not items.items and not items.waiters:
+            del self.server.keys[name]
+            self.server.expires.pop(name, None)
+        return value
+
+    async def rpush(self, name: str, *values: Any) -> int:
+        items = self._list(name, create=True)
+        assert items is not None
+        items.items.extend(str(value) for value in values)
+        _wake(items.waiters)
+        return len(items.items)
+
+    async def lpop(self, name: str) -> Optional[str]:
+        return self._pop(name)
+
+    async def llen(self, name: str) -> int:
+        items = self._list(name)
+        return len(items.items) if items else 0
+
+    async def blpop(
+        self, keys: Union[str, List[str]], timeout: Optional[float] = 0
+    ) -> Optional[List[str]]:
+        names = [keys] if isinstance(keys, str) else list(keys)
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            for name in names:
+                value = self._pop(name)
+                if value is not None:
+                    return [name, value]
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            lists = [self._list(name, create=True) for name in names]
+            try:
+                await _wait([items.waiters for items in lists if items], remaining)
+            finally:
+                for name, items in zip(names, lists):
+                    if items and not items.items and not items.waiters:
+                        self.server.keys.pop(name, None)
+
+    # set commands
+
+    def _set(self, name: str, create: bool = False) -> Optional[Set[str]]:
+        members = self.server.lookup(name, set)
+        if members is None and create:
+            members = self.server.keys[name] = set()
+        return members  # type: ignore[no-any-return]
+
+    async def sadd(self, name: str, *values: Any) -> int:
+        members = self._set(name, create=True)
+        assert members is not None
+        count = len(members)
+        members.update(str(value) for value in values)
+        return len(members) - count
+
+    async def srem(self, name: str, *values: Any) -> int:
+        members = self._set(name)
+        if members is None:
+            return 0
+        count = len(members)
+        members.difference_update(str(value) for value in values)
+        if not members:
+            del self.server.keys[name]
+            self.server.expires.pop(name, None)
+        return count - len(members)
+
+    async def sismember(self, name: str, value: Any) -> bool:
+        members = self._set(name)
+        return members is not None and str(value) in members
+
+    async def scard(self, name: str) -> int:
+        members = self._set(name)
+        return len(members) if members else 0
+
+    # stream commands
+
+    def _stream(self, name: str, create: bool = False) -> Optional[_Stream]:
+        stream = self.server.lookup(name, _Stream)
+        if stream is None and create:
+            stream = self.server.keys[name] = _Stream()
+        return stream
+
+    def _group(self, name: str, groupname: str, command: str) -> Tuple[_Stream, _Group]:
+        stream = self._stream(name)
+        group = stream.groups.get(groupname, None) if stream else None
+        if stream is None or group is None:
+            raise ResponseError(
+                "NOGROUP No such key '%s' or consumer group '%s' in %s with GROUP "
+                "option" % (name, groupname, command)
+            )
+        return stream, group
+
+    async def xadd(
+        self,
+        name: str,
+        fields: Dict[str, Any],
+        id: Any = "*",  # pylint: disable=redefined-builtin
+        maxlen: Optional[int] = None,
+        approximate: bool = True,
+        nomkstream: bool = False,
+        minid: Any = None,
+        limit: Optional[int] = None,
+    ) -> Optional[str]:
+        if maxlen is not None and minid is not None:
+            raise ResponseError("Only one of ``maxlen`` or ``minid`` may be specified")
+        stream = self._stream(name, create=not nomkstream)
+        if stream is None:
+            return None
+
+        stream_id = stream.next_id(id)
+        stream.ids.append(stream_id)
+        stream.fields[stream_id] = {str(k): str(v) for k, v in fields.items()}
+        stream.last_id = stream_id
+        stream.entries_added += 1
+        stream.trim(maxlen, minid)
+
+        _wake(stream.waiters)
+        return _format_id(stream_id)
+
+    async def xlen(self, name: str) -> int:
+        stream = self._stream(name)
+        return len(stream.ids) if stream else 0
+
+    async def xdel(self, name: str, *ids: Any) -> int:
+        stream = self._stream(name)
+        if stream is None:
+            return 0
+        count = 0
+        for stream_id in map(_parse_id, ids):
+            if stream_id in stream.fields:
+                del stream.fields[stream_id]
+                stream.ids.remove(stream_id)
+                stream.max_deleted_id = max(stream.max_deleted_id, stream_id)
+                count += 1
+        return count
+
+    async def xtrim(
+        self,
+        name: str,
+        maxlen: Optional[int] = None,
+        approximate: bool = True,
+        minid: Any = None,
+        limit: Optional[int] = None,
+    ) -> int:
+        stream = self._stream(name)
+        return stream.trim(maxlen, minid) if stream else 0
+
+    async def xrange(
+        self, name: str, min: Any = "-", max: Any = "+", count: Optional[int] = None
+    ) -> List[Entry]:  # pylint: disable=redefined-builtin
+        stream = self._stream(name)
+        if stream is None:
+            return []
+        min_id = _parse_id(min, 0)
+        max_id = _parse_id(max, 2**64 - 1)
+        if isinstance(min, str) and min.startswith("("):
+            min_id = _parse_id(min[1:], 2**64 - 1)
+            min_id = (min_id[0], min_id[1] + 1)
+        ids = stream.between(min_id, max_id)
+        if count:
+            ids = ids[:count]
+        return [stream.entry(stream_id) for stream_id in ids]
+
+    async def xrevrange(
+        self, name: str, max: Any = "+", min: Any = "-", count: Optional[int] = None
+    ) -> List[Entry]:  # pylint: disable=redefined-builtin
+        entries = await self.xrange(name, min, max)
+        entries.reverse()
+        return entries[:count] if count else entries
+
+    async def xread(
+        self,
+        streams: Dict[str, Any],
+        count: Optional[int] = None,
+        block: Optional[int] = None,
+    ) -> List[List[Any]]:
+        deadline = None if not block else time.monotonic() + block / 1000.0
+        positions = {}
+        for name, start in streams.items():
+            if start in ("$", b"$"):
+                stream = self._stream(name)
+                positions[name] = stream.last_id if stream else (0, 0)
+            else:
+                positions[name] = _parse_id(start)
+
+        while True:
+            results = []
+            for name, position in positions.items():
+                stream = self._stream(name)
+                if stream is None:
+                    continue
+                ids = stream.after(position, count)
+                if ids:
+                    results.append([name, [stream.entry(i) for i in ids]])
+            if results or block is None:
+                return results
+
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                return []
+            waiters = [self._stream(name, create=True).waiters for name in positions]
+            await _wait(waiters, timeout)
+
+    async def xgroup_create(
+        self, name: str, groupname: str, id: Any = "$", mkstream: bool = False
+    ) -> bool:  # pylint: disable=redefined-builtin
+        stream = self._stream(name, create=mkstream)
+        if stream is None:
+            raise ResponseError(
+                "ERR The XGROUP subcommand requires the key to exist. Note that for "
+                "CREATE you may want to use the MKSTREAM option to create an empty "
+                "stream automatically."
+            )
+        if groupname in stream.groups:
+            raise ResponseError("BUSYGROUP Consumer Group name already exists")
+        last_id = stream.last_id if id in ("$", b"$") else _parse_id(id)
+        stream.groups[groupname] = _Group(groupname, last_id)
+        return True
+
+    async def xgroup_destroy(self, name: str, groupname: str) -> int:
+        stream = self._stream(name)
+        if stream is None or groupname not in stream.groups:
+            return 0
+        del stream.groups[groupname]
+        return 1
+
+    async def xgroup_delconsumer(
+        self, name: str, groupname: str, consumername: str
+    ) -> int:
+        _, group = self._group(name, groupname, "XGROUP")
+        if group.consumers.pop(consumername, None) is None:
+            return 0
+        owned = [i for i, info in group.pel.items() if info[0] == consumername]
+        for stream_id in owned:
+            del group.pel[stream_id]
+        return len(owned)
+
+    async def xreadgroup(
+        self,
+        groupname: str,
+        consumername: str,
+        streams: Dict[str, Any],
+        count: Optional[int] = None,
+        block: Optional[int] = None,
+        noack: bool = False,
+    ) -> List[List[Any]]:
+        deadline = None if not block else time.monotonic() + block / 1000.0
+        for name in streams:
+            self._group(name, groupname, "XREADGROUP")
+
+        while True:
+            results = []
+            new_only = True
+            for name, start in streams.items():
+                stream, group = self._group(name, groupname, "XREADGROUP")
+                consumer = group.consumer(consumername)
+                now = _now_ms()
+
+                if start in (">", b">"):
+                    ids = stream.after(group.last_id, count)
+                    if not ids:
+                        continue
+                    group.last_id = ids[-1]
+                    group.entries_read = (group.entries_read or 0) + len(ids)
+                    consumer.active_time = now
+                    if not noack:
+                        for stream_id in ids:
+                            group.pel[stream_id] = [consumername, now, 1]
+                    results.append([name, [stream.entry(i) for i in ids]])
+                else:
+                    # re-read this consumer's pending entries
+                    new_only = False
+                    start_id = _parse_id(start)
+                    ids = [
+                        stream_id
+                        for stream_id in group.pending_ids()
+                        if stream_id > start_id
+                        and group.pel[stream_id][0] == consumername
+                    ][: count or None]
+                    for stream_id in ids:
+                        group.pel[stream_id][1] = now
+                        group.pel[stream_id][2] += 1
+                    results.append([name, [stream.entry(i) for i in ids]])
+
+            if results or block is None or not new_only:
+                return results
+
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                return []
+            waiters = [self._stream(name, create=True).waiters for name in streams]
+            await _wait(waiters, timeout)
+
+    async def xack(self, name: str, groupname: str, *ids: Any) -> int:
+        stream = self._stream(name)
+        group = stream.groups.get(groupname, None) if stream else None
+        if group is None:
+            return 0
+        count = 0
+        for stream_id in map(_parse_id, ids):
+            if group.pel.pop(stream_id, None) is not None:
+                count += 1
+        return count
+
+    async def xclaim(
+        self,
+        name: str,
+        groupname: str,
+        consumername: str,
+        min_idle_time: int,
+        message_ids: List[Any],
+        idle: Optional[int] = None,
+        time: Optional[int] = None,  # pylint: disable=redefined-outer-name
+        retrycount: Optional[int] = None,
+        force: bool = False,
+        justid: bool = False,
+    ) -> List[Any]:
+        stream, group = self._group(name, groupname, "XCLAIM")
+        consumer = group.consumer(consumername)
+        now = _now_ms()
+
+        claimed: List[Any] = []
+        for stream_id in map(_parse_id, message_ids):
+            info = group.pel.get(stream_id, None)
+            if info is None:
+                if not force or stream_id not in stream.fields:
+                    continue
+                info = group.pel[stream_id] = [consumername, now, 0]
+            elif now - info[1] < min_idle_time:
+                continue
+            if stream_id not in stream.fields:
+                # deleted entries are dropped from the pending list
+                del group.pel[stream_id]
+                continue
+
+            info[0] = consumername
+            if idle is not None:
+                info[1] = now - idle
+            elif time is not None:
+                info[1] = time
+            else:
+                info[1] = now
+            if retrycount is not None:
+                info[2] = retrycount
+            elif not justid:
+                info[2] += 1
+            consumer.active_time = now
+            claimed.append(_format_id(stream_id) if justid else stream.entry(stream_id))
+        return claimed
+
+    async def xautoclaim(
+        self,
+        name: str,
+        groupname: str,
+        consumername: str,
+        min_idle_time: int,
+        start_id: Any = "0-0",
+        count: Optional[int] = None,
+        justid: bool = False,
+    ) -> List[Any]:
+        stream, group = self._group(name, groupname, "XAUTOCLAIM")
+        count = count or 100
+        now = _now_ms()
+
+        start = _parse_id(start_id)
+        candidates = [i for i in group.pending_ids() if i >= start]
+        claimed_ids: List[StreamID] = []
+        deleted: List[str] = []
+        next_id = "0-0"
+        for stream_id in candidates:
+            if len(claimed_ids) + len(deleted) >= count:
+                next_id = _format_id(stream_id)
+                break
+            if now - group.pel[stream_id][1] < min_idle_time:
+                continue
+            if stream_id not in stream.fields:
+                del group.pel[stream_id]
+                deleted.append(_format_id(stream_id))
+                continue
+            claimed_ids.append(stream_id)
+
+        claimed = await self.xclaim(
+            name,
+            groupname,
+            consumername,
+            0,
+            [_format_id(stream_id) for stream_id in claimed_ids],
+            justid=justid,
+        )
+        if justid:
+            return claimed
+        return [next_id, claimed, deleted]
+
+    async def xpending(self, name: str, groupname: str) -> Dict[str, Any]:
+        _, group = self._group(name, groupname, "XPENDING")
+        ids = group.pending_ids()
+        counts: Dict[str, int] = {}
+        for stream_id in ids:
+            owner = group.pel[stream_id][0]
+            counts[owner] = counts.get(owner, 0) + 1
+        return {
+            "pending": len(ids),
+            "min": _format_id(ids[0]) if ids else None,
+            "max": _format_id(ids[-1]) if ids else None,
+            "consumers": [{"name": k, "pending": v} for k, v in sorted(counts.items())],
+        }
+
+    async def xpending_range(
+        self,
+        name: str,
+        groupname: str,
+        min: Any,
+        max: Any,
+        count: int,
+        consumername: Optional[str] = None,
+        idle: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:  # pylint: disable=redefined-builtin
+        _, group = self._group(name, groupname, "XPENDING")
+        now = _now_ms()
+        min_id = _parse_id(min, 0)
+        max_id = _parse_id(max, 2**64 - 1)
+
+        results: List[Dict[str, Any]] = []
+        for stream_id in group.pending_ids():
+            owner, delivered, times_delivered = group.pel[stream_id]
+            if not min_id <= stream_id <= max_id:
+                continue
+            if consumername is not None and owner != consumername:
+                continue
+            if idle is not None and now - delivered < idle:
+                continue
+            results.append(
+                {
+                    "message_id": _format_id(stream_id),
+                    "consumer": owner,
+                    "time_since_delivered": now - delivered,
+                    "times_delivered": times_delivered,
+                }
+            )
+            if len(results) >= count:
+                break
+        return results
+
+    async def xinfo_groups(self, name: str) -> List[Dict[str, Any]]:
+        stream = self._stream(name)
+        if stream is None:
+            raise ResponseError("no such key")
+        return [
+            {
+                "name": group.name,
+                "consumers": len(group.consumers),
+                "pending": len(group.pel),
+                "last-delivered-id": _format_id(group.last_id),
+                "entries-read": group.entries_read,
+                "lag": stream.lag(group),
+            }
+            for group in stream.groups.values()
+        ]
+
+    async def xinfo_consumers(self, name: str, groupname: str) -> List[Dict[str, Any]]:
+        _, group = self._group(name, groupname, "XINFO")
+        now = _now_ms()
+        results = []
+        for consumer in group.consumers.values():
+            pending = sum(1 for info in group.pel.values() if info[0] == consumer.name)
+            results.append(
+                {
+                    "name": consumer.name,
+                    "pending": pending,
+                    "idle": now - consumer.seen_time,
+                    "inactive": (
+                        now - consumer.active_time if consumer.active_time >= 0 else -1
+                    ),
+                }
+            )
+        return results
+
+    async def xinfo_stream(self, name: str, full: bool = False) -> Dict[str, Any]:
+        stream = self._stream(name)
+        if stream is None:
+            raise ResponseError("no such key")
+        info: Dict[str, Any] = {
+            "length": len(stream.ids),
+            "radix-tree-keys": 1,
+            "radix-tree-nodes": 1,
+            "last-generated-id": _format_id(stream.last_id),
+            "max-deleted-entry-id": _format_id(stream.max_deleted_id),
+            "entries-added": stream.entries_added,
+            "recorded-first-entry-id": (
+                _format_id(stream.ids[0]) if stream.ids else "0-0"
+            ),
+            "groups": len(stream.groups),
+            "first-entry": stream.entry(stream.ids[0]) if stream.ids else None,
+            "last-entry": stream.entry(stream.ids[-1]) if stream.ids else None,
+        }
+        return info
@@ -4,12 +4,30 @@ Producer for RedisMQ
 from __future__ import annotations
 
 import asyncio
+import copy
 import json
 import time
+import uuid
+from functools import partial
 
-from typing import TYPE_CHECKING, Any, Callable, Dict, TypedDict, Optional, cast
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    TypedDict,
+    Optional,
+    cast,
+)
 from redis import Connection  # type: ignore[attr-defined]
 from .debugging import debugging
+from . import envelope
+from .cache import ResponseCache
+from .tracing import Tracer
+from .spool import Spool
+from .hedging import HedgePolicy
+from .resilience import Backoff, RETRY_ERRORS
 
 Client = TypedDict("Client", redis=Connection)
 
@@ -20,6 +38,30 @@ AnyFuture = asyncio.Future
 MAXLEN = 100
 TIMEOUT = 10.0
 
+# seconds that a backlog check is reused
+BACKPRESSURE_INTERVAL = 0.1
+BACKPRESSURE_MODES = ("block", "delay", "reject")
+
+# chunks of a streaming response the consumer can send ahead of the reader
+WINDOW = 16
+
+# attempts to subscribe to a response channel while the pubsub connection
+# is being restored
+SUBSCRIBE_ATTEMPTS = 5
+
+
+class BackpressureError(RuntimeError):
+    """
+    Raised when a message is not added because the consumers are too far
+    behind.
+    """
+
+
+class StreamError(RuntimeError):
+    """
+    Raised when a streaming response ends with an error or stops arriving.
+    """
+
 
 @debugging
 class Producer:
@@ -30,64 +72,174 @@ class Producer:
     client: Client
     stream_name: str
     channel_key: str
-    maxlen: int
+    maxlen: Optional[int]
+    approximate: bool
+    retention: Optional[float]
     timeout: float
     id: int
 
+    single_flight: bool
+    in_flight: Dict[str, Any]
+    counters: Dict[str, int]
+
+    cache: Optional[ResponseCache]
+    cache_prefix: str
+
+    backpressure: Optional[str]
+    backpressure_group: Optional[str]
+    backpressure_interval: float
+    high_watermark: Optional[int]
+    backlog: int
+    backlog_checked: float
+
+    tracer: Optional[Tracer]
+    spool: Optional[Spool]
+    compact: bool
+    hedge: Optional[HedgePolicy]
+    idempotent: bool
+    idempotency_prefix: str
+    sequence: int
+
     log_debug: Callable[..., None]
 
     def __init__(
         self,
         client: Client,
         stream_name: str,
-        maxlen: int = MAXLEN,
+        maxlen: Optional[int] = MAXLEN,
         timeout: float = TIMEOUT,
+        single_flight: bool = False,
+        cache: Optional[ResponseCache] = None,
+        approximate: bool = True,
+        retention: Optional[float] = None,
+        backpressure: Optional[str] = None,
+        backpressure_group: Optional[str] = None,
+        backpressure_interval: float = BACKPRESSURE_INTERVAL,
+        high_watermark: Optional[int] = None,
+        tracer: Optional[Tracer] = None,
+        spool: Optional[Spool] = None,
+        compact: bool = False,
+        hedge: Optional[HedgePolicy] = None,
+        idempotent: bool = False,
     ) -> None:
         """
         default constructor
         """
         Producer.log_debug("__init__ %r %r", client, stream_name)
+        if backpressure is not None and backpressure not in BACKPRESSURE_MODES:
+            raise ValueError("not a backpressure mode: %r" % (backpressure,))
 
         self.client = client
         self.stream_name = stream_name
         self.channel_key = "%s:responseid" % client.namespace
-        self.maxlen = maxlen
         self.timeout = timeout
 
+        # trim the stream by length ("~" unless approximate is False) or by
+        # age in seconds when there is a retention period
+        self.maxlen = None if retention is not None else maxlen
+        self.approximate = approximate
+        self.retention = retention
+
         self.id = time.time_ns()
 
-    # make the handler for the channel
+        # identical confirmed requests share one in-flight request, the
+        # values are [request_task, waiter_count]
+        self.single_flight = single_flight
+        self.in_flight = {}
+
+        self.counters = {"confirmed": 0, "sent": 0, "coalesced": 0, "hedged": 0}
+
+        # responses marked cacheable by the consumer
+        self.cache = cache
+        self.cache_prefix = "%s:cache:%s" % (client.namespace, stream_name)
+
+        # block, delay or reject new messages before unread ones are trimmed,
+        # the backlog is checked at most once per interval and the messages
+        # added since then are counted locally
+        self.backpressure = backpressure
+        self.backpressure_group = backpressure_group
+        self.backpressure_interval = backpressure_interval
+        self.high_watermark = high_watermark if high_watermark else self.maxlen
+        if backpressure and not self.high_watermark:
+            raise ValueError("backpressure needs maxlen or high_watermark")
+        self.backlog = 0
+        self.backlog_checked = 0.0
+
+        # sampled messages carry a trace context and a timeline
+        self.tracer = tracer
+
+        # unconfirmed messages that can't be added while redis is down are
+        # kept here, and what was left by an earlier run is added first
+        self.spool = spool
+        if spool is not None and spool.depth:
+            spool.start_replay(client.redis, client.connection_restored)
+
+        # messages are added with the compact envelope, which every consumer
+        # of the stream has to be able to read
+        self.compact = compact
+
+        # confirmed requests that are slow to be answered are sent again
+        self.hedge = hedge
+
+        # every message is tagged with an idempotency key, so a consumer
+        # with a deduplicator skips the copies of it
+        self.idempotent = idempotent
+        self.idempotency_prefix = uuid.uuid4().hex
+        self.sequence = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return a snapshot of the request counters.
+        """
+        stats: Dict[str, Any] = dict(self.counters)
+        stats["in_flight"] = len(self.in_flight)
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        if self.spool is not None:
+            stats["spool"] = self.spool.stats()
+        if self.hedge is not None:
+            stats["hedge"] = self.hedge.stats()
+        return stats
+
+    # make the handler for the channel, it is called by the pubsub reader
+    # and sets the result of the future without waiting for anything
     def get_handler(self, channel_id, fut: AnyFuture):
         Producer.log_debug("get_handler channel_id %r fut %r" % (channel_id, fut))
 
-        async def _handler(json_message=None):
+        def _handler(json_message):
             Producer.log_debug("_handler json_message: %r", json_message)
-            response = None
+            if fut.done():
+                return
             try:
-                if json_message:
-                    response = json.loads(json_message["data"])
+                response = json.loads(json_message["data"])
             except ValueError as err:
                 Producer.log_debug("    - value/decoding error %s", channel_id)
                 response = {"message": "JSON Decoding Error", "err": err}
             except TypeError as err:
                 Producer.log_debug("    - type error %s", channel_id)
                 response = {"message": "Type Error", "err": err}
-            finally:
-                Producer.log_debug("    - finally %s", channel_id)
-                await self.client.pubsub.unsubscribe(channel_id)
-                Producer.log_debug("    - unsubscribed %s", channel_id)
-                if not fut.cancelled():
-                    Producer.log_debug("    -setting result %s", response)
-                    fut.set_result(response)
+            fut.set_result(response)
 
         return _handler
 
     # pylint: disable=invalid-name
     def addUnconfirmedMessage(
-        self, message: Any, response_channel_id: str = None
+        self,
+        message: Any,
+        response_channel_id: str = None,
+        traceparent: Optional[str] = None,
+        ordering_key: Optional[str] = None,
+        idempotency_key: Optional[str] = None,
     ) -> AnyFuture:
         """
         Return a task that adds an unconfirmed message to the message queue.
+        With a spool, a message that can't be added because redis is
+        unavailable (or while older ones are still spooled) is spooled and the
+        result is None instead of the message ID.  Messages with the same
+        ordering_key are handled in order by consumers serving in order.
+        Consumers with a deduplicator handle only one of the messages with
+        the same idempotency_key, which an idempotent producer makes up when
+        there isn't one.
         """
         Producer.log_debug("addUnconfirmedMessage %r", message)
 
@@ -95,22 +247,354 @@ class Producer:
         payload = {"message": json.dumps(message)}
         if response_channel_id is not None:
             payload["response_channel"] = response_channel_id
+        if ordering_key is not None:
+            payload["key"] = ordering_key
+        if idempotency_key is None and self.idempotent:
+            idempotency_key = self._next_idempotency_key()
+        if idempotency_key is not None:
+            payload["idempotency_key"] = idempotency_key
+        if self.tracer is not None:
+            trace = self.tracer.start(traceparent)
+            if trace is not None:
+                payload["trace"] = Tracer.encode(trace)
+
+        payload = self._envelope(payload)
 
         # create a task to add it to the stream
-        future = self.client.redis.xadd(self.stream_name, payload, maxlen=self.maxlen)
+        if self.spool is not None:
+            future = self._xadd_or_spool(payload)
+        else:
+            future = self._xadd(payload)
 
         return cast(AnyFuture, future)
 
+    def _next_idempotency_key(self) -> str:
+        """
+        Return a key no other message of any producer has.
+        """
+        self.sequence += 1
+        return "%s-%d" % (self.idempotency_prefix, self.sequence)
+
+    def _envelope(
+        self, payload: Dict[str, str], deadline: Optional[float] = None
+    ) -> Dict[str, str]:
+        """
+        Return the fields to add for the payload, in the compact envelope
+        when the producer uses it.
+        """
+        if not self.compact:
+            return payload
+        return envelope.compact(payload, self.client.namespace, deadline)
+
+    async def _xadd(self, payload: Dict[str, str]) -> str:
+        """
+        Wait for the backlog to be short enough then add the payload to the
+        stream, trimming it by length or age.
+        """
+        if self.backpressure is not None:
+            await self._wait_for_backlog()
+
+        kwargs: Dict[str, Any] = {"approximate": self.approximate}
+        if self.retention is not None:
+            kwargs["minid"] = int((time.time() - self.retention) * 1000)
+        else:
+            kwargs["maxlen"] = self.maxlen
+
+        message_id: str = await self.client.redis.xadd(
+            self.stream_name, payload, **kwargs
+        )
+        self.backlog += 1
+        return message_id
+
+    async def _xadd_or_spool(self, payload: Dict[str, str]) -> Optional[str]:
+        """
+        Add the payload to the stream, or to the spool when redis is
+        unavailable, keeping the messages in order.
+        """
+        assert self.spool is not None
+        if not self.spool.depth:
+            try:
+                return await self._xadd(payload)
+            except RETRY_ERRORS as err:
+                Producer.log_debug("    - spooling, xadd failed: %r", err)
+                self.client.connection_lost(err)
+
+        options = {"maxlen": self.maxlen, "approximate": self.approximate}
+        if self.retention is not None:
+            options = {"retention": self.retention, "approximate": self.approximate}
+        self.spool.append(self.stream_name, payload, options)
+        self.spool.start_replay(self.client.redis, self.client.connection_restored)
+        return None
+
+    async def _check_backlog(self) -> int:
+        """
+        Return the number of messages the consumers have not acked, the
+        slowest group when there is more than one.  Groups that do not report
+        their lag count the whole stream.
+        """
+        now = time.monotonic()
+        if now - self.backlog_checked < self.backpressure_interval:
+            return self.backlog
+
+        Producer.log_debug("_check_backlog")
+        try:
+            group_info = await self.client.redis.xinfo_groups(self.stream_name)
+        except Exception as err:  # pylint: disable=broad-except
+            Producer.log_debug("    - no existing stream: %r", err)
+            group_info = []
+
+        backlog = 0
+        for info in group_info:
+            if self.backpressure_group and info["name"] != self.backpressure_group:
+                continue
+            lag = info.get("lag", None)
+            if lag is None:
+                lag = await self.client.redis.xlen(self.stream_name)
+            backlog = max(backlog, lag + info["pending"])
+        Producer.log_debug("    - backlog: %r", backlog)
+
+        self.backlog = backlog
+        self.backlog_checked = now
+        return backlog
+
+    async def _wait_for_backlog(self) -> None:
+        """
+        Apply the backpressure mode before a message is added.
+        """
+        assert self.high_watermark
+        backlog = await self._check_backlog()
+        if backlog < self.high_watermark:
+            # start slowing down at half the watermark
+            low_watermark = self.high_watermark // 2
+            if self.backpressure == "delay" and backlog > low_watermark:
+                delay = self.backpressure_interval * (
+                    (backlog - low_watermark) / (self.high_watermark - low_watermark)
+                )
+                Producer.log_debug("    - delay %r", delay)
+                await asyncio.sleep(delay)
+            return
+
+        if self.backpressure == "reject":
+            raise BackpressureError(
+                "backlog of %d reached %d" % (backlog, self.high_watermark)
+            )
+
+        # block and delay both wait for the consumers to catch up
+        Producer.log_debug("    - blocked, backlog %r", backlog)
+        deadline = time.monotonic() + self.timeout
+        while backlog >= self.high_watermark:
+            if time.monotonic() >= deadline:
+                raise BackpressureError(
+                    "backlog of %d still at %d after %rs"
+                    % (backlog, self.high_watermark, self.timeout)
+                )
+            await asyncio.sleep(self.backpressure_interval)
+            backlog = await self._check_backlog()
+
     # pylint: disable=invalid-name
-    async def addConfirmedMessage(self, message: Any):
+    async def addConfirmedMessage(
+        self,
+        message: Any,
+        coalesce_key: Optional[str] = None,
+        traceparent: Optional[str] = None,
+        ordering_key: Optional[str] = None,
+        idempotency_key: Optional[str] = None,
+    ):
         """
         Adds a confirmed message to the message queue and
-        results in the confirmed response.
+        results in the confirmed response.  When the producer is single-flight,
+        concurrent calls with the same encoded message (or the same
+        coalesce_key) share one request and its response.  When the producer
+        has a cache, responses the consumer marked as cacheable are returned
+        without sending the request.  When the producer has a tracer and the
+        message is sampled, the response includes its trace, which continues
+        the traceparent when there is one.  Messages with the same
+        ordering_key are handled in order by consumers serving in order.
+        When the producer has a hedge policy, a request that is not answered
+        in time may be added again, tagged with the same idempotency key, and
+        the first response is used.  Consumers with a deduplicator handle only
+        one of the messages with the same idempotency_key.
         """
         Producer.log_debug("addConfirmedMessage %r", message)
+        self.counters["confirmed"] += 1
 
         # JSON encode the message
-        payload = {"message": json.dumps(message)}
+        json_message = json.dumps(message)
+        if self.cache is not None:
+            resp = await self.cache.lookup(
+                self.client.redis, self.cache_prefix, json_message
+            )
+            if resp is not None:
+                Producer.log_debug("    - cached response: %r", resp)
+                return resp
+
+        if not self.single_flight:
+            return await self._send_confirmed(
+                json_message, traceparent, ordering_key, idempotency_key
+            )
+
+        if coalesce_key is None:
+            coalesce_key = json_message
+            if ordering_key is not None:
+                coalesce_key = "%s\0%s" % (ordering_key, json_message)
+
+        flight = self.in_flight.get(coalesce_key, None)
+        if flight is None:
+            request = asyncio.ensure_future(
+                self._send_confirmed(
+                    json_message, traceparent, ordering_key, idempotency_key
+                )
+            )
+            request.add_done_callback(partial(self._flight_done, coalesce_key))
+            flight = self.in_flight[coalesce_key] = [request, 0]
+        else:
+            Producer.log_debug("    - coalesced %r", coalesce_key)
+            self.counters["coalesced"] += 1
+
+        request, _ = flight
+        flight[1] += 1
+        try:
+            # every caller gets its own copy of the shared response
+            resp = copy.deepcopy(await asyncio.shield(request))
+        except asyncio.CancelledError as err:
+            Producer.log_debug("    - cancelled %r", err)
+            resp = {"message": "Cancelled Error", "err": err}
+        finally:
+            flight[1] -= 1
+            # nobody is waiting for the shared request any more
+            if not flight[1] and not request.done():
+                request.cancel()
+        return resp
+
+    # pylint: disable=invalid-name
+    async def addStreamingMessage(
+        self, message: Any, window: int = WINDOW
+    ) -> AsyncIterator[Any]:
+        """
+        Adds a confirmed message to the message queue and yields the chunks
+        of the response as the consumer sends them, then the final response
+        if it is not None.  The consumer is allowed window chunks ahead of
+        the reader and is given more credit as they are read.  Raises
+        StreamError when the consumer acks with an error or nothing arrives
+        for timeout seconds.
+        """
+        Producer.log_debug("addStreamingMessage %r", message)
+        if window < 1:
+            raise ValueError("window must be positive")
+
+        chunks: asyncio.Queue = asyncio.Queue()
+        uid = await self.client.redis.incr(self.channel_key)
+        response_channel_id = "%s:response.%d" % (self.client.namespace, uid)
+        credit_key = "%s:credit" % (response_channel_id,)
+        Producer.log_debug("    - response_channel_id: %r", response_channel_id)
+
+        def _handler(json_message: Dict[str, Any]) -> None:
+            chunks.put_nowait(json_message["data"])
+
+        pubsub = self.client.pubsub_for(response_channel_id)
+        await Backoff().call(
+            pubsub.subscribe,
+            max_attempts=SUBSCRIBE_ATTEMPTS,
+            **{response_channel_id: _handler},
+        )
+        finished = False
+        try:
+            payload = {
+                "message": json.dumps(message),
+                "response_channel": response_channel_id,
+                "window": str(window),
+            }
+            message_id: str = await self._xadd(self._envelope(payload))
+            Producer.log_debug("    - message_id: %r", message_id)
+
+            # chunks read since credit was last given
+            unacked = 0
+            while True:
+                try:
+                    json_message = await asyncio.wait_for(chunks.get(), self.timeout)
+                    resp = json.loads(json_message)
+                except asyncio.TimeoutError as err:
+                    raise StreamError("no response for %rs" % (self.timeout,)) from err
+                except ValueError as err:
+                    raise StreamError("JSON Decoding Error") from err
+
+                if isinstance(resp, dict) and "chunk" in resp:
+                    yield resp["chunk"]
+                    unacked += 1
+                    if unacked * 2 >= window:
+                        await self._give_credit(credit_key, unacked)
+                        unacked = 0
+                    continue
+
+                finished = True
+                if not isinstance(resp, dict):
+                    raise StreamError("unexpected response: %r" % (resp,))
+                if resp.get("error", None) is not None:
+                    raise StreamError(resp["error"])
+                if resp.get("message", None) is not None:
+                    yield resp["message"]
+                return
+        finally:
+            Producer.log_debug("    - stream finished: %r", finished)
+            await pubsub.unsubscribe(response_channel_id)
+            if finished:
+                await self.client.redis.delete(credit_key)
+            else:
+                # zero credit tells the consumer nobody is reading
+                await self._give_credit(credit_key, 0)
+                await self._cancel_request(response_channel_id)
+
+    async def _cancel_request(self, response_channel_id: str) -> None:
+        """
+        Tell the consumers nobody is waiting for the response any more.
+        """
+        try:
+            await self.client.redis.publish(
+                "%s:cancel" % (self.client.namespace,), response_channel_id
+            )
+        except Exception as err:  # pylint: disable=broad-except
+            Producer.log_debug("    - cancel not sent: %r", err)
+
+    async def _give_credit(self, credit_key: str, credit: int) -> None:
+        """
+        Let the consumer of a streaming response send credit more chunks.
+        """
+        pipe = self.client.redis.pipeline(transaction=False)
+        pipe.rpush(credit_key, credit)
+        pipe.expire(credit_key, max(1, int(self.timeout * 2)))
+        await pipe.execute()
+
+    def _flight_done(self, coalesce_key: str, request: AnyFuture) -> None:
+        """
+        Callback when a shared request completes, later calls will make a
+        new request.
+        """
+        Producer.log_debug("_flight_done %r", coalesce_key)
+        flight = self.in_flight.get(coalesce_key, None)
+        if flight is not None and flight[0] is request:
+            del self.in_flight[coalesce_key]
+
+    async def _send_confirmed(
+        self,
+        json_message: str,
+        traceparent: Optional[str] = None,
+        ordering_key: Optional[str] = None,
+        idempotency_key: Optional[str] = None,
+    ):
+        """
+        Send one confirmed request and wait for the response.
+        """
+        Producer.log_debug("_send_confirmed %r", json_message)
+        self.counters["sent"] += 1
+
+        payload = {"message": json_message}
+        if ordering_key is not None:
+            payload["key"] = ordering_key
+        trace = None
+        if self.tracer is not None:
+            trace = self.tracer.start(traceparent)
+            if trace is not None:
+                payload["trace"] = Tracer.encode(trace)
         # create a future
         future = asyncio.get_running_loop().create_future()
 
@@ -119,44 +603,135 @@ class Producer:
         response_channel_id = "%s:response.%d" % (self.client.namespace, uid)
         Producer.log_debug("    - response_channel_id: %r", response_channel_id)
 
-        # pack it into the request payload
+        # pack it into the request payload, a hedged request may be added
+        # twice so both copies are tagged as the same request
         payload["response_channel"] = response_channel_id
+        if idempotency_key is None and (self.hedge is not None or self.idempotent):
+            idempotency_key = response_channel_id
+        if idempotency_key is not None:
+            payload["idempotency_key"] = idempotency_key
 
         # start listening for a response
         _handler = self.get_handler(response_channel_id, future)
         kwargs = {response_channel_id: _handler}
+        pubsub = self.client.pubsub_for(response_channel_id)
         try:
-            await self.client.pubsub.subscribe(**kwargs)
+            # the connection may be coming back after being lost
+            await Backoff().call(
+                pubsub.subscribe, max_attempts=SUBSCRIBE_ATTEMPTS, **kwargs
+            )
             Producer.log_debug("    - subscribed")
 
             # put the request into the stream
-            message_id: str = await self.client.redis.xadd(
-                self.stream_name, payload, maxlen=self.maxlen
-            )
+            entry = self._envelope(payload, time.time() + self.timeout)
+            message_id: str = await self._xadd(entry)
             Producer.log_debug("    - message_id: %r", message_id)
             # future will get the result set by the handler when the response is published
-            resp = await asyncio.wait_for(future, self.timeout)
+            if self.hedge is None:
+                resp = await asyncio.wait_for(future, self.timeout)
+            else:
+                resp = await asyncio.wait_for(
+                    self._hedged(future, entry, response_channel_id), self.timeout
+                )
         except asyncio.TimeoutError as err:
             Producer.log_debug("    - timeout waiting for future: %r", err)
-            await _handler()
+            await self._cancel_request(response_channel_id)
             resp = {"message": "Timeout Error", "err": err}
         except asyncio.CancelledError as err:
             Producer.log_debug("    - cancelled %r", err)
-            await _handler()
+            await self._cancel_request(response_channel_id)
             resp = {"message": "Cancelled Error", "err": err}
+        except BackpressureError as err:
+            Producer.log_debug("    - backpressure %r", err)
+            resp = {"message": "Backpressure Error", "err": err}
         except BaseException as err:
             #Producer.log_debug("    - unexpected error %r", err)
-            await _handler()
             resp = {"message": "Unexpected Error", "err": err}
+        await pubsub.unsubscribe(response_channel_id)
+        Producer.log_debug("    - unsubscribed %s", response_channel_id)
+
+        if trace is not None:
+            self._finish_trace(trace, resp)
+
+        # the cache hints are for the producer, not the caller
+        cacheable, ttl = False, None
+        if isinstance(resp, dict):
+            cacheable = resp.pop("cacheable", False)
+            ttl = resp.pop("ttl", None)
+        if (
+            self.cache is not None
+            and cacheable
+            and resp.get("error", None) is None
+        ):
+            await self.cache.store(
+                self.client.redis,
+                self.cache_prefix,
+                json_message,
+                {"message": resp["message"], "error": None},
+                ttl,
+            )
+        return resp
+
+    async def _hedged(
+        self, future: AnyFuture, entry: Dict[str, str], response_channel_id: str
+    ) -> Any:
+        """
+        Wait for the response to a request, adding the entry again when it
+        takes longer than the hedge delay and the policy allows it.  The
+        consumers are told to cancel the copy that loses.
+        """
+        assert self.hedge is not None
+        start = time.monotonic()
+        delay = self.hedge.delay()
+        hedged = False
+        if delay is not None:
+            try:
+                resp = await asyncio.wait_for(asyncio.shield(future), delay)
+                self.hedge.record(time.monotonic() - start)
+                return resp
+            except asyncio.TimeoutError:
+                hedged = self.hedge.allow()
+            if hedged:
+                Producer.log_debug("    - hedging %r", response_channel_id)
+                self.counters["hedged"] += 1
+                await self._xadd(entry)
+
+        resp = await future
+        self.hedge.record(time.monotonic() - start)
+        if hedged:
+            await self._cancel_request(response_channel_id)
         return resp
 
+    def _finish_trace(self, trace: Dict[str, Any], resp: Any) -> None:
+        """
+        Complete the timeline of a traced request with the time the response
+        arrived and pass it to the tracer.
+        """
+        assert self.tracer
+        if isinstance(resp, dict) and isinstance(resp.get("trace", None), dict):
+            trace = resp["trace"]
+            trace.setdefault("timeline", {})
+        elif isinstance(resp, dict) and "err" in resp:
+            # there was no response, report what is known
+            trace["error"] = resp["message"]
+        trace["timeline"]["response"] = time.time()
+        self.tracer.finish(trace)
+
     # pylint: disable=invalid-name
     def destroy(self) -> None:
         """
         Stops this producer from working. This is automatically called when
-        client.dispose_producer() is called with this producer.
+        client.dispose_producer() is called with this producer, or when the
+        client is closed.  Its spool stops replaying and is closed, unless
+        another producer of the client uses it.
         """
         Producer.log_debug("destroy")
+        if self.spool is not None and not any(
+            producer.spool is self.spool
+            for producer in self.client.producer_registry.values()
+            if producer is not self
+        ):
+            self.spool.close()
 
         # assume this hasn't been gracefully closed
         # close_task = asyncio.create_task(self.close())
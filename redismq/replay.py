@@ -0,0 +1,168 @@
+"""
+Stream History for RedisMQ
+"""
+from __future__ import annotations
+
+import json
+import asyncio
+import datetime
+
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+
+from .debugging import debugging
+from . import envelope
+
+__all__ = ["Entry", "replay", "stream_id"]
+
+# entries read with each XRANGE
+PAGE_SIZE = 1000
+
+# the largest sequence number of a stream ID
+MAX_SEQ = 2**64 - 1
+
+# an entry whose message has not been decoded yet
+_UNDECODED = object()
+
+Position = Union[str, int, float, datetime.datetime]
+
+
+def stream_id(position: Position, end: bool = False) -> str:
+    """
+    Return the stream ID for a position in the history, which is an ID (or
+    "-" and "+"), a time in seconds since the epoch or a datetime.  A time
+    is the first ID at that millisecond, or the last one when it is the end
+    of a range.
+    """
+    if isinstance(position, datetime.datetime):
+        position = position.timestamp()
+    if isinstance(position, (int, float)):
+        return "%d-%d" % (int(position * 1000), MAX_SEQ if end else 0)
+    return position
+
+
+def next_id(msg_id: str) -> str:
+    """
+    Return the smallest stream ID after msg_id.
+    """
+    ms, seq = map(int, msg_id.split("-"))
+    if seq == MAX_SEQ:
+        return "%d-0" % (ms + 1,)
+    return "%d-%d" % (ms, seq + 1)
+
+
+class Entry:
+    """
+    A message read from the history of a stream, with the attributes of a
+    Payload that can be read, decoded when they are used.
+    """
+
+    msg_id: str
+    fields: Dict[str, str]
+    namespace: str
+
+    _envelope: Optional[Dict[str, Any]]
+    _message: Any
+
+    def __init__(self, msg_id: str, fields: Dict[str, str], namespace: str) -> None:
+        self.msg_id = msg_id
+        self.fields = fields
+        self.namespace = namespace
+        self._envelope = None
+        self._message = _UNDECODED
+
+    def __repr__(self) -> str:
+        return "<Entry %s>" % (self.msg_id,)
+
+    @property
+    def envelope(self) -> Dict[str, Any]:
+        """
+        The fields of the entry as a classic envelope, raises ValueError when
+        it can't be read.
+        """
+        if self._envelope is None:
+            self._envelope = envelope.expand(self.fields, self.namespace)
+        return self._envelope
+
+    @property
+    def message(self) -> Any:
+        """
+        The decoded message, raises ValueError when it can't be decoded.
+        """
+        if self._message is _UNDECODED:
+            self._message = json.loads(self.envelope["message"])
+        return self._message
+
+    @property
+    def response_channel(self) -> Optional[str]:
+        """
+        The channel the response was published on, if there was one.
+        """
+        return self.envelope.get("response_channel", None)
+
+    @property
+    def ordering_key(self) -> Optional[str]:
+        """
+        The ordering key of the message.
+        """
+        return self.envelope.get("key", None)
+
+    @property
+    def idempotency_key(self) -> Optional[str]:
+        """
+        The key shared by copies of the same request.
+        """
+        return self.envelope.get("idempotency_key", None)
+
+    @property
+    def deadline(self) -> Optional[float]:
+        """
+        When the producer stopped waiting for the response, if it said.
+        """
+        return self.envelope.get("deadline", None)
+
+    @property
+    def timestamp(self) -> float:
+        """
+        The time the entry was added, in seconds since the epoch.
+        """
+        return int(self.msg_id.split("-", 1)[0]) / 1000.0
+
+
+@debugging
+async def replay(
+    client: Any,
+    stream_name: str,
+    start: Position = "-",
+    end: Position = "+",
+    page_size: int = PAGE_SIZE,
+) -> AsyncIterator[Entry]:
+    """
+    Yield the entries of a stream from start to end, inclusive, reading
+    page_size of them with each XRANGE while the last page is being used.
+    """
+    if page_size < 1:
+        raise ValueError("page_size must be positive")
+    redis = client.redis
+    low = stream_id(start)
+    high = stream_id(end, end=True)
+    replay.log_debug(  # type: ignore[attr-defined]
+        "replay %r %r %r", stream_name, low, high
+    )
+
+    def _read(low: str) -> "asyncio.Future[List[Any]]":
+        return asyncio.ensure_future(
+            redis.xrange(stream_name, min=low, max=high, count=page_size)
+        )
+
+    pending: Optional["asyncio.Future[List[Any]]"] = _read(low)
+    try:
+        while pending is not None:
+            page = await pending
+            pending = None
+            if len(page) == page_size:
+                pending = _read(next_id(page[-1][0]))
+            for msg_id, fields in page:
+                yield Entry(msg_id, fields, client.namespace)
+    finally:
+        if pending is not None:
+            pending.cancel()
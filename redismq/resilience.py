@@ -0,0 +1,114 @@
+"""
+Resilience for RedisMQ
+"""
+from __future__ import annotations
+
+import random
+import asyncio
+
+from typing import Any, Awaitable, Callable, Optional, Tuple, Type
+
+from redis import exceptions  # type: ignore[attr-defined]
+
+from .debugging import debugging
+
+__all__ = ["Backoff", "RETRY_ERRORS"]
+
+# backoff default settings
+BASE = 0.05
+CAP = 5.0
+FACTOR = 2.0
+
+# errors worth trying again after a delay
+RETRY_ERRORS: Tuple[Type[BaseException], ...] = (
+    exceptions.ConnectionError,
+    exceptions.TimeoutError,
+    OSError,
+)
+
+
+@debugging
+class Backoff:
+    """
+    Exponential backoff with full jitter, each delay is a random amount up to
+    base * factor ** attempts, but no more than cap seconds.
+    """
+
+    base: float
+    cap: float
+    factor: float
+    jitter: bool
+    attempts: int
+
+    log_debug: Callable[..., None]
+
+    def __init__(
+        self,
+        base: float = BASE,
+        cap: float = CAP,
+        factor: float = FACTOR,
+        jitter: bool = True,
+    ) -> None:
+        """
+        default constructor
+        """
+        self.base = base
+        self.cap = cap
+        self.factor = factor
+        self.jitter = jitter
+        self.attempts = 0
+
+    def delay(self, attempts: int) -> float:
+        """
+        Return a delay after a number of failed attempts.
+        """
+        delay = min(self.cap, self.base * (self.factor**attempts))
+        if self.jitter:
+            delay = random.uniform(0.0, delay)
+        return delay
+
+    def next_delay(self) -> float:
+        """
+        Return the next delay and count the attempt.
+        """
+        delay = self.delay(self.attempts)
+        self.attempts += 1
+        return delay
+
+    async def wait(self) -> None:
+        """
+        Sleep for the next delay.
+        """
+        delay = self.next_delay()
+        Backoff.log_debug("wait %r (attempt %d)", delay, self.attempts)
+        await asyncio.sleep(delay)
+
+    def reset(self) -> None:
+        """
+        Start over after a success.
+        """
+        self.attempts = 0
+
+    async def call(
+        self,
+        func: Callable[..., Awaitable[Any]],
+        *args: Any,
+        max_attempts: Optional[int] = None,
+        **kwargs: Any,
+    ) -> Any:
+        """
+        Await func(*args, **kwargs), waiting and trying again when it fails
+        with one of the RETRY_ERRORS, at most max_attempts times.
+        """
+        while True:
+            try:
+                result = await func(*args, **kwargs)
+            except RETRY_ERRORS as err:
+                Backoff.log_debug("call %r failed: %r", func, err)
+                if max_attempts is not None and self.attempts + 1 >= max_attempts:
+                    self.reset()
+                    raise
+                await self.wait()
+            else:
+                self.reset()
+                return result
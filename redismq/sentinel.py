@@ -0,0 +1,158 @@
+"""
+Sentinel Support for RedisMQ
+
+    redis+sentinel://[[username]:password@]host[:port][,host[:port]...]/service[/db]
+"""
+from __future__ import annotations
+
+import asyncio
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from redis.asyncio.sentinel import Sentinel  # type: ignore[import]
+
+from .debugging import debugging
+from .resilience import Backoff, RETRY_ERRORS
+
+__all__ = [
+    "SCHEME",
+    "parse_url",
+    "from_url",
+    "managed",
+    "replica_for",
+    "watch_failover",
+]
+
+SCHEME = "redis+sentinel"
+DEFAULT_PORT = 26379
+
+# seconds to wait for a sentinel to answer, or to connect to a server
+SENTINEL_TIMEOUT = 0.5
+CONNECT_TIMEOUT = 2.0
+
+# the channel the sentinels announce a new primary on
+SWITCH_MASTER = "+switch-master"
+
+
+def parse_url(address: str) -> Tuple[List[Tuple[str, int]], str, Dict[str, Any]]:
+    """
+    Return the sentinel addresses, the service name and the connection
+    options in a redis+sentinel:// URL.  The user and password are for the
+    servers, a sentinel_password query option is for the sentinels.
+    """
+    url = urlsplit(address)
+    if url.scheme != SCHEME:
+        raise ValueError("not a %s:// URL: %r" % (SCHEME, address))
+
+    userinfo, _, hosts = url.netloc.rpartition("@")
+    sentinels = []
+    for host in hosts.split(","):
+        hostname, _, port = host.partition(":")
+        if not hostname:
+            raise ValueError("missing sentinel host in %r" % (address,))
+        sentinels.append((hostname, int(port) if port else DEFAULT_PORT))
+
+    path = [part for part in url.path.split("/") if part]
+    if not path:
+        raise ValueError("missing service name in %r" % (address,))
+    options: Dict[str, Any] = {"db": int(path[1]) if len(path) > 1 else 0}
+    if userinfo:
+        username, _, password = userinfo.partition(":")
+        if username:
+            options["username"] = unquote(username)
+        if password:
+            options["password"] = unquote(password)
+
+    sentinel_kwargs: Dict[str, Any] = {"socket_timeout": SENTINEL_TIMEOUT}
+    query = parse_qs(url.query)
+    if "sentinel_password" in query:
+        sentinel_kwargs["password"] = query["sentinel_password"][-1]
+    options["sentinel_kwargs"] = sentinel_kwargs
+
+    return sentinels, unquote(path[0]), options
+
+
+@debugging
+def from_url(address: str) -> Any:
+    """
+    Return a connection to the primary of the service in a redis+sentinel://
+    URL, which asks the sentinels where the primary is each time it
+    connects.
+    """
+    from_url.log_debug("from_url %r", address)  # type: ignore[attr-defined]
+    sentinels, service_name, options = parse_url(address)
+    sentinel_kwargs = options.pop("sentinel_kwargs")
+    manager = Sentinel(
+        sentinels,
+        sentinel_kwargs=sentinel_kwargs,
+        socket_connect_timeout=CONNECT_TIMEOUT,
+        decode_responses=True,
+        **options,
+    )
+    return manager.master_for(service_name)
+
+
+def managed(redis: Any) -> bool:
+    """
+    Return True when the connection is to the primary or replicas of a
+    service managed by sentinels.
+    """
+    return hasattr(redis.connection_pool, "sentinel_manager")
+
+
+def replica_for(redis: Any) -> Any:
+    """
+    Return a connection to the replicas of the service of a connection from
+    from_url(), taking turns between them and using the primary when there
+    are none.
+    """
+    if not managed(redis):
+        raise ValueError("replicas are only known for a %s:// address" % (SCHEME,))
+    pool = redis.connection_pool
+    return pool.sentinel_manager.slave_for(pool.service_name)
+
+
+@debugging
+async def watch_failover(
+    redis: Any, on_failover: Callable[[str], Awaitable[None]]
+) -> None:
+    """
+    Listen to the sentinels for a new primary of the service of a connection
+    from from_url() and await on_failover with its host:port address, moving
+    on to the next sentinel with backoff when one can't be reached.
+    """
+    pool = redis.connection_pool
+    backoff = Backoff()
+    while True:
+        for sentinel in pool.sentinel_manager.sentinels:
+            pubsub = sentinel.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(SWITCH_MASTER)
+                backoff.reset()
+                while True:
+                    message = await pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=SENTINEL_TIMEOUT
+                    )
+                    if message is None:
+                        continue
+                    # service old-host old-port new-host new-port
+                    data = message["data"]
+                    if isinstance(data, bytes):
+                        data = data.decode()
+                    parts = data.split()
+                    if len(parts) == 5 and parts[0] == pool.service_name:
+                        address = "%s:%s" % (parts[3], parts[4])
+                        watch_failover.log_debug(  # type: ignore[attr-defined]
+                            "    - new primary %s", address
+                        )
+                        await on_failover(address)
+            except asyncio.CancelledError:
+                raise
+            except RETRY_ERRORS as err:
+                watch_failover.log_debug(  # type: ignore[attr-defined]
+                    "    - sentinel %r error: %r", sentinel, err
+                )
+            finally:
+                await pubsub.reset()
+        await backoff.wait()
@@ -0,0 +1,448 @@
+"""
+Durable Spool for RedisMQ
+"""
+from __future__ import annotations
+
+import os
+import json
+import mmap
+import time
+import zlib
+import struct
+import asyncio
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .debugging import debugging
+from .resilience import Backoff, RETRY_ERRORS
+
+__all__ = ["Spool", "SpoolFullError"]
+
+# spool default settings
+MAX_BYTES = 64 * 1024 * 1024
+SEGMENT_SIZE = 4 * 1024 * 1024
+FSYNC_INTERVAL = 0.05
+REPLAY_BATCH = 100
+
+# each record is its length and crc32 followed by the JSON encoded entry, a
+# zero length marks the end of the records in a segment
+HEADER = struct.Struct("<II")
+
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+
+# entries redis refuses to add are kept here, one JSON list per line
+DEAD_LETTER_FILE = "dead-letter.jsonl"
+
+
+class SpoolFullError(RuntimeError):
+    """
+    Raised when a message does not fit in the spool.
+    """
+
+
+@debugging
+class _Segment:
+    """
+    An append-only file of records, mapped into memory.
+    """
+
+    seq: int
+    path: str
+    size: int
+    end: int
+    mm: mmap.mmap
+
+    log_debug: Callable[..., None]
+
+    def __init__(self, path: str, seq: int, size: int = 0) -> None:
+        """
+        Open a segment, making it size bytes when it is new.
+        """
+        self.seq = seq
+        self.path = path
+        with open(path, "a+b") as segment_file:
+            current = os.fstat(segment_file.fileno()).st_size
+            if current < size:
+                segment_file.truncate(size)
+                current = size
+            self.size = current
+            self.mm = mmap.mmap(segment_file.fileno(), current)
+        self.end = 0
+
+    def records(
+        self, offset: int = 0, limit: Optional[int] = None
+    ) -> List[Tuple[int, int, bytes]]:
+        """
+        Return the (offset, next_offset, data) of the valid records from
+        offset to the end, or at most limit of them.
+        """
+        records: List[Tuple[int, int, bytes]] = []
+        while offset + HEADER.size <= self.size:
+            if limit is not None and len(records) >= limit:
+                break
+            length, crc = HEADER.unpack_from(self.mm, offset)
+            start = offset + HEADER.size
+            if not length or start + length > self.size:
+                break
+            data = self.mm[start : start + length]
+            if zlib.crc32(data) != crc:
+                _Segment.log_debug("    - torn record at %r in %r", offset, self.path)
+                break
+            records.append((offset, start + length, data))
+            offset = start + length
+        return records
+
+    def recover(self) -> int:
+        """
+        Find the end of the valid records and clear anything after it, left
+        by a write that was interrupted.  Returns the number of records.
+        """
+        records = self.records()
+        self.end = records[-1][1] if records else 0
+        if self.end < self.size and any(self.mm[self.end : self.end + HEADER.size]):
+            self.mm[self.end :] = bytes(self.size - self.end)
+        return len(records)
+
+    def room(self) -> int:
+        """
+        Return the number of bytes that can still be appended.
+        """
+        return self.size - self.end
+
+    def append(self, data: bytes) -> None:
+        """
+        Add a record at the end.
+        """
+        start = self.end + HEADER.size
+        self.mm[start : start + len(data)] = data
+        # the header goes last so a torn write is never valid
+        HEADER.pack_into(self.mm, self.end, len(data), zlib.crc32(data))
+        self.end = start + len(data)
+
+    def flush(self) -> None:
+        """
+        Write the changes to the disk.
+        """
+        self.mm.flush()
+
+    def close(self) -> None:
+        """
+        Unmap the file.
+        """
+        self.mm.close()
+
+
+@debugging
+class Spool:
+    """
+    A bounded, crash-safe queue of stream entries on the disk for a producer
+    to use while redis is unavailable.  Entries are appended to mmap-backed
+    segment files, which are flushed to the disk at most every
+    fsync_interval seconds, and replayed in order in pipelined batches.  The
+    replay position is kept in a cursor file so a restarted process picks
+    up where it left off.  An entry redis refuses to add (a WRONGTYPE or OOM
+    error, a bad option) is moved to the dead letter file rather than
+    holding up the ones behind it.
+    """
+
+    directory: str
+    max_bytes: int
+    segment_size: int
+    fsync_interval: float
+    replay_batch: int
+
+    segments: List[_Segment]
+    read_offset: int
+    depth: int
+    bytes: int
+    counters: Dict[str, int]
+
+    flush_handle: Optional[asyncio.Handle]
+    replay_task: Optional[asyncio.Task]
+
+    log_debug: Callable[..., None]
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = MAX_BYTES,
+        segment_size: int = SEGMENT_SIZE,
+        fsync_interval: float = FSYNC_INTERVAL,
+        replay_batch: int = REPLAY_BATCH,
+    ) -> None:
+        """
+        default constructor, recovers what is already in the directory
+        """
+        Spool.log_debug("__init__ %r", directory)
+        if segment_size <= HEADER.size:
+            raise ValueError("segment_size is too small")
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_size = segment_size
+        self.fsync_interval = fsync_interval
+        self.replay_batch = replay_batch
+
+        self.segments = []
+        self.read_offset = 0
+        self.depth = 0
+        self.bytes = 0
+        self.counters = {
+            "spooled": 0,
+            "replayed": 0,
+            "rejected": 0,
+            "recovered": 0,
+            "dead_lettered": 0,
+        }
+
+        self.flush_handle = None
+        self.replay_task = None
+
+        os.makedirs(directory, exist_ok=True)
+        self.recover()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def recover(self) -> None:
+        """
+        Open the segments in the directory, skip the records before the
+        cursor and drop the ones that were not completely written.
+        """
+        cursor_seq, cursor_offset = 0, 0
+        try:
+            with open(self._path(CURSOR_FILE)) as cursor_file:
+                cursor_seq, cursor_offset = map(int, cursor_file.read().split())
+        except (OSError, ValueError):
+            pass
+
+        seqs = sorted(
+            int(name[: -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX) and name[: -len(SEGMENT_SUFFIX)].isdigit()
+        )
+        for seq in seqs:
+            path = self._path("%016d%s" % (seq, SEGMENT_SUFFIX))
+            if seq < cursor_seq:
+                os.remove(path)
+                continue
+            try:
+                segment = _Segment(path, seq)
+            except ValueError:
+                # created but never written
+                os.remove(path)
+                continue
+            segment.recover()
+            self.segments.append(segment)
+
+        if self.segments and self.segments[0].seq == cursor_seq:
+            self.read_offset = min(cursor_offset, self.segments[0].end)
+
+        for index, segment in enumerate(self.segments):
+            records = segment.records(self.read_offset if index == 0 else 0)
+            self.depth += len(records)
+            self.bytes += sum(end - start for start, end, _ in records)
+        self.counters["recovered"] = self.depth
+        Spool.log_debug("    - recovered %r entries", self.depth)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return a snapshot of the spool depth and counters.
+        """
+        stats: Dict[str, Any] = dict(self.counters)
+        stats["depth"] = self.depth
+        stats["bytes"] = self.bytes
+        stats["segments"] = len(self.segments)
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+    def append(
+        self, stream_name: str, payload: Dict[str, str], options: Dict[str, Any]
+    ) -> None:
+        """
+        Add an entry for the stream, with the options of the XADD.
+        """
+        data = json.dumps([stream_name, payload, options]).encode()
+        needed = HEADER.size + len(data)
+        if self.bytes + needed > self.max_bytes:
+            self.counters["rejected"] += 1
+            raise SpoolFullError(
+                "spool of %d bytes can't take %d more" % (self.bytes, needed)
+            )
+
+        # the last segment has an end marker unless it is exactly full
+        if not self.segments or self.segments[-1].room() < needed:
+            seq = 1
+            if self.segments:
+                seq = self.segments[-1].seq + 1
+                self.segments[-1].flush()
+            segment = _Segment(
+                self._path("%016d%s" % (seq, SEGMENT_SUFFIX)),
+                seq,
+                max(self.segment_size, needed),
+            )
+            if len(self.segments) == 1 and self.read_offset == self.segments[0].end:
+                # the only segment has been replayed
+                self._drop_first()
+            self.segments.append(segment)
+
+        self.segments[-1].append(data)
+        self.depth += 1
+        self.bytes += needed
+        self.counters["spooled"] += 1
+        self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        """
+        Flush soon, batching the writes that come before then.
+        """
+        if self.flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        self.flush_handle = loop.call_later(self.fsync_interval, self.flush)
+
+    def flush(self) -> None:
+        """
+        Write the segments to the disk.
+        """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.segments:
+            self.segments[-1].flush()
+
+    def peek(self, count: int) -> List[Tuple[str, Dict[str, str], Dict[str, Any]]]:
+        """
+        Return up to count entries from the front of the spool.
+        """
+        entries: List[Tuple[str, Dict[str, str], Dict[str, Any]]] = []
+        for index, segment in enumerate(self.segments):
+            offset = self.read_offset if index == 0 else 0
+            for _, _, data in segment.records(offset, count - len(entries)):
+                stream_name, payload, options = json.loads(data)
+                entries.append((stream_name, payload, options))
+            if len(entries) >= count:
+                break
+        return entries
+
+    def commit(self, count: int) -> None:
+        """
+        Remove count entries from the front of the spool once they have
+        been added to their streams, and save the position.
+        """
+        while count and self.segments:
+            records = self.segments[0].records(self.read_offset, count)
+            if records:
+                self.read_offset = records[-1][1]
+                self.depth -= len(records)
+                self.bytes -= sum(end - start for start, end, _ in records)
+                self.counters["replayed"] += len(records)
+                count -= len(records)
+            if len(self.segments) > 1 and not self.segments[0].records(
+                self.read_offset, 1
+            ):
+                self._drop_first()
+            elif not records:
+                break
+        self._save_cursor()
+
+    def _drop_first(self) -> None:
+        """
+        Remove the first segment, which has been replayed.
+        """
+        segment = self.segments.pop(0)
+        Spool.log_debug("    - removing %r", segment.path)
+        segment.close()
+        os.remove(segment.path)
+        self.read_offset = 0
+
+    def _save_cursor(self) -> None:
+        """
+        Save the replay position, replacing the old one in one step.
+        """
+        seq = self.segments[0].seq if self.segments else 0
+        path = self._path(CURSOR_FILE)
+        with open(path + ".tmp", "w") as cursor_file:
+            cursor_file.write("%d %d" % (seq, self.read_offset))
+            cursor_file.flush()
+            os.fsync(cursor_file.fileno())
+        os.replace(path + ".tmp", path)
+
+    def start_replay(self, redis: Any, on_restored: Optional[Callable] = None) -> None:
+        """
+        Start adding the spooled entries to their streams, unless it is
+        already happening.
+        """
+        if self.replay_task is None or self.replay_task.done():
+            self.replay_task = asyncio.ensure_future(self.replay(redis, on_restored))
+
+    async def replay(self, redis: Any, on_restored: Optional[Callable] = None) -> None:
+        """
+        Add the spooled entries to their streams in pipelined batches,
+        waiting with backoff while redis is unavailable, until the spool is
+        empty.
+        """
+        Spool.log_debug("replay")
+        backoff = Backoff()
+        while self.depth:
+            entries = self.peek(self.replay_batch)
+            pipe = redis.pipeline(transaction=False)
+            for stream_name, payload, options in entries:
+                kwargs: Dict[str, Any] = {"approximate": options.get("approximate")}
+                if options.get("retention", None) is not None:
+                    kwargs["minid"] = int((time.time() - options["retention"]) * 1000)
+                else:
+                    kwargs["maxlen"] = options.get("maxlen", None)
+                pipe.xadd(stream_name, payload, **kwargs)
+            try:
+                results = await pipe.execute(raise_on_error=False)
+            except RETRY_ERRORS as err:
+                Spool.log_debug("    - replay failed: %r", err)
+                await backoff.wait()
+                continue
+
+            if on_restored is not None:
+                on_restored()
+            backoff.reset()
+            failed = [
+                (entry, result)
+                for entry, result in zip(entries, results)
+                if isinstance(result, Exception)
+            ]
+            if failed:
+                self.dead_letter(failed)
+            self.commit(len(entries))
+            Spool.log_debug("    - replayed %d, depth %d", len(entries), self.depth)
+
+    def dead_letter(self, failed: List[Tuple[Any, Exception]]) -> None:
+        """
+        Save the entries redis refused to add, with the errors, in the dead
+        letter file.
+        """
+        Spool.log_debug("dead_letter %r", failed)
+        with open(self._path(DEAD_LETTER_FILE), "a") as dead_letter_file:
+            for (stream_name, payload, options), err in failed:
+                dead_letter_file.write(
+                    json.dumps([stream_name, payload, options, str(err)]) + "\n"
+                )
+            dead_letter_file.flush()
+            os.fsync(dead_letter_file.fileno())
+        self.counters["dead_lettered"] += len(failed)
+
+    def close(self) -> None:
+        """
+        Flush and close the segments, the entries that have not been
+        replayed are kept for next time.
+        """
+        Spool.log_debug("close")
+        if self.replay_task is not None:
+            self.replay_task.cancel()
+        self.flush()
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
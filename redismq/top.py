@@ -0,0 +1,116 @@
+"""
+Live view of RedisMQ streams
+
+    python -m redismq.top redis://localhost mystream [otherstream ...]
+"""
+
+from __future__ import annotations
+
+import sys
+import asyncio
+import argparse
+
+from typing import Any, Dict, List, Optional
+
+from .debugging import debugging
+from .client import Client
+
+# seconds between refreshes
+INTERVAL = 2.0
+
+# clear the screen and move the cursor home
+CLEAR = "\x1b[2J\x1b[H"
+
+
+def _seconds(value: Optional[float]) -> str:
+    """
+    Format a number of seconds, or a dash when there is no value.
+    """
+    if value is None:
+        return "-"
+    return "%.1fs" % (value,)
+
+
+def format_stats(stats: Dict[str, Dict[str, Any]]) -> str:
+    """
+    Format the results of Client.stats_many() as a table.
+    """
+    lines: List[str] = [
+        "%-24s %-16s %8s %8s %8s %10s"
+        % ("STREAM/CONSUMER", "GROUP", "LENGTH", "LAG", "PENDING", "AGE/IDLE")
+    ]
+    for stream_name, stream_stats in stats.items():
+        lines.append("%-24s %-16s %8d" % (stream_name, "", stream_stats["length"]))
+        for group_name, group_stats in stream_stats["groups"].items():
+            lag = group_stats["lag"]
+            lines.append(
+                "%-24s %-16s %8s %8s %8d %10s"
+                % (
+                    "",
+                    group_name,
+                    "",
+                    "-" if lag is None else lag,
+                    group_stats["pending"],
+                    _seconds(group_stats["oldest_pending_age"]),
+                )
+            )
+            for consumer_name, consumer_stats in group_stats["consumers"].items():
+                lines.append(
+                    "  %-22s %-16s %8s %8s %8d %10s"
+                    % (
+                        consumer_name,
+                        "",
+                        "",
+                        "",
+                        consumer_stats["pending"],
+                        _seconds(consumer_stats["idle"]),
+                    )
+                )
+    return "\n".join(lines)
+
+
+@debugging
+async def top(address: str, stream_names: List[str], interval: float) -> None:
+    """
+    Refresh the statistics of the streams until interrupted.
+    """
+    top.log_debug("top %r %r", address, stream_names)  # type: ignore[attr-defined]
+
+    client = await Client.connect(address)
+    client.stats_ttl = interval / 2.0
+    try:
+        while True:
+            stats = await client.stats_many(stream_names)
+            sys.stdout.write(CLEAR + format_stats(stats) + "\n")
+            sys.stdout.flush()
+            await asyncio.sleep(interval)
+    finally:
+        await client.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Parse the command line and run the live view.
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m redismq.top", description="live view of RedisMQ streams"
+    )
+    parser.add_argument("address", help="redis URL, for example redis://localhost")
+    parser.add_argument("streams", nargs="+", help="stream names")
+    parser.add_argument(
+        "-i",
+        "--interval",
+        type=float,
+        default=INTERVAL,
+        help="seconds between refreshes (default %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(top(args.address, args.streams, args.interval))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
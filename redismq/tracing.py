@@ -0,0 +1,174 @@
+"""
+Tracing for RedisMQ
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import random
+
+from typing import Any, Callable, Dict, Optional
+
+from .debugging import debugging
+
+__all__ = ["Tracer", "new_traceparent", "child_traceparent"]
+
+# W3C trace context version and the sampled flag
+TRACE_VERSION = "00"
+SAMPLED = 0x01
+
+# the events of a timeline in the order they happen
+EVENTS = ("enqueue", "delivered", "handler_start", "handler_end", "publish", "response")
+
+
+def new_traceparent(sampled: bool = True) -> str:
+    """
+    Return a traceparent header value that starts a new trace.
+    """
+    return "%s-%s-%s-%02x" % (
+        TRACE_VERSION,
+        os.urandom(16).hex(),
+        os.urandom(8).hex(),
+        SAMPLED if sampled else 0,
+    )
+
+
+def parse_traceparent(traceparent: str) -> Optional[Dict[str, Any]]:
+    """
+    Split a traceparent header value into its fields, None if it is not
+    valid.
+    """
+    parts = traceparent.strip().split("-")
+    if len(parts) < 4 or parts[0] == "ff":
+        return None
+    version, trace_id, parent_id, flags = parts[:4]
+    try:
+        if len(trace_id) != 32 or int(trace_id, 16) == 0:
+            return None
+        if len(parent_id) != 16 or int(parent_id, 16) == 0:
+            return None
+        trace_flags = int(flags, 16)
+    except ValueError:
+        return None
+    return {
+        "version": version,
+        "trace_id": trace_id,
+        "parent_id": parent_id,
+        "flags": trace_flags,
+    }
+
+
+def child_traceparent(traceparent: str) -> str:
+    """
+    Return the traceparent of a new span in the same trace.
+    """
+    fields = parse_traceparent(traceparent)
+    if fields is None:
+        return new_traceparent()
+    return "%s-%s-%s-%02x" % (
+        TRACE_VERSION,
+        fields["trace_id"],
+        os.urandom(8).hex(),
+        fields["flags"],
+    )
+
+
+@debugging
+class Tracer:
+    """
+    Decides which messages are traced and collects their timelines.  A
+    message that continues a trace is traced when its traceparent is sampled,
+    a new trace is started for sample_rate of the other messages.  Completed
+    timelines are passed to the sink.
+    """
+
+    sample_rate: float
+    sink: Optional[Callable[[Dict[str, Any]], Any]]
+
+    log_debug: Callable[..., None]
+
+    def __init__(
+        self,
+        sample_rate: float = 1.0,
+        sink: Optional[Callable[[Dict[str, Any]], Any]] = None,
+    ) -> None:
+        """
+        default constructor
+        """
+        Tracer.log_debug("__init__ %r %r", sample_rate, sink)
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate must be between 0 and 1")
+
+        self.sample_rate = sample_rate
+        self.sink = sink
+
+    def start(self, traceparent: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Return the trace context for a new message, None if it is not
+        sampled.
+        """
+        if traceparent is not None:
+            fields = parse_traceparent(traceparent)
+            if fields is not None:
+                if not fields["flags"] & SAMPLED:
+                    return None
+                traceparent = child_traceparent(traceparent)
+            else:
+                traceparent = None
+
+        if traceparent is None:
+            if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+                return None
+            traceparent = new_traceparent()
+
+        return {"traceparent": traceparent, "timeline": {"enqueue": time.time()}}
+
+    @staticmethod
+    def encode(trace: Dict[str, Any]) -> str:
+        """
+        Encode a trace context for a stream entry field.
+        """
+        return json.dumps(trace)
+
+    @staticmethod
+    def decode(value: Optional[str]) -> Optional[Dict[str, Any]]:
+        """
+        Decode the trace context of a stream entry field, None if it is
+        missing or not valid.
+        """
+        if not value:
+            return None
+        try:
+            trace = json.loads(value)
+        except ValueError:
+            return None
+        if not isinstance(trace, dict) or "traceparent" not in trace:
+            return None
+        trace.setdefault("timeline", {})
+        return trace
+
+    def finish(self, trace: Dict[str, Any]) -> None:
+        """
+        Pass a completed trace to the sink.
+        """
+        Tracer.log_debug("finish %r", trace)
+        if self.sink is None:
+            return
+        try:
+            self.sink(trace)
+        except Exception as err:  # pylint: disable=broad-except
+            Tracer.log_debug("    - sink error: %r", err)
+
+    @staticmethod
+    def durations(trace: Dict[str, Any]) -> Dict[str, float]:
+        """
+        Return the seconds between each pair of consecutive events in the
+        timeline, like {"enqueue-delivered": 0.003, ...}.
+        """
+        timeline = trace.get("timeline", {})
+        events = [event for event in EVENTS if event in timeline]
+        return {
+            "%s-%s" % (first, second): timeline[second] - timeline[first]
+            for first, second in zip(events, events[1:])
+        }
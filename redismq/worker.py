@@ -0,0 +1,370 @@
+"""
+Worker Processes for RedisMQ
+
+    python -m redismq worker module:handler redis://localhost mystream mygroup \
+        --processes 4 --concurrency 8
+"""
+from __future__ import annotations
+
+import os
+import signal
+import socket
+import asyncio
+import argparse
+import importlib
+import multiprocessing
+
+from typing import Any, Callable, Dict, List, Optional
+
+from .debugging import debugging
+from .client import Client
+from .resilience import Backoff, RETRY_ERRORS
+
+# seconds between checks on the worker processes
+SUPERVISE_INTERVAL = 0.5
+
+# seconds a worker has to finish its handlers when it is stopped
+SHUTDOWN_TIMEOUT = 30.0
+
+# a worker that ran this many seconds restarts without a delay
+HEALTHY_RUN = 10.0
+
+# pending messages handed over to a new worker in one call
+CLAIM_COUNT = 100
+
+# attempts at each call that hands over the messages of a worker while the
+# connection is down
+HAND_OVER_ATTEMPTS = 10
+
+
+def load_handler(target: str) -> Callable[..., Any]:
+    """
+    Import a handler given as "package.module:function", the function may
+    be an attribute path like "module:Class.method".
+    """
+    module_name, _, attr_path = target.partition(":")
+    if not module_name or not attr_path:
+        raise ValueError("handler must look like module:function, not %r" % target)
+
+    obj: Any = importlib.import_module(module_name)
+    for attr in attr_path.split("."):
+        obj = getattr(obj, attr)
+    if not callable(obj):
+        raise TypeError("%r is not callable" % (target,))
+    return obj
+
+
+async def run_consumer(
+    address: str,
+    stream_name: str,
+    group_name: str,
+    consumer_name: str,
+    handler: Callable[..., Any],
+    concurrency: int,
+) -> None:
+    """
+    Serve the stream until SIGTERM or SIGINT, then finish the running
+    handlers and close the client.
+    """
+    client = await Client.connect(address)
+    consumer = await client.consumer(stream_name, group_name, consumer_name)
+
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, consumer.stop)
+    try:
+        await consumer.serve(handler, concurrency)
+    finally:
+        await client.close()
+
+
+def worker_main(options: Dict[str, Any], consumer_name: str) -> None:
+    """
+    Entry point of a worker process.
+    """
+    handler = load_handler(options["handler"])
+    asyncio.run(
+        run_consumer(
+            options["address"],
+            options["stream"],
+            options["group"],
+            consumer_name,
+            handler,
+            options["concurrency"],
+        )
+    )
+
+
+@debugging
+class Supervisor:
+    """
+    Runs a consumer in each of a number of worker processes.  Each worker
+    gets a new consumer name, when one exits its pending messages are handed
+    over to the worker that replaces it and its name is removed from the
+    group.
+    """
+
+    options: Dict[str, Any]
+    processes: int
+    prefix: str
+
+    workers: Dict[int, Any]
+    names: Dict[int, str]
+    started: Dict[int, float]
+    backoffs: Dict[int, Backoff]
+    generation: int
+    stopping: bool
+
+    log_debug: Callable[..., None]
+
+    def __init__(
+        self,
+        handler: str,
+        address: str,
+        stream_name: str,
+        group_name: str,
+        processes: int = 1,
+        concurrency: int = 1,
+        prefix: Optional[str] = None,
+    ) -> None:
+        """
+        default constructor
+        """
+        Supervisor.log_debug("__init__ %r %r %r", handler, stream_name, group_name)
+        if processes < 1:
+            raise ValueError("processes must be positive")
+
+        self.options = {
+            "handler": handler,
+            "address": address,
+            "stream": stream_name,
+            "group": group_name,
+            "concurrency": concurrency,
+        }
+        self.processes = processes
+        self.prefix = prefix or "%s-%d" % (socket.gethostname(), os.getpid())
+
+        # by slot number
+        self.workers = {}
+        self.names = {}
+        self.started = {}
+        self.backoffs = {}
+
+        self.generation = 0
+        self.stopping = False
+
+    def next_name(self, slot: int) -> str:
+        """
+        Return a consumer name that has not been used before.
+        """
+        self.generation += 1
+        return "%s-%d.%d" % (self.prefix, slot, self.generation)
+
+    def start(self, slot: int, consumer_name: str) -> None:
+        """
+        Start a worker process in a slot, spawned rather than forked so it
+        doesn't inherit the event loop.
+        """
+        Supervisor.log_debug("start %r %r", slot, consumer_name)
+        context = multiprocessing.get_context("spawn")
+        process = context.Process(
+            target=worker_main,
+            args=(self.options, consumer_name),
+            name=consumer_name,
+            daemon=False,
+        )
+        process.start()
+        self.workers[slot] = process
+        self.names[slot] = consumer_name
+        self.started[slot] = asyncio.get_running_loop().time()
+
+    def stop(self) -> None:
+        """
+        Stop restarting workers and ask them to finish.
+        """
+        Supervisor.log_debug("stop")
+        self.stopping = True
+        for process in self.workers.values():
+            if process.is_alive():
+                process.terminate()
+
+    async def hand_over(
+        self, client: Client, old_name: str, new_name: Optional[str]
+    ) -> bool:
+        """
+        Give the pending messages of a consumer to another one and remove it
+        from the group.  Without another consumer it is only removed when it
+        has nothing pending, so its messages are not lost.  Each call is
+        tried again while the connection is down, HAND_OVER_ATTEMPTS times.
+        """
+        Supervisor.log_debug("hand_over %r %r", old_name, new_name)
+        stream_name = self.options["stream"]
+        group_name = self.options["group"]
+        redis = client.redis
+        backoff = Backoff()
+
+        while True:
+            pending = await backoff.call(
+                redis.xpending_range,
+                stream_name,
+                group_name,
+                min="-",
+                max="+",
+                count=CLAIM_COUNT,
+                consumername=old_name,
+                max_attempts=HAND_OVER_ATTEMPTS,
+            )
+            if not pending:
+                break
+            if new_name is None:
+                Supervisor.log_debug("    - %d pending, keeping it", len(pending))
+                return False
+            message_ids = [info["message_id"] for info in pending]
+            await backoff.call(
+                redis.xclaim,
+                stream_name,
+                group_name,
+                new_name,
+                0,
+                message_ids,
+                justid=True,
+                max_attempts=HAND_OVER_ATTEMPTS,
+            )
+            Supervisor.log_debug("    - handed over %r", message_ids)
+
+        await backoff.call(
+            redis.xgroup_delconsumer,
+            stream_name,
+            group_name,
+            old_name,
+            max_attempts=HAND_OVER_ATTEMPTS,
+        )
+        return True
+
+    async def run(self) -> None:
+        """
+        Start the workers and replace the ones that exit until stop() is
+        called or the process gets SIGTERM or SIGINT, then wait for them to
+        finish, which they are also given when this fails.
+        """
+        Supervisor.log_debug("run")
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.stop)
+
+        client = await Client.connect(self.options["address"])
+        try:
+            for slot in range(self.processes):
+                self.backoffs[slot] = Backoff(base=0.5, cap=30.0)
+                self.start(slot, self.next_name(slot))
+
+            while not self.stopping:
+                await asyncio.sleep(SUPERVISE_INTERVAL)
+                for slot, process in list(self.workers.items()):
+                    if self.stopping or process.is_alive():
+                        continue
+                    await self.restart(client, slot, process)
+        finally:
+            # don't leave the workers running without a supervisor
+            self.stopping = True
+            try:
+                await self.shut_down(client)
+            finally:
+                for signum in (signal.SIGTERM, signal.SIGINT):
+                    loop.remove_signal_handler(signum)
+                await client.close()
+
+    async def restart(self, client: Client, slot: int, process: Any) -> None:
+        """
+        Replace a worker that exited, with a delay when it keeps crashing.
+        """
+        old_name = self.names[slot]
+        Supervisor.log_debug("    - %r exited with %r", old_name, process.exitcode)
+        process.join()
+
+        backoff = self.backoffs[slot]
+        if asyncio.get_running_loop().time() - self.started[slot] >= HEALTHY_RUN:
+            backoff.reset()
+        else:
+            await backoff.wait()
+            if self.stopping:
+                return
+
+        new_name = self.next_name(slot)
+        await self.hand_over(client, old_name, new_name)
+        self.start(slot, new_name)
+
+    async def shut_down(self, client: Client) -> None:
+        """
+        Wait for the workers to finish, kill the ones that take too long,
+        and remove their names from the group.  A name that can't be removed
+        while the connection is down is left, its messages can still be
+        claimed as stale.
+        """
+        Supervisor.log_debug("shut_down")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SHUTDOWN_TIMEOUT
+        for process in self.workers.values():
+            if process.is_alive():
+                process.terminate()
+        while any(process.is_alive() for process in self.workers.values()):
+            if loop.time() >= deadline:
+                for process in self.workers.values():
+                    if process.is_alive():
+                        Supervisor.log_debug("    - killing %r", process.name)
+                        process.kill()
+                break
+            await asyncio.sleep(0.1)
+
+        for slot, process in self.workers.items():
+            process.join()
+            try:
+                await self.hand_over(client, self.names[slot], None)
+            except RETRY_ERRORS as err:
+                Supervisor.log_debug("    - hand over exception: %r", err)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Parse the command line and run the workers.
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m redismq worker",
+        description="serve a stream with a handler in worker processes",
+    )
+    parser.add_argument("handler", help="module:function called with each payload")
+    parser.add_argument("address", help="redis URL, for example redis://localhost")
+    parser.add_argument("stream", help="stream name")
+    parser.add_argument("group", help="consumer group name")
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes (default %(default)s)",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=1,
+        help="messages handled at a time by each process (default %(default)s)",
+    )
+    parser.add_argument(
+        "--prefix", help="start of the consumer names (default host-pid)"
+    )
+    args = parser.parse_args(argv)
+
+    # fail here rather than in every worker
+    load_handler(args.handler)
+
+    supervisor = Supervisor(
+        args.handler,
+        args.address,
+        args.stream,
+        args.group,
+        processes=args.processes,
+        concurrency=args.concurrency,
+        prefix=args.prefix,
+    )
+    asyncio.run(supervisor.run())
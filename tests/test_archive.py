@@ -0,0 +1,114 @@
+"""
+Test Archive
+"""
+import os
+import asyncio
+import pytest  # type: ignore
+from tests.utils import TEST_URL  # type: ignore
+from redismq import Client, Archiver, ArchiveReader
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_archive(tmp_path) -> None:
+    "test entries are archived in segments, trimmed and read back by ID and time"
+    mq_connection = await Client.connect(TEST_URL)
+    await mq_connection.redis.delete("archivestream")
+    my_producer = await mq_connection.producer("archivestream", maxlen=None)
+    msg_ids = [await my_producer.addUnconfirmedMessage(i) for i in range(50)]
+
+    archiver = Archiver(
+        mq_connection,
+        "archivestream",
+        str(tmp_path),
+        segment_size=200,
+        block_size=7,
+        trim=True,
+    )
+    while await archiver.run_once(block_ms=10):
+        pass
+    stats = archiver.stats()
+    assert stats["archived"] == 50 and stats["blocks"] == 8
+    assert stats["segments"] > 1 and stats["last_id"] == msg_ids[-1]
+    assert await mq_connection.redis.xlen("archivestream") == 0
+
+    reader = ArchiveReader(str(tmp_path))
+    assert [entry.message for entry in reader.read()] == list(range(50))
+    assert [entry.msg_id for entry in reader.read(msg_ids[9], msg_ids[30])] == (
+        msg_ids[9:31]
+    )
+    first = next(reader.read())
+    assert next(reader.read(first.timestamp)).msg_id == msg_ids[0]
+    assert list(reader.read("0-1", "0-2")) == []
+
+    # run() picks up the new entries until stopped
+    run_task = asyncio.create_task(archiver.run())
+    msg_ids.append(await my_producer.addUnconfirmedMessage(50))
+    while archiver.last_id != msg_ids[-1]:
+        await asyncio.sleep(0.01)
+    archiver.stop()
+    await asyncio.wait_for(run_task, 2.0)
+    archiver.close()
+    assert [entry.message for entry in reader.read(msg_ids[-1])] == [50]
+
+    await mq_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_archive_recovery(tmp_path) -> None:
+    "test a restarted archiver continues after the last complete block"
+    mq_connection = await Client.connect(TEST_URL)
+    await mq_connection.redis.delete("archiverecovery")
+    my_producer = await mq_connection.producer("archiverecovery", maxlen=None)
+    msg_ids = [await my_producer.addUnconfirmedMessage(i) for i in range(10)]
+
+    archiver = Archiver(mq_connection, "archiverecovery", str(tmp_path), block_size=4)
+    assert await archiver.run_once(block_ms=10) == 4
+    archiver.close()
+
+    # a block that was only partly written at the end, and a lost index
+    last = sorted(name for name in os.listdir(tmp_path) if name.endswith(".arc"))[-1]
+    with open(tmp_path / last, "ab") as segment_file:
+        segment_file.write(b"\x20\0\0\0\x01\x02\x03\x04garbage")
+    os.remove(tmp_path / last.replace(".arc", ".idx"))
+
+    archiver = Archiver(mq_connection, "archiverecovery", str(tmp_path), block_size=4)
+    assert archiver.last_id == msg_ids[3]
+    while await archiver.run_once(block_ms=10):
+        pass
+    archiver.close()
+    assert await mq_connection.redis.xlen("archiverecovery") == 10
+
+    reader = ArchiveReader(str(tmp_path))
+    assert [entry.msg_id for entry in reader.read()] == msg_ids
+    assert [entry.message for entry in reader.read(msg_ids[5])] == list(range(5, 10))
+
+    await mq_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_archive_trim_groups(tmp_path) -> None:
+    "test the stream is not trimmed past entries a group still needs"
+    mq_connection = await Client.connect(TEST_URL)
+    await mq_connection.redis.delete("archivegroups")
+    my_consumer = await mq_connection.consumer("archivegroups", "mygroup", "c1")
+    my_producer = await mq_connection.producer("archivegroups", maxlen=None)
+    msg_ids = [await my_producer.addUnconfirmedMessage(i) for i in range(6)]
+
+    # the first is pending, the rest have not been delivered
+    payload = await my_consumer.read()
+    archiver = Archiver(mq_connection, "archivegroups", str(tmp_path), trim=True)
+    assert await archiver.run_once(block_ms=10) == 6
+    assert await mq_connection.redis.xlen("archivegroups") == 6
+
+    # once it is acked and the next two read, at most those can go (the
+    # trim is approximate)
+    await payload.ack()
+    for _ in range(2):
+        await (await my_consumer.read()).ack()
+    msg_ids.append(await my_producer.addUnconfirmedMessage(6))
+    assert await archiver.run_once(block_ms=10) == 1
+    entries = await mq_connection.redis.xrange("archivegroups")
+    assert [msg_id for msg_id, _ in entries][-4:] == msg_ids[3:]
+    archiver.close()
+
+    await mq_connection.close()
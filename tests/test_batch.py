@@ -0,0 +1,158 @@
+"""
+Test Batches
+"""
+import time
+import asyncio
+import pytest  # type: ignore
+from tests.utils import TEST_URL  # type: ignore
+from redismq import Client
+from redismq.resilience import Backoff
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_read_batch() -> None:
+    "test reading the messages that are there with one call"
+    mq_connection = await Client.connect(TEST_URL)
+    await mq_connection.redis.delete("batchstream")
+    my_producer = await mq_connection.producer("batchstream")
+    my_consumer = await mq_connection.consumer("batchstream", "mygroup", "consumer1")
+
+    assert await my_consumer.read_batch(max_wait_ms=10) == []
+    for i in range(5):
+        await my_producer.addUnconfirmedMessage(i)
+    payloads = await my_consumer.read_batch(max_batch=3)
+    assert [payload.message for payload in payloads] == [0, 1, 2]
+    payloads += await my_consumer.read_batch(max_batch=3)
+    assert [payload.message for payload in payloads] == [0, 1, 2, 3, 4]
+
+    await my_consumer.ack_batch(payloads, [None] * 5)
+    pending = await mq_connection.redis.xpending("batchstream", "mygroup")
+    assert pending["pending"] == 0
+
+    await mq_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_batch_fills() -> None:
+    "test a batch waits for more messages after the first one"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("batchfill")
+    my_producer = await p_connection.producer("batchfill")
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer("batchfill", "mygroup", "consumer1")
+    sizes = []
+
+    def count(payloads):
+        sizes.append(len(payloads))
+        return [None] * len(payloads)
+
+    serve_task = asyncio.create_task(
+        my_consumer.serve_batch(count, max_batch=5, max_wait_ms=500)
+    )
+    for i in range(5):
+        await my_producer.addUnconfirmedMessage(i)
+        await asyncio.sleep(0.02)
+    while not sizes:
+        await asyncio.sleep(0.01)
+    assert sizes == [5]
+
+    # a batch that doesn't fill is handed over after max_wait_ms
+    start = time.monotonic()
+    await my_producer.addUnconfirmedMessage(5)
+    while len(sizes) < 2:
+        await asyncio.sleep(0.01)
+    assert sizes == [5, 1]
+    assert 0.4 <= time.monotonic() - start < 1.0
+
+    my_consumer.stop()
+    await asyncio.wait_for(serve_task, 1.0)
+    await p_connection.close()
+    await q_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_serve_batch() -> None:
+    "test a batch handler gets lists and its results are the responses"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("batchserve")
+    my_producer = await p_connection.producer("batchserve")
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer("batchserve", "mygroup", "consumer1")
+    sizes = []
+
+    async def double(payloads):
+        sizes.append(len(payloads))
+        results = []
+        for payload in payloads:
+            if payload.message == "bad":
+                results.append(ValueError("bad number"))
+            else:
+                results.append(payload.message * 2)
+        return results
+
+    for i in range(10):
+        await my_producer.addUnconfirmedMessage(i)
+    serve_task = asyncio.create_task(my_consumer.serve_batch(double, max_batch=4))
+    responses = await asyncio.gather(
+        *[my_producer.addConfirmedMessage(message) for message in (1, "bad", 3)]
+    )
+    assert responses[0]["message"] == 2 and responses[0]["error"] is None
+    assert responses[1]["error"] == "bad number"
+    assert responses[2]["message"] == 6
+    assert sizes[:2] == [4, 4]
+    assert sum(sizes) == 13 and max(sizes) <= 4
+
+    my_consumer.stop()
+    await asyncio.wait_for(serve_task, 1.0)
+    pending = await p_connection.redis.xpending("batchserve", "mygroup")
+    assert pending["pending"] == 0
+
+    await p_connection.close()
+    await q_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_serve_batch_retry() -> None:
+    "test messages a batch handler fails are nacked, then acked with the error"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("batchretry")
+    my_producer = await p_connection.producer("batchretry")
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer(
+        "batchretry",
+        "mygroup",
+        "consumer1",
+        claim_interval=0.05,
+        retry_backoff=Backoff(base=0.0, cap=0.0),
+        max_deliveries=3,
+    )
+    attempts = {}
+
+    async def flaky(payloads):
+        results = []
+        for payload in payloads:
+            attempts[payload.message] = attempts.get(payload.message, 0) + 1
+            if payload.message == "bad" or attempts[payload.message] < 2:
+                results.append(ValueError("try again"))
+            else:
+                results.append(payload.message)
+        return results
+
+    serve_task = asyncio.create_task(my_consumer.serve_batch(flaky, max_batch=4))
+    responses = await asyncio.gather(
+        *[my_producer.addConfirmedMessage(message) for message in ("a", "bad", "b")]
+    )
+    assert [response["message"] for response in (responses[0], responses[2])] == [
+        "a",
+        "b",
+    ]
+    assert responses[1]["error"] == "try again"
+    assert attempts == {"a": 2, "bad": 3, "b": 2}
+
+    my_consumer.stop()
+    await asyncio.wait_for(serve_task, 1.0)
+    pending = await p_connection.redis.xpending("batchretry", "mygroup")
+    assert pending["pending"] == 0
+
+    await p_connection.close()
+    await q_connection.close()
@@ -0,0 +1,109 @@
+"""
+Test Response Cache
+"""
+import asyncio
+import pytest  # type: ignore
+from redis import exceptions # type: ignore[attr-defined]
+
+from tests.utils import TEST_URL  # type: ignore
+from redismq import Client, Consumer, ResponseCache
+
+
+async def ack_cacheable_messages(my_consumer: Consumer) -> None:
+    "ack confirmed messages with cacheable responses"
+    while True:
+        payload = await my_consumer.read()
+        await payload.ack(f"Acknowledged {payload.message}", cacheable=True)
+
+
+def test_lru_eviction() -> None:
+    "least recently used entries are evicted"
+    cache = ResponseCache(maxsize=2)
+    cache.put("a", {"message": 1})
+    cache.put("b", {"message": 2})
+    assert cache.get("a") == {"message": 1}
+    cache.put("c", {"message": 3})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"message": 1}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_expiration() -> None:
+    "expired entries are not returned"
+    cache = ResponseCache(ttl=60.0)
+    cache.put("a", {"message": 1}, ttl=-1.0)
+    assert cache.get("a") is None
+    assert "a" not in cache.entries
+    cache.put("a", {"message": 1})
+    cache.entries["a"] = (0.0, {"message": 1})
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_cached_confirmed() -> None:
+    "test repeated confirmed messages are answered from the cache"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("cachestream")
+    my_producer = await p_connection.producer(
+        "cachestream", cache=ResponseCache(shared=True)
+    )
+    await p_connection.redis.delete(
+        ResponseCache.shared_key(my_producer.cache_prefix, '"cached"')
+    )
+
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer("cachestream", "mygroup", "consumer1")
+    ack_task = asyncio.create_task(ack_cacheable_messages(my_consumer))
+
+    for i in range(3):
+        response = await my_producer.addConfirmedMessage("cached")
+        assert response == {"message": "Acknowledged cached", "error": None}
+    stats = my_producer.stats()
+    assert stats["sent"] == 1
+    assert stats["cache"]["hits"] == 2
+    assert stats["cache"]["misses"] == 1
+
+    # another producer finds it in the shared tier
+    r_connection = await Client.connect(TEST_URL)
+    your_producer = await r_connection.producer(
+        "cachestream", cache=ResponseCache(shared=True)
+    )
+    response = await your_producer.addConfirmedMessage("cached")
+    assert response["message"] == "Acknowledged cached"
+    assert your_producer.stats()["sent"] == 0
+    assert your_producer.stats()["cache"]["shared_hits"] == 1
+    ack_task.cancel()
+
+    await p_connection.close()
+    await q_connection.close()
+    await r_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_cache_shared_tier_down() -> None:
+    "test a shared tier that can't be read is a miss and the request is sent"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("cachestream")
+    my_producer = await p_connection.producer(
+        "cachestream", cache=ResponseCache(shared=True)
+    )
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer("cachestream", "mygroup", "consumer1")
+    ack_task = asyncio.create_task(ack_cacheable_messages(my_consumer))
+
+    redis = p_connection.redis
+    get, set_ = redis.get, redis.set
+
+    async def down(*args, **kwargs):
+        raise exceptions.ConnectionError("down")
+
+    redis.get, redis.set = down, down
+    response = await my_producer.addConfirmedMessage("uncached")
+    assert response == {"message": "Acknowledged uncached", "error": None}
+    assert my_producer.stats()["cache"]["errors"] == 2
+    redis.get, redis.set = get, set_
+    ack_task.cancel()
+
+    await p_connection.close()
+    await q_connection.close()
@@ -0,0 +1,71 @@
+"""
+Test Cancellation
+"""
+import asyncio
+import pytest  # type: ignore
+from tests.utils import TEST_URL  # type: ignore
+from redismq import Client
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_cancel_running_handler() -> None:
+    "test the handler of a request that timed out is cancelled"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("cancelstream")
+    my_producer = await p_connection.producer("cancelstream", timeout=0.2)
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer("cancelstream", "mygroup", "consumer1")
+    handled = []
+    cancelled = asyncio.Event()
+
+    async def slow(payload) -> str:
+        handled.append(payload)
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return "too late"
+
+    serve_task = asyncio.create_task(my_consumer.serve(slow))
+    response = await my_producer.addConfirmedMessage("slow request")
+    assert response["message"] == "Timeout Error"
+    await asyncio.wait_for(cancelled.wait(), 2.0)
+    assert handled[0].cancelled
+
+    my_consumer.stop()
+    await asyncio.wait_for(serve_task, 1.0)
+    pending = await p_connection.redis.xpending("cancelstream", "mygroup")
+    assert pending["pending"] == 0
+    assert not q_connection.requests
+
+    await p_connection.close()
+    await q_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_cancel_before_read() -> None:
+    "test a request cancelled before it is read is marked cancelled"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("cancelstream")
+    my_producer = await p_connection.producer("cancelstream")
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer("cancelstream", "mygroup", "consumer1")
+
+    request = asyncio.create_task(my_producer.addConfirmedMessage("never mind"))
+    while not await p_connection.redis.xlen("cancelstream"):
+        await asyncio.sleep(0.01)
+    request.cancel()
+    response = await request
+    assert response["message"] == "Cancelled Error"
+    while not q_connection.cancelled_requests:
+        await asyncio.sleep(0.01)
+
+    payload = await my_consumer.read()
+    assert payload.cancelled
+    assert not await payload.send_chunk("anything")
+    await payload.ack()
+    assert not q_connection.cancelled_requests
+
+    await p_connection.close()
+    await q_connection.close()
@@ -7,6 +7,7 @@ from redis import exceptions # type: ignore[attr-defined]
 
 from tests.utils import TEST_URL  # type: ignore
 from redismq import Client
+from redismq.top import format_stats
 
 
 @pytest.mark.asyncio  # type: ignore[misc]
@@ -39,3 +40,36 @@ async def test_client_close_twice() -> None:
     await p_connection.close()
     with pytest.raises(RuntimeError):
         await p_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_client_stats() -> None:
+    "stream statistics are gathered and cached"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("statstream", "nostream")
+    my_producer = await p_connection.producer("statstream")
+    await p_connection.consumer("statstream", "mygroup", "consumer1")
+    for i in range(3):
+        await my_producer.addUnconfirmedMessage(f"message {i}")
+    await p_connection.redis.xreadgroup(
+        groupname="mygroup",
+        consumername="consumer1",
+        count=2,
+        streams={"statstream": b">"},
+    )
+
+    stats = await p_connection.stats("statstream")
+    assert stats["length"] == 3
+    group_stats = stats["groups"]["mygroup"]
+    assert group_stats["pending"] == 2
+    assert group_stats["oldest_pending_age"] >= 0.0
+    assert group_stats["consumers"]["consumer1"]["pending"] == 2
+    assert group_stats["consumers"]["consumer1"]["idle"] >= 0.0
+    assert await p_connection.stats("statstream") is stats
+
+    many_stats = await p_connection.stats_many(["statstream", "nostream"])
+    assert many_stats["statstream"] is stats
+    assert many_stats["nostream"] == {"stream": "nostream", "length": 0, "groups": {}}
+    assert "statstream" in format_stats(many_stats)
+
+    await p_connection.close()
@@ -262,3 +262,80 @@ async def test_cancelled_confirmed() -> None:
 #            await asyncio.sleep(.01)
 #            channels = await p_connection.redis.pubsub_channels()
     await p_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_single_flight_confirmed() -> None:
+    "test identical concurrent confirmed messages share one request"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("flightstream")
+    my_producer = await p_connection.producer("flightstream", single_flight=True)
+
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer("flightstream", "mygroup", "consumer1")
+    confirmed_coros = [my_producer.addConfirmedMessage("same") for i in range(10)]
+    confirmed_coros.append(my_producer.addConfirmedMessage("other"))
+    ack_task = asyncio.create_task(ack_confirmed_messages(my_consumer))
+    responses = await asyncio.gather(*confirmed_coros)
+    assert all(resp["message"] == "Acknowledged same" for resp in responses[:10])
+    assert responses[10]["message"] == "Acknowledged other"
+    ack_task.cancel()
+
+    stats = my_producer.stats()
+    assert stats["confirmed"] == 11
+    assert stats["sent"] == 2
+    assert stats["coalesced"] == 9
+    assert stats["in_flight"] == 0
+
+    # the first caller changes its response before the others get theirs
+    async def first() -> dict:
+        resp = await my_producer.addConfirmedMessage({"nested": "same"})
+        resp["message"]["nested"] = "changed"
+        resp["extra"] = True
+        return resp
+
+    async def ack_nested(my_consumer: Consumer) -> None:
+        while True:
+            payload = await my_consumer.read()
+            await payload.ack(payload.message)
+
+    ack_task = asyncio.create_task(ack_nested(my_consumer))
+    first_task = asyncio.create_task(first())
+    await asyncio.sleep(0)
+    responses = await asyncio.gather(
+        *[my_producer.addConfirmedMessage({"nested": "same"}) for i in range(2)]
+    )
+    assert (await first_task)["message"] == {"nested": "changed"}
+    for resp in responses:
+        assert resp == {"message": {"nested": "same"}, "error": None}
+    assert my_producer.stats()["sent"] == 3
+    ack_task.cancel()
+
+    await p_connection.close()
+    await q_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_sharded_pubsub() -> None:
+    "test replies are spread over several pubsub connections"
+    p_connection = await Client.connect(TEST_URL, pubsub_shards=4)
+    await p_connection.redis.delete("shardstream")
+    my_producer = await p_connection.producer("shardstream")
+    assert len(p_connection.pubsubs) == 4 and len(p_connection.sub_tasks) == 4
+    assert p_connection.pubsub_for("rmq:response.1") is p_connection.pubsub_for(
+        "rmq:response.1"
+    )
+
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer("shardstream", "mygroup", "consumer1")
+    ack_task = asyncio.create_task(ack_confirmed_messages(my_consumer))
+    responses = await asyncio.gather(
+        *[my_producer.addConfirmedMessage(f"message {i}") for i in range(40)]
+    )
+    assert [resp["message"] for resp in responses] == [
+        f"Acknowledged message {i}" for i in range(40)
+    ]
+    ack_task.cancel()
+
+    await p_connection.close()
+    await q_connection.close()
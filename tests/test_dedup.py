@@ -0,0 +1,160 @@
+"""
+Test Deduplication
+"""
+import asyncio
+import pytest  # type: ignore
+from tests.utils import TEST_URL  # type: ignore
+from redismq import Client, Deduplicator
+
+
+def test_deduplicator_lru() -> None:
+    "test the local tier evicts the least recently used keys"
+    dedup = Deduplicator(maxsize=2)
+    dedup.put("a")
+    dedup.put("b")
+    assert "a" in dedup
+    dedup.put("c")
+    assert "a" in dedup and "c" in dedup and "b" not in dedup
+    assert dedup.stats()["evictions"] == 1
+
+    with pytest.raises(ValueError):
+        Deduplicator(ttl=0)
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_duplicates_skipped() -> None:
+    "test copies of a handled message are acked and not handled again"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("dedupstream")
+    my_producer = await p_connection.producer("dedupstream")
+    c_connection = await Client.connect(TEST_URL)
+    dedup = Deduplicator()
+    my_consumer = await c_connection.consumer(
+        "dedupstream", "mygroup", "c1", dedup=dedup
+    )
+    await c_connection.redis.delete(*dedup.shared_keys(my_consumer.dedup_prefix))
+
+    await my_producer.addUnconfirmedMessage("one", idempotency_key="k1")
+    payload = await my_consumer.read()
+    assert payload.idempotency_key == "k1"
+    await payload.ack()
+
+    # the copy is skipped, the next message is read
+    await my_producer.addUnconfirmedMessage("one", idempotency_key="k1")
+    await my_producer.addUnconfirmedMessage("two", idempotency_key="k2")
+    payload = await my_consumer.read()
+    assert payload.message == "two"
+    await payload.ack()
+
+    # batches skip them too
+    await my_producer.addUnconfirmedMessage("one", idempotency_key="k1")
+    await my_producer.addUnconfirmedMessage("three", idempotency_key="k3")
+    batch = await my_consumer.read_batch(10, 100)
+    assert [payload.message for payload in batch] == ["three"]
+    await my_consumer.ack_batch(batch, [None] * len(batch))
+
+    pending = await p_connection.redis.xpending("dedupstream", "mygroup")
+    assert pending["pending"] == 0
+    assert dedup.stats()["duplicates"] == 2
+
+    # another consumer of the group finds the key in the shared tier
+    other_connection = await Client.connect(TEST_URL)
+    other_dedup = Deduplicator()
+    other_consumer = await other_connection.consumer(
+        "dedupstream", "mygroup", "c2", dedup=other_dedup
+    )
+    await my_producer.addUnconfirmedMessage("two", idempotency_key="k2")
+    await my_producer.addUnconfirmedMessage("four", idempotency_key="k4")
+    payload = await other_consumer.read()
+    assert payload.message == "four"
+    await payload.ack()
+    assert other_dedup.stats()["shared_duplicates"] == 1
+
+    await p_connection.close()
+    await c_connection.close()
+    await other_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_idempotent_producer() -> None:
+    "test an idempotent producer tags every message with its own key"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("idemstream")
+    my_producer = await p_connection.producer("idemstream", idempotent=True)
+    c_connection = await Client.connect(TEST_URL)
+    my_consumer = await c_connection.consumer(
+        "idemstream", "mygroup", "c1", dedup=Deduplicator()
+    )
+
+    async def echo(payload):
+        return payload.message
+
+    serve_task = asyncio.create_task(my_consumer.serve(echo))
+    resp = await asyncio.wait_for(my_producer.addConfirmedMessage("hello"), 2.0)
+    assert resp["message"] == "hello"
+    await my_producer.addUnconfirmedMessage("a")
+    await my_producer.addUnconfirmedMessage("b")
+    entries = await p_connection.redis.xrange("idemstream")
+    keys = [fields.get("idempotency_key") for _, fields in entries]
+    assert len(keys) == 3 and len(set(keys)) == 3
+
+    my_consumer.stop()
+    await asyncio.wait_for(serve_task, 2.0)
+    await p_connection.close()
+    await c_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_duplicate_confirmed() -> None:
+    "test a copy of a confirmed request gets the response to the first one"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("dupconfstream")
+    my_producer = await p_connection.producer("dupconfstream")
+    c_connection = await Client.connect(TEST_URL)
+    dedup = Deduplicator()
+    my_consumer = await c_connection.consumer(
+        "dupconfstream", "mygroup", "c1", dedup=dedup
+    )
+    await c_connection.redis.delete(*dedup.shared_keys(my_consumer.dedup_prefix))
+    handled = []
+
+    async def handler(payload):
+        handled.append(payload.message)
+        return "ok %d" % (len(handled),)
+
+    serve_task = asyncio.create_task(my_consumer.serve(handler))
+    for _ in range(2):
+        resp = await asyncio.wait_for(
+            my_producer.addConfirmedMessage("x", idempotency_key="kc1"), 2.0
+        )
+        assert resp["message"] == "ok 1" and resp["error"] is None
+    assert handled == ["x"]
+
+    # without the response there is an error instead of a timeout
+    await c_connection.redis.delete(dedup.response_key(my_consumer.dedup_prefix, "kc1"))
+    resp = await asyncio.wait_for(
+        my_producer.addConfirmedMessage("x", idempotency_key="kc1"), 2.0
+    )
+    assert resp["error"] == "duplicate"
+    assert handled == ["x"]
+
+    my_consumer.stop()
+    await asyncio.wait_for(serve_task, 2.0)
+    await p_connection.close()
+    await c_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_idempotency_keys_unique() -> None:
+    "test producers created together don't make up the same keys"
+    mq_connection = await Client.connect(TEST_URL)
+    producers = [
+        await mq_connection.producer("idemstream%d" % (i,), idempotent=True)
+        for i in range(10)
+    ]
+    keys = {
+        producer._next_idempotency_key()  # pylint: disable=protected-access
+        for producer in producers
+    }
+    assert len(keys) == 10
+    await mq_connection.close()
@@ -0,0 +1,79 @@
+"""
+Test Envelopes
+"""
+import time
+import asyncio
+import pytest  # type: ignore
+from tests.utils import TEST_URL  # type: ignore
+from redismq import Client
+from redismq.envelope import compact, expand
+
+
+def test_envelope_round_trip() -> None:
+    "test the compact envelope has fixed fields and reads back as the classic one"
+    plain = compact({"message": '"hello"'}, "rmq")
+    assert plain == {"h": "AQ", "m": '"hello"'}
+    assert expand(plain, "rmq") == {"message": '"hello"'}
+
+    classic = {
+        "message": "[1, 2]",
+        "response_channel": "rmq:response.123456",
+        "window": "16",
+        "key": "account 7",
+        "trace": "{}",
+    }
+    fields = compact(classic, "rmq", deadline=1700000000.25)
+    assert sorted(fields) == ["h", "m"]
+    assert "response" not in fields["h"]
+    assert expand(fields, "rmq") == dict(classic, deadline=1700000000.25)
+
+    # a channel that is not made from a correlation ID goes along as it is
+    fields = compact({"message": "1", "response_channel": "elsewhere"}, "rmq")
+    assert expand(fields, "rmq") == {"message": "1", "response_channel": "elsewhere"}
+
+    # classic entries are left alone
+    assert expand(classic, "rmq") is classic
+
+    for bad in ({"h": "!!!", "m": "1"}, {"h": "Ag", "m": "1"}, {"h": "AQ"}):
+        with pytest.raises(ValueError):
+            expand(bad, "rmq")
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_compact_producer() -> None:
+    "test a consumer handles messages in both envelopes"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("compactstream")
+    my_producer = await p_connection.producer("compactstream", compact=True)
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer("compactstream", "mygroup", "consumer1")
+
+    async def shout(payload) -> str:
+        assert payload.ordering_key == "k"
+        assert payload.deadline > time.time()
+        return payload.message.upper()
+
+    await my_producer.addUnconfirmedMessage("plain")
+    payload = await my_consumer.read()
+    assert payload.message == "plain"
+    assert payload.response_channel is None and payload.deadline is None
+    await payload.ack()
+
+    serve_task = asyncio.create_task(my_consumer.serve(shout))
+    response = await my_producer.addConfirmedMessage("hello", ordering_key="k")
+    assert response["message"] == "HELLO"
+    entries = await p_connection.redis.xrange("compactstream")
+    assert all(sorted(fields) == ["h", "m"] for _, fields in entries)
+
+    # a broken envelope is acked and skipped
+    await p_connection.redis.xadd("compactstream", {"h": "Aw", "m": "1"})
+    response = await my_producer.addConfirmedMessage("again", ordering_key="k")
+    assert response["message"] == "AGAIN"
+
+    my_consumer.stop()
+    await asyncio.wait_for(serve_task, 1.0)
+    pending = await p_connection.redis.xpending("compactstream", "mygroup")
+    assert pending["pending"] == 0
+
+    await p_connection.close()
+    await q_connection.close()
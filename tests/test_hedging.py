@@ -0,0 +1,96 @@
+"""
+Test Hedging
+"""
+import asyncio
+import pytest  # type: ignore
+from tests.utils import TEST_URL  # type: ignore
+from redismq import Client, HedgePolicy
+
+
+def test_hedge_policy() -> None:
+    "test the delay is learned and hedges are capped by the budget"
+    policy = HedgePolicy(max_ratio=0.25, burst=2, min_samples=10)
+    assert policy.delay() is None
+    for latency in range(1, 101):
+        policy.record(latency / 100.0)
+    assert policy.delay() == 0.96
+
+    hedged = 0
+    for _ in range(100):
+        policy.delay()
+        hedged += policy.allow()
+    assert hedged == 25
+    assert policy.stats()["denied"] == 75
+
+    with pytest.raises(ValueError):
+        HedgePolicy(percentile=100)
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_hedged_request() -> None:
+    "test a request stuck with a slow consumer is answered by another"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("hedgestream")
+    my_producer = await p_connection.producer(
+        "hedgestream", hedge=HedgePolicy(delay=0.05, max_ratio=1.0, burst=1)
+    )
+    slow_connection = await Client.connect(TEST_URL)
+    slow_consumer = await slow_connection.consumer("hedgestream", "mygroup", "slow")
+    fast_connection = await Client.connect(TEST_URL)
+    fast_consumer = await fast_connection.consumer("hedgestream", "mygroup", "fast")
+
+    async def echo(payload):
+        return payload.message
+
+    # the slow consumer reads the request and sits on it
+    request = asyncio.create_task(my_producer.addConfirmedMessage("hello"))
+    slow_payload = await slow_consumer.read()
+    assert slow_payload.idempotency_key == slow_payload.response_channel
+    serve_task = asyncio.create_task(fast_consumer.serve(echo))
+    resp = await asyncio.wait_for(request, 2.0)
+    assert resp["message"] == "hello"
+    assert my_producer.stats()["hedged"] == 1
+
+    # the copy that lost is cancelled
+    while not slow_payload.cancelled:
+        await asyncio.sleep(0.01)
+    await slow_payload.ack("late")
+    entries = await p_connection.redis.xrange("hedgestream")
+    assert len(entries) == 2 and entries[0][1] == entries[1][1]
+
+    fast_consumer.stop()
+    await asyncio.wait_for(serve_task, 2.0)
+    await p_connection.close()
+    await slow_connection.close()
+    await fast_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_hedged_copies_one_client() -> None:
+    "test the copy that lost is cancelled when both are read by one client"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("hedgestream")
+    my_producer = await p_connection.producer(
+        "hedgestream", hedge=HedgePolicy(delay=0.05, max_ratio=1.0, burst=1)
+    )
+    q_connection = await Client.connect(TEST_URL)
+    slow_consumer = await q_connection.consumer("hedgestream", "mygroup", "slow")
+    fast_consumer = await q_connection.consumer("hedgestream", "mygroup", "fast")
+
+    request = asyncio.create_task(my_producer.addConfirmedMessage("hello"))
+    slow_payload = await slow_consumer.read()
+    fast_payload = await asyncio.wait_for(fast_consumer.read(), 2.0)
+    assert fast_payload.response_channel == slow_payload.response_channel
+    assert len(q_connection.requests[slow_payload.response_channel]) == 2
+
+    await fast_payload.ack(fast_payload.message)
+    resp = await asyncio.wait_for(request, 2.0)
+    assert resp["message"] == "hello"
+    while not slow_payload.cancelled:
+        await asyncio.sleep(0.01)
+    assert not fast_payload.cancelled
+    await slow_payload.ack("late")
+    assert not q_connection.requests
+
+    await p_connection.close()
+    await q_connection.close()
@@ -0,0 +1,80 @@
+"""
+Test Adaptive Concurrency
+"""
+import asyncio
+import pytest  # type: ignore
+from tests.utils import TEST_URL  # type: ignore
+from redismq import Client, AdaptiveLimiter
+
+
+async def run_window(limiter: AdaptiveLimiter, latency: float, error: bool = False):
+    "finish a window of handlers, keeping the limiter full"
+    while limiter.in_flight < limiter.limit:
+        await limiter.acquire()
+    for _ in range(max(limiter.min_samples, limiter.limit)):
+        limiter.release(latency, error)
+        if limiter.in_flight < limiter.limit:
+            await limiter.acquire()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_limiter_aimd() -> None:
+    "test the limit grows while latency holds and backs off when it degrades"
+    limiter = AdaptiveLimiter(initial_limit=2, max_limit=8, min_samples=4)
+    for _ in range(10):
+        await run_window(limiter, 0.01)
+    assert limiter.limit == 8
+    assert limiter.stats()["increases"] == 6
+
+    await run_window(limiter, 0.05)
+    assert limiter.limit == 6
+    assert limiter.stats()["decreases"] == 1
+
+    # errors back off even when it is fast
+    await run_window(limiter, 0.01, error=True)
+    assert limiter.limit == 4
+    assert [entry["limit"] for entry in limiter.history][-3:] == [8, 6, 4]
+
+    # nothing more than the limit runs at once
+    while limiter.in_flight > limiter.limit:
+        limiter.release(0.01)
+    waiter = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0.01)
+    assert not waiter.done() and limiter.stats()["waiting"] == 1
+    limiter.release(0.01)
+    await asyncio.wait_for(waiter, 1.0)
+    assert limiter.in_flight == limiter.limit
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_serve_with_limiter() -> None:
+    "test serving a stream with an adaptive limit"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("limitstream")
+    my_producer = await p_connection.producer("limitstream")
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer("limitstream", "mygroup", "consumer1")
+    limiter = AdaptiveLimiter(initial_limit=1, max_limit=4, min_samples=2)
+    running = {"now": 0, "most": 0}
+
+    async def handle(payload) -> str:
+        running["now"] += 1
+        running["most"] = max(running["most"], running["now"])
+        await asyncio.sleep(0.01)
+        running["now"] -= 1
+        return payload.message
+
+    serve_task = asyncio.create_task(my_consumer.serve(handle, limiter=limiter))
+    responses = await asyncio.gather(
+        *[my_producer.addConfirmedMessage(i) for i in range(40)]
+    )
+    assert [resp["message"] for resp in responses] == list(range(40))
+    assert limiter.limit > 1
+    assert running["most"] <= 4
+    assert limiter.stats()["handled"] == 40
+
+    my_consumer.stop()
+    await asyncio.wait_for(serve_task, 1.0)
+
+    await p_connection.close()
+    await q_connection.close()
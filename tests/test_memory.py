@@ -0,0 +1,88 @@
+"""
+Test the memory:// Backend
+"""
+
+import asyncio
+import pytest  # type: ignore
+from redis import exceptions  # type: ignore[attr-defined]
+
+from redismq import Client
+from redismq.memory import MemoryRedis
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_memory_groups() -> None:
+    "stream entries are delivered once per group and tracked until acked"
+    redis = MemoryRedis.from_url("memory://test_memory_groups")
+    await redis.flushall()
+    with pytest.raises(exceptions.ResponseError):
+        await redis.xgroup_create("s", "g")
+    assert await redis.xgroup_create("s", "g", id="$", mkstream=True)
+    with pytest.raises(exceptions.ResponseError):
+        await redis.xgroup_create("s", "g")
+
+    ids = [await redis.xadd("s", {"n": i}, maxlen=2) for i in range(3)]
+    assert await redis.xlen("s") == 2
+    assert [entry_id for entry_id, _ in await redis.xrange("s")] == ids[1:]
+
+    messages = await redis.xreadgroup("g", "c1", {"s": ">"}, count=1)
+    assert messages == [["s", [(ids[1], {"n": "1"})]]]
+    assert (await redis.xpending("s", "g"))["pending"] == 1
+    assert await redis.xreadgroup("g", "c2", {"s": ">"}, count=5, block=None) == [
+        ["s", [(ids[2], {"n": "2"})]]
+    ]
+    assert await redis.xreadgroup("g", "c2", {"s": ">"}, block=10) == []
+
+    # re-reading the pending entries counts another delivery
+    messages = await redis.xreadgroup("g", "c1", {"s": "0-0"})
+    assert messages == [["s", [(ids[1], {"n": "1"})]]]
+    pending = await redis.xpending_range("s", "g", "-", "+", 10, consumername="c1")
+    assert pending[0]["times_delivered"] == 2
+
+    # claim it for another consumer
+    assert await redis.xclaim("s", "g", "c2", 0, [ids[1]], justid=True) == [ids[1]]
+    summary = await redis.xpending("s", "g")
+    assert summary["consumers"] == [{"name": "c2", "pending": 2}]
+
+    assert await redis.xack("s", "g", ids[1], ids[2]) == 2
+    groups = await redis.xinfo_groups("s")
+    assert groups[0]["pending"] == 0
+    assert groups[0]["lag"] == 0
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_memory_blocking_read() -> None:
+    "a blocked read wakes up when an entry is added"
+    redis = MemoryRedis.from_url("memory://test_memory_blocking_read")
+    await redis.flushall()
+    await redis.xgroup_create("s", "g", mkstream=True)
+
+    read_task = asyncio.create_task(
+        redis.xreadgroup("g", "c1", {"s": ">"}, count=1, block=1000)
+    )
+    await asyncio.sleep(0.01)
+    assert not read_task.done()
+    entry_id = await redis.xadd("s", {"n": 1})
+    assert await read_task == [["s", [(entry_id, {"n": "1"})]]]
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_memory_confirmed() -> None:
+    "confirmed messages between clients of the same memory server"
+    p_connection = await Client.connect("memory://test_memory_confirmed")
+    q_connection = await Client.connect("memory://test_memory_confirmed")
+    assert p_connection.redis.server is q_connection.redis.server
+    my_producer = await p_connection.producer("mystream")
+    my_consumer = await q_connection.consumer("mystream", "mygroup", "consumer1")
+
+    async def ack_one() -> None:
+        payload = await my_consumer.read()
+        await payload.ack(f"Acknowledged {payload.message}")
+
+    ack_task = asyncio.create_task(ack_one())
+    response = await my_producer.addConfirmedMessage("hello")
+    assert response["message"] == "Acknowledged hello"
+    await ack_task
+
+    await p_connection.close()
+    await q_connection.close()
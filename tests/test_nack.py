@@ -0,0 +1,332 @@
+"""
+Test Negative Acknowledgements
+"""
+import time
+import asyncio
+import pytest  # type: ignore
+from tests.utils import TEST_URL  # type: ignore
+from redismq import Client
+from redismq import consumer as consumer_module
+from redismq.resilience import Backoff
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_nack_redelivery() -> None:
+    "test a nacked message is delivered again to another consumer"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("nackstream")
+    my_producer = await p_connection.producer("nackstream")
+    q_connection = await Client.connect(TEST_URL)
+    consumer1 = await q_connection.consumer(
+        "nackstream", "mygroup", "consumer1", claim_interval=0.05
+    )
+    consumer2 = await q_connection.consumer(
+        "nackstream", "mygroup", "consumer2", claim_interval=0.05
+    )
+
+    await my_producer.addUnconfirmedMessage("try again")
+    payload = await consumer1.read()
+    assert await payload.delivery_count() == 1
+    assert await payload.nack()
+
+    # comes back right away, even though min_idle_time is a minute
+    start = time.monotonic()
+    payload = await asyncio.wait_for(consumer2.read(), 1.0)
+    assert time.monotonic() - start < 1.0
+    assert payload.message == "try again"
+    assert await payload.delivery_count() == 2
+    await payload.ack()
+    assert await payload.delivery_count() == 0
+
+    # later
+    await my_producer.addUnconfirmedMessage("not yet")
+    payload = await consumer1.read()
+    await payload.nack(delay=0.3)
+    start = time.monotonic()
+    payload = await asyncio.wait_for(consumer2.read(), 2.0)
+    assert time.monotonic() - start >= 0.2
+    assert payload.message == "not yet"
+    await payload.ack()
+
+    await p_connection.close()
+    await q_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_nack_default_settings() -> None:
+    "test a nacked message comes back without a claim_interval"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("defaultstream")
+    my_producer = await p_connection.producer("defaultstream")
+    q_connection = await Client.connect(TEST_URL)
+    consumer1 = await q_connection.consumer("defaultstream", "mygroup", "consumer1")
+    consumer2 = await q_connection.consumer("defaultstream", "mygroup", "consumer2")
+    assert consumer1.claim_interval is None
+
+    await my_producer.addUnconfirmedMessage("try again")
+    payload = await consumer1.read()
+    assert await payload.nack(delay=0.2)
+    start = time.monotonic()
+    payload = await asyncio.wait_for(consumer1.read(), 1.0)
+    assert 0.15 <= time.monotonic() - start < 1.0
+    assert payload.message == "try again"
+    assert await payload.delivery_count() == 2
+    await payload.ack()
+    assert consumer2.claim_interval is None
+
+    # serving with a retry_backoff checks for them on its own
+    my_consumer = await q_connection.consumer(
+        "defaultstream",
+        "mygroup",
+        "consumer3",
+        retry_backoff=Backoff(base=0.2, jitter=False),
+    )
+    assert my_consumer.claim_interval is not None
+    deliveries = []
+
+    async def flaky(payload) -> str:
+        deliveries.append(time.monotonic())
+        if len(deliveries) == 1:
+            raise RuntimeError("not yet")
+        my_consumer.stop()
+        return "done"
+
+    serve_task = asyncio.create_task(my_consumer.serve(flaky))
+    await my_producer.addUnconfirmedMessage("flaky")
+    await asyncio.wait_for(serve_task, 3.0)
+    assert len(deliveries) == 2
+    assert 0.15 <= deliveries[1] - deliveries[0] < 1.5
+
+    await p_connection.close()
+    await q_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_nack_max_deliveries() -> None:
+    "test a confirmed message gets an error once it has been retried enough"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("retrystream")
+    my_producer = await p_connection.producer("retrystream")
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer(
+        "retrystream",
+        "mygroup",
+        "consumer1",
+        claim_interval=0.05,
+        retry_backoff=Backoff(base=0.01, jitter=False),
+        max_deliveries=3,
+    )
+
+    async def always_fail() -> int:
+        deliveries = 0
+        while True:
+            payload = await my_consumer.read()
+            deliveries += 1
+            if not await payload.nack():
+                return deliveries
+
+    fail_task = asyncio.create_task(always_fail())
+    response = await my_producer.addConfirmedMessage("flaky")
+    assert response["error"] == "delivered 3 times"
+    assert await fail_task == 3
+
+    await p_connection.close()
+    await q_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_lease() -> None:
+    "test a slow handler keeps its message from being claimed"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("leasestream")
+    my_producer = await p_connection.producer("leasestream")
+    q_connection = await Client.connect(TEST_URL)
+    consumer1 = await q_connection.consumer(
+        "leasestream", "mygroup", "consumer1", min_idle_time=300, lease_interval=0.1
+    )
+    consumer2 = await q_connection.consumer(
+        "leasestream", "mygroup", "consumer2", min_idle_time=300, claim_interval=0.05
+    )
+
+    await my_producer.addUnconfirmedMessage("slow")
+    payload = await consumer1.read()
+    assert list(consumer1.in_flight) == [payload.msg_id]
+
+    # the other consumer finds nothing to claim while the handler works
+    read_task = consumer2.read()
+    await asyncio.sleep(0.8)
+    assert not read_task.done()
+    read_task.cancel()
+    pending = await p_connection.redis.xpending_range(
+        "leasestream", "mygroup", min="-", max="+", count=10
+    )
+    assert [info["consumer"] for info in pending] == ["consumer1"]
+    assert pending[0]["time_since_delivered"] < 300
+
+    assert await payload.extend()
+    await payload.ack()
+    assert not consumer1.in_flight
+    assert not await payload.extend()
+
+    await p_connection.close()
+    await q_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_lease_not_stolen_back() -> None:
+    "test a message claimed by another consumer is not claimed back"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("leasestream")
+    my_producer = await p_connection.producer("leasestream")
+    q_connection = await Client.connect(TEST_URL)
+    consumer1 = await q_connection.consumer(
+        "leasestream", "mygroup", "consumer1", min_idle_time=300, lease_interval=0.1
+    )
+
+    await my_producer.addUnconfirmedMessage("slow")
+    payload = await consumer1.read()
+    await p_connection.redis.xclaim(
+        "leasestream", "mygroup", "consumer2", 0, [payload.msg_id], justid=True
+    )
+    await asyncio.sleep(0.3)
+    assert not consumer1.in_flight
+    assert not await payload.extend()
+    pending = await p_connection.redis.xpending_range(
+        "leasestream", "mygroup", min="-", max="+", count=10
+    )
+    assert [info["consumer"] for info in pending] == ["consumer2"]
+
+    await p_connection.close()
+    await q_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_lease_batched(monkeypatch) -> None:
+    "test the leases are renewed with a command per chunk of messages"
+    monkeypatch.setattr(consumer_module, "LEASE_CHUNK", 10)
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("leasestream")
+    my_producer = await p_connection.producer("leasestream")
+    q_connection = await Client.connect(TEST_URL)
+    consumer1 = await q_connection.consumer(
+        "leasestream", "mygroup", "consumer1", min_idle_time=600, lease_interval=0.2
+    )
+
+    for i in range(25):
+        await my_producer.addUnconfirmedMessage(i)
+    payloads = await consumer1.read_batch(25, 100)
+    assert len(consumer1.in_flight) == 25
+    stolen = payloads[5].msg_id
+    await p_connection.redis.xclaim(
+        "leasestream", "mygroup", "consumer2", 0, [stolen], justid=True
+    )
+
+    calls = {"xpending_range": 0, "pipeline": 0}
+    redis = q_connection.redis
+    xpending_range, pipeline = redis.xpending_range, redis.pipeline
+
+    async def counting_xpending_range(*args, **kwargs):
+        calls["xpending_range"] += 1
+        return await xpending_range(*args, **kwargs)
+
+    def counting_pipeline(*args, **kwargs):
+        calls["pipeline"] += 1
+        return pipeline(*args, **kwargs)
+
+    redis.xpending_range = counting_xpending_range
+    redis.pipeline = counting_pipeline
+    await asyncio.sleep(0.3)
+    assert calls == {"xpending_range": 3, "pipeline": 1}
+    assert len(consumer1.in_flight) == 24 and stolen not in consumer1.in_flight
+
+    pending = await p_connection.redis.xpending_range(
+        "leasestream", "mygroup", min="-", max="+", count=100
+    )
+    for info in pending:
+        if info["message_id"] == stolen:
+            assert info["consumer"] == "consumer2"
+        else:
+            assert info["consumer"] == "consumer1"
+            assert info["time_since_delivered"] < 200
+    for payload in payloads:
+        if payload.msg_id != stolen:
+            await payload.ack()
+
+    await p_connection.close()
+    await q_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_max_lease() -> None:
+    "test a message its handler abandons is given up after max_lease"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("leasestream")
+    my_producer = await p_connection.producer("leasestream")
+    q_connection = await Client.connect(TEST_URL)
+    consumer1 = await q_connection.consumer(
+        "leasestream",
+        "mygroup",
+        "consumer1",
+        min_idle_time=200,
+        lease_interval=0.05,
+        max_lease=0.3,
+    )
+    consumer2 = await q_connection.consumer(
+        "leasestream", "mygroup", "consumer2", min_idle_time=200, claim_interval=0.05
+    )
+
+    await my_producer.addUnconfirmedMessage("abandoned")
+    payload = await consumer1.read()
+    msg_id = payload.msg_id
+    del payload
+
+    read_task = consumer2.read()
+    claimed = await asyncio.wait_for(read_task, 3.0)
+    assert claimed.msg_id == msg_id
+    assert not consumer1.in_flight
+    await claimed.ack()
+
+    await p_connection.close()
+    await q_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_claim_busy_pending_list() -> None:
+    "test a pending list with nothing idle is checked once per interval"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("claimstream")
+    my_producer = await p_connection.producer("claimstream", maxlen=None)
+    q_connection = await Client.connect(TEST_URL)
+    consumer1 = await q_connection.consumer("claimstream", "mygroup", "consumer1")
+    consumer2 = await q_connection.consumer(
+        "claimstream", "mygroup", "consumer2", claim_interval=0.5
+    )
+    off = await q_connection.consumer(
+        "claimstream",
+        "mygroup",
+        "consumer3",
+        claim_interval=0.5,
+        claim_stale_messages=False,
+    )
+    assert consumer1.claim_interval is None and off.claim_interval is None
+
+    # a hundred messages being handled, none of them idle
+    for i in range(100):
+        await my_producer.addUnconfirmedMessage(i)
+    assert len(await consumer1.read_batch(100, 100)) == 100
+
+    checks = 0
+    xpending_range = q_connection.redis.xpending_range
+
+    async def counting(*args, **kwargs):
+        nonlocal checks
+        checks += 1
+        return await xpending_range(*args, **kwargs)
+
+    q_connection.redis.xpending_range = counting
+    assert await consumer2.read_batch(10, 300) == []
+    assert await consumer2.read_batch(10, 300) == []
+    assert checks <= 2
+
+    await p_connection.close()
+    await q_connection.close()
@@ -0,0 +1,136 @@
+"""
+Test Ordered Serving
+"""
+import asyncio
+import pytest  # type: ignore
+from tests.utils import TEST_URL  # type: ignore
+from redismq import Client
+from redismq.resilience import Backoff
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_ordered_serve() -> None:
+    "test messages with the same key are handled in order and others in parallel"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("orderstream")
+    my_producer = await p_connection.producer("orderstream")
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer("orderstream", "mygroup", "consumer1")
+    handled = []
+    active = {"keys": set(), "most": 0}
+
+    async def record(payload) -> None:
+        key, number = payload.message
+        assert key not in active["keys"]
+        active["keys"].add(key)
+        active["most"] = max(active["most"], len(active["keys"]))
+        await asyncio.sleep(0.01 * (3 - number % 3))
+        active["keys"].discard(key)
+        handled.append((key, number))
+
+    for number in range(5):
+        for key in "abc":
+            await my_producer.addUnconfirmedMessage([key, number], ordering_key=key)
+    serve_task = asyncio.create_task(
+        my_consumer.serve(record, concurrency=3, ordered=True, buffer=6)
+    )
+    while len(handled) < 15:
+        await asyncio.sleep(0.01)
+    for key in "abc":
+        assert [number for k, number in handled if k == key] == list(range(5))
+    assert active["most"] > 1
+
+    my_consumer.stop()
+    await asyncio.wait_for(serve_task, 1.0)
+    pending = await p_connection.redis.xpending("orderstream", "mygroup")
+    assert pending["pending"] == 0
+
+    await p_connection.close()
+    await q_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_ordered_retry() -> None:
+    "test a failed message is retried before the next one with its key"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("orderretry")
+    my_producer = await p_connection.producer("orderretry")
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer(
+        "orderretry",
+        "mygroup",
+        "consumer1",
+        retry_backoff=Backoff(base=0.01, cap=0.05),
+        max_deliveries=3,
+    )
+    attempts = []
+
+    def flaky(payload) -> str:
+        attempts.append(payload.message)
+        if payload.message == "first" and attempts.count("first") < 2:
+            raise RuntimeError("not yet")
+        if payload.message == "never":
+            raise RuntimeError("never")
+        return payload.message
+
+    serve_task = asyncio.create_task(my_consumer.serve(flaky, ordered=True))
+    responses = await asyncio.gather(
+        my_producer.addConfirmedMessage("first", ordering_key="k"),
+        my_producer.addConfirmedMessage("second", ordering_key="k"),
+        my_producer.addConfirmedMessage("never", ordering_key="j"),
+    )
+    assert [resp["message"] for resp in responses[:2]] == ["first", "second"]
+    assert responses[2]["error"] == "never"
+    assert attempts.index("second") > 1
+    assert attempts.count("never") == 3
+
+    my_consumer.stop()
+    await asyncio.wait_for(serve_task, 1.0)
+    pending = await p_connection.redis.xpending("orderretry", "mygroup")
+    assert pending["pending"] == 0
+
+    await p_connection.close()
+    await q_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_ordered_cancel_retry() -> None:
+    "test a request cancelled while it waits to be retried lets its key go on"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("ordercancel")
+    my_producer = await p_connection.producer("ordercancel", timeout=0.2)
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer(
+        "ordercancel",
+        "mygroup",
+        "consumer1",
+        retry_backoff=Backoff(base=1.0, jitter=False),
+    )
+    attempts = []
+
+    def flaky(payload) -> str:
+        attempts.append(payload.message)
+        if payload.message == "first":
+            raise RuntimeError("not yet")
+        return payload.message
+
+    serve_task = asyncio.create_task(my_consumer.serve(flaky, ordered=True))
+    first_task = asyncio.create_task(
+        my_producer.addConfirmedMessage("first", ordering_key="k")
+    )
+    while not attempts:
+        await asyncio.sleep(0.01)
+    await my_producer.addUnconfirmedMessage("second", ordering_key="k")
+    await my_producer.addUnconfirmedMessage("third", ordering_key="k")
+    await first_task
+    while len(attempts) < 3:
+        await asyncio.sleep(0.01)
+    assert attempts == ["first", "second", "third"]
+
+    my_consumer.stop()
+    await asyncio.wait_for(serve_task, 1.0)
+    pending = await p_connection.redis.xpending("ordercancel", "mygroup")
+    assert pending["pending"] == 0
+
+    await p_connection.close()
+    await q_connection.close()
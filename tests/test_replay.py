@@ -0,0 +1,58 @@
+"""
+Test Replay
+"""
+import pytest  # type: ignore
+from tests.utils import TEST_URL  # type: ignore
+from redismq import Client, Producer
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_replay() -> None:
+    "test reading the history of a stream in pages"
+    mq_connection = await Client.connect(TEST_URL)
+    await mq_connection.redis.delete("replaystream")
+    classic = await mq_connection.producer("replaystream", maxlen=None)
+    compact = Producer(mq_connection, "replaystream", maxlen=None, compact=True)
+    msg_ids = []
+    for i in range(25):
+        msg_ids.append(
+            await (compact if i % 2 else classic).addUnconfirmedMessage(
+                i, ordering_key="k%d" % (i % 3,)
+            )
+        )
+    await mq_connection.redis.xadd("replaystream", {"message": "not json"})
+
+    entries = [
+        entry async for entry in mq_connection.replay("replaystream", page_size=10)
+    ]
+    assert [entry.msg_id for entry in entries[:25]] == msg_ids
+    assert [entry.message for entry in entries[:25]] == list(range(25))
+    assert [entry.ordering_key for entry in entries[:3]] == ["k0", "k1", "k2"]
+    with pytest.raises(ValueError):
+        entries[25].message
+
+    # between two IDs, and from a time
+    entries = [
+        entry.message
+        async for entry in mq_connection.replay(
+            "replaystream", msg_ids[5], msg_ids[14], page_size=4
+        )
+    ]
+    assert entries == list(range(5, 15))
+    first = [entry async for entry in mq_connection.replay("replaystream")][0]
+    entries = [
+        entry
+        async for entry in mq_connection.replay(
+            "replaystream", first.timestamp, page_size=3
+        )
+    ]
+    assert entries[0].msg_id == msg_ids[0]
+
+    # stopping early
+    stream = mq_connection.replay("replaystream", page_size=5)
+    async for entry in stream:
+        if entry.message == 7:
+            break
+    await stream.aclose()
+
+    await mq_connection.close()
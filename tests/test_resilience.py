@@ -0,0 +1,92 @@
+"""
+Test Resilience
+"""
+import asyncio
+import pytest  # type: ignore
+from redis import exceptions  # type: ignore[attr-defined]
+
+from tests.utils import TEST_URL  # type: ignore
+from redismq import Client
+from redismq.resilience import Backoff
+
+
+def test_backoff_delays() -> None:
+    "delays grow exponentially up to the cap"
+    backoff = Backoff(base=0.1, cap=1.0, jitter=False)
+    assert [backoff.next_delay() for i in range(6)] == [0.1, 0.2, 0.4, 0.8, 1.0, 1.0]
+    backoff.reset()
+    assert backoff.next_delay() == 0.1
+
+    backoff = Backoff(base=0.1, cap=1.0)
+    assert all(0.0 <= backoff.next_delay() <= 1.0 for i in range(20))
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_backoff_call() -> None:
+    "connection errors are retried"
+    attempts = []
+
+    async def flaky() -> str:
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise exceptions.ConnectionError("down")
+        return "up"
+
+    backoff = Backoff(base=0.001)
+    assert await backoff.call(flaky) == "up"
+    assert len(attempts) == 3
+    assert backoff.attempts == 0
+
+    attempts.clear()
+    with pytest.raises(exceptions.ConnectionError):
+        await backoff.call(flaky, max_attempts=2)
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_state_callbacks() -> None:
+    "state changes are reported"
+    changes = []
+    p_connection = await Client.connect(
+        TEST_URL, on_state_change=lambda old, new: changes.append((old, new))
+    )
+    p_connection.connection_lost(exceptions.ConnectionError("down"))
+    p_connection.connection_restored()
+    await p_connection.close()
+    assert changes == [
+        ("wait", "connecting"),
+        ("connecting", "ready"),
+        ("ready", "disconnected"),
+        ("disconnected", "ready"),
+        ("ready", "closing"),
+        ("closing", "closed"),
+    ]
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_pubsub_reconnect() -> None:
+    "confirmed messages still work after the pubsub connection is lost"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("reconnectstream")
+    my_producer = await p_connection.producer("reconnectstream")
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer("reconnectstream", "mygroup", "consumer1")
+
+    async def ack_one() -> None:
+        payload = await my_consumer.read()
+        await payload.ack("got it")
+
+    ack_task = asyncio.create_task(ack_one())
+    response = await my_producer.addConfirmedMessage("first")
+    assert response["message"] == "got it"
+    await ack_task
+
+    # drop the pubsub connection out from under the client
+    await p_connection.pubsub.connection.disconnect()
+
+    ack_task = asyncio.create_task(ack_one())
+    response = await my_producer.addConfirmedMessage("second")
+    assert response["message"] == "got it"
+    await ack_task
+
+    await p_connection.close()
+    await q_connection.close()
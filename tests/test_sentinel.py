@@ -0,0 +1,147 @@
+"""
+Test Sentinel
+"""
+
+import asyncio
+from urllib.parse import urlsplit
+import pytest  # type: ignore
+from tests.utils import TEST_URL  # type: ignore
+from redismq import Client
+from redismq.sentinel import parse_url
+
+
+class FakeSentinel:
+    "answers the sentinel commands for one primary and announces failovers"
+
+    def __init__(self, host, port):
+        self.primary = (host, port)
+        self.subscribers = []
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        for writer in self.subscribers:
+            writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    @staticmethod
+    def encode(value):
+        if isinstance(value, list):
+            return b"*%d\r\n" % (len(value),) + b"".join(
+                map(FakeSentinel.encode, value)
+            )
+        if isinstance(value, int):
+            return b":%d\r\n" % (value,)
+        value = str(value).encode()
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = []
+                for _ in range(int(line[1:])):
+                    length = int((await reader.readline())[1:])
+                    command.append((await reader.readexactly(length + 2))[:-2].decode())
+                name = " ".join(command[:2]).upper()
+                if name == "PING":
+                    writer.write(b"+PONG\r\n")
+                elif name == "SENTINEL MASTERS":
+                    host, port = self.primary
+                    state = ["name", "mymaster", "ip", host, "port", port]
+                    state += ["flags", "master", "num-other-sentinels", 0]
+                    writer.write(self.encode([state]))
+                elif name in ("SENTINEL SLAVES", "SENTINEL REPLICAS"):
+                    writer.write(self.encode([]))
+                elif command[0].upper() == "SUBSCRIBE":
+                    self.subscribers.append(writer)
+                    writer.write(self.encode(["subscribe", command[1], 1]))
+                else:
+                    writer.write(b"-ERR unknown command\r\n")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    def failover(self, host, port):
+        old_host, old_port = self.primary
+        self.primary = (host, port)
+        data = "mymaster %s %s %s %s" % (old_host, old_port, host, port)
+        for writer in self.subscribers:
+            writer.write(self.encode(["message", "+switch-master", data]))
+
+
+class RecordingClient(Client):
+    "a client that remembers the failovers it was told about"
+
+    failovers = []
+
+    async def failed_over(self, address):
+        RecordingClient.failovers.append(address)
+        await super().failed_over(address)
+
+
+def test_parse_url() -> None:
+    "test the sentinels, service and options in a sentinel URL"
+    sentinels, service_name, options = parse_url(
+        "redis+sentinel://:s%40cret@one,two:26380/mymaster/2?sentinel_password=x"
+    )
+    assert sentinels == [("one", 26379), ("two", 26380)]
+    assert service_name == "mymaster"
+    assert options["db"] == 2 and options["password"] == "s@cret"
+    assert options["sentinel_kwargs"]["password"] == "x"
+    with pytest.raises(ValueError):
+        parse_url("redis+sentinel://one")
+    with pytest.raises(ValueError):
+        parse_url("redis://one/mymaster")
+
+
+@pytest.mark.skipif(
+    not TEST_URL.startswith("redis://"), reason="the fake sentinel needs a redis server"
+)
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_sentinel_failover() -> None:
+    "test the primary is found by the sentinels and connections move on failover"
+    url = urlsplit(TEST_URL)
+    sentinel = FakeSentinel(url.hostname or "localhost", url.port or 6379)
+    await sentinel.start()
+    RecordingClient.failovers = []
+
+    p_connection = await RecordingClient.connect(
+        "redis+sentinel://127.0.0.1:%d/mymaster" % (sentinel.port,),
+        read_from_replicas=True,
+    )
+    await p_connection.redis.delete("sentinelstream")
+    my_producer = await p_connection.producer("sentinelstream")
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer("sentinelstream", "mygroup", "consumer1")
+
+    async def echo(payload):
+        return payload.message
+
+    serve_task = asyncio.create_task(my_consumer.serve(echo))
+    assert (await my_producer.addConfirmedMessage("before"))["message"] == "before"
+    stats = await p_connection.stats("sentinelstream")
+    assert stats["length"] == 1
+
+    # announced on the sentinel's channel, the connections are dropped and
+    # made again to the primary it names
+    while not sentinel.subscribers:
+        await asyncio.sleep(0.01)
+    sentinel.failover(*sentinel.primary)
+    while not RecordingClient.failovers:
+        await asyncio.sleep(0.01)
+    assert RecordingClient.failovers == ["%s:%s" % sentinel.primary]
+    assert (await my_producer.addConfirmedMessage("after"))["message"] == "after"
+
+    my_consumer.stop()
+    await asyncio.wait_for(serve_task, 2.0)
+    await p_connection.close()
+    await q_connection.close()
+    await sentinel.close()
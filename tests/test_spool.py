@@ -0,0 +1,165 @@
+"""
+Test Spool
+"""
+import os
+import json
+import asyncio
+import pytest  # type: ignore
+from redis import exceptions  # type: ignore[attr-defined]
+from tests.utils import TEST_URL  # type: ignore
+from redismq import Client, Spool, SpoolFullError
+
+
+def test_spool_recovery(tmp_path) -> None:
+    "test spooled entries survive a restart and a torn write"
+    spool = Spool(str(tmp_path), segment_size=256)
+    for i in range(10):
+        spool.append("mystream", {"message": str(i)}, {"maxlen": 10})
+    assert spool.stats()["depth"] == 10
+    assert spool.stats()["segments"] > 1
+    spool.commit(3)
+    spool.close()
+
+    # a record that was only partly written at the end
+    last = sorted(name for name in os.listdir(tmp_path) if name.endswith(".seg"))[-1]
+    with open(tmp_path / last, "r+b") as segment_file:
+        data = segment_file.read()
+        end = data.index(b"\0" * 8)
+        segment_file.seek(end)
+        segment_file.write(b"\x20\0\0\0\x01\x02\x03\x04garbage")
+
+    spool = Spool(str(tmp_path), segment_size=256)
+    assert spool.depth == 7
+    entries = spool.peek(100)
+    assert [payload["message"] for _, payload, _ in entries] == [
+        str(i) for i in range(3, 10)
+    ]
+    spool.commit(7)
+    assert spool.depth == 0
+    assert spool.stats()["segments"] == 1
+    spool.append("mystream", {"message": "10"}, {"maxlen": 10})
+    spool.close()
+
+    spool = Spool(str(tmp_path), segment_size=256)
+    assert [payload["message"] for _, payload, _ in spool.peek(100)] == ["10"]
+    spool.close()
+
+
+def test_spool_bounded(tmp_path) -> None:
+    "test a full spool rejects entries"
+    spool = Spool(str(tmp_path), max_bytes=200, segment_size=1024)
+    with pytest.raises(SpoolFullError):
+        for i in range(100):
+            spool.append("mystream", {"message": str(i)}, {})
+    assert 0 < spool.bytes <= 200
+    assert spool.stats()["rejected"] == 1
+    spool.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_spool_replay(tmp_path) -> None:
+    "test messages are spooled while redis is down and added in order later"
+    mq_connection = await Client.connect(TEST_URL)
+    await mq_connection.redis.delete("spoolstream")
+    spool = Spool(str(tmp_path), replay_batch=4)
+    my_producer = await mq_connection.producer("spoolstream", spool=spool)
+    await my_producer.addUnconfirmedMessage("message 0")
+
+    # redis goes away, the pipelined replay keeps failing too
+    async def xadd_down(*args, **kwargs):
+        raise exceptions.ConnectionError("down")
+
+    redis = mq_connection.redis
+    xadd, pipeline = redis.xadd, redis.pipeline
+    redis.xadd = xadd_down
+
+    def pipeline_down(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        pipe.execute = xadd_down
+        return pipe
+
+    redis.pipeline = pipeline_down
+    for i in range(1, 10):
+        assert await my_producer.addUnconfirmedMessage(f"message {i}") is None
+    assert my_producer.stats()["spool"]["depth"] == 9
+    assert mq_connection.status == "disconnected"
+
+    # back again
+    redis.xadd, redis.pipeline = xadd, pipeline
+    await my_producer.addUnconfirmedMessage("message 10")
+    while spool.depth:
+        await asyncio.sleep(0.05)
+    entries = await redis.xrange("spoolstream")
+    assert [fields["message"] for _, fields in entries] == [
+        f'"message {i}"' for i in range(11)
+    ]
+    assert mq_connection.status == "ready"
+
+    spool.close()
+    await mq_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_spool_dead_letter(tmp_path) -> None:
+    "test an entry redis refuses is dead-lettered instead of blocking the rest"
+    mq_connection = await Client.connect(TEST_URL)
+    redis = mq_connection.redis
+    await redis.delete("spoolstream", "spoolstring")
+    await redis.set("spoolstring", "not a stream")
+    spool = Spool(str(tmp_path))
+    spool.append("spoolstring", {"message": '"lost"'}, {})
+    spool.append("spoolstream", {"message": '"kept"'}, {})
+
+    await asyncio.wait_for(spool.replay(redis), 2.0)
+    assert spool.depth == 0
+    assert spool.stats()["dead_lettered"] == 1
+    entries = await redis.xrange("spoolstream")
+    assert [fields["message"] for _, fields in entries] == ['"kept"']
+    with open(tmp_path / "dead-letter.jsonl") as dead_letter_file:
+        dead = [json.loads(line) for line in dead_letter_file]
+    assert [entry[:2] for entry in dead] == [["spoolstring", {"message": '"lost"'}]]
+    assert "WRONGTYPE" in dead[0][3]
+
+    spool.close()
+    await redis.delete("spoolstring")
+    await mq_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_spool_closed_with_client(tmp_path) -> None:
+    "test closing the client stops the replay and closes the spool"
+    mq_connection = await Client.connect(TEST_URL)
+    await mq_connection.redis.delete("spoolstream")
+    spool = Spool(str(tmp_path))
+    my_producer = await mq_connection.producer("spoolstream", spool=spool)
+
+    async def xadd_down(*args, **kwargs):
+        raise exceptions.ConnectionError("down")
+
+    redis = mq_connection.redis
+    pipeline = redis.pipeline
+    redis.xadd = xadd_down
+
+    def pipeline_down(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        pipe.execute = xadd_down
+        return pipe
+
+    redis.pipeline = pipeline_down
+    assert await my_producer.addUnconfirmedMessage("kept") is None
+    replay_task = spool.replay_task
+    assert replay_task is not None and not replay_task.done()
+
+    # a producer disposed of leaves the spool it shares open
+    other_producer = await mq_connection.producer("otherstream", spool=spool)
+    await mq_connection.dispose_producer(other_producer)
+    assert spool.segments and not replay_task.done()
+
+    await mq_connection.close()
+    assert replay_task.cancelled()
+    assert not spool.segments and not mq_connection.producer_registry
+
+    # the entry is still there for next time
+    spool = Spool(str(tmp_path))
+    assert spool.depth == 1
+    spool.close()
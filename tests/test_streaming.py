@@ -0,0 +1,114 @@
+"""
+Test Streaming Responses
+"""
+import asyncio
+import pytest  # type: ignore
+from tests.utils import TEST_URL  # type: ignore
+from redismq import Client, StreamError
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_streaming_response() -> None:
+    "test chunks arrive in order and the sender waits for the reader"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("chunkstream")
+    my_producer = await p_connection.producer("chunkstream")
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer("chunkstream", "mygroup", "consumer1")
+    counts = {"sent": 0, "read": 0, "ahead": 0}
+
+    async def send_chunks() -> None:
+        payload = await my_consumer.read()
+        for i in range(payload.message):
+            assert await payload.send_chunk(i)
+            counts["sent"] += 1
+            counts["ahead"] = max(counts["ahead"], counts["sent"] - counts["read"])
+        await payload.ack("done")
+
+    send_task = asyncio.create_task(send_chunks())
+    chunks = []
+    async for chunk in my_producer.addStreamingMessage(40, window=4):
+        chunks.append(chunk)
+        counts["read"] += 1
+        await asyncio.sleep(0.001)
+    await send_task
+    assert chunks == list(range(40)) + ["done"]
+    assert counts["ahead"] <= 4 + 1
+
+    await p_connection.close()
+    await q_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_streaming_error() -> None:
+    "test an error ends the stream and a reader that leaves stops the sender"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("chunkstream")
+    my_producer = await p_connection.producer("chunkstream")
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer("chunkstream", "mygroup", "consumer1")
+
+    async def fail() -> None:
+        payload = await my_consumer.read()
+        await payload.send_chunk("partial")
+        await payload.ack(error="boom")
+
+    fail_task = asyncio.create_task(fail())
+    chunks = []
+    with pytest.raises(StreamError, match="boom"):
+        async for chunk in my_producer.addStreamingMessage("go"):
+            chunks.append(chunk)
+    assert chunks == ["partial"]
+    await fail_task
+
+    async def send_forever() -> int:
+        payload = await my_consumer.read()
+        sent = 0
+        while await payload.send_chunk(sent):
+            sent += 1
+        await payload.ack()
+        return sent
+
+    send_task = asyncio.create_task(send_forever())
+    stream = my_producer.addStreamingMessage("go", window=2)
+    async for chunk in stream:
+        if chunk == 3:
+            break
+    await stream.aclose()
+    assert await asyncio.wait_for(send_task, 2.0) < 10
+
+    await p_connection.close()
+    await q_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_streaming_many_senders() -> None:
+    "test senders waiting for credit don't hold on to connections"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("chunkstream")
+    my_producer = await p_connection.producer("chunkstream")
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer("chunkstream", "mygroup", "consumer1")
+
+    async def send_chunks(payload) -> str:
+        for i in range(3):
+            await payload.send_chunk(i)
+        return "done"
+
+    serve_task = asyncio.create_task(my_consumer.serve(send_chunks, concurrency=16))
+    streams = [my_producer.addStreamingMessage(i, window=1) for i in range(16)]
+
+    # every sender is waiting for the readers to take the first chunk
+    firsts = await asyncio.wait_for(
+        asyncio.gather(*[stream.__anext__() for stream in streams]), 5.0
+    )
+    assert firsts == [0] * 16
+    await asyncio.sleep(0.2)
+    assert await asyncio.wait_for(q_connection.redis.ping(), 1.0)
+
+    for stream in streams:
+        assert [chunk async for chunk in stream] == [1, 2, "done"]
+    my_consumer.stop()
+    await asyncio.wait_for(serve_task, 5.0)
+    await p_connection.close()
+    await q_connection.close()
@@ -0,0 +1,99 @@
+"""
+Test Tracing
+"""
+import asyncio
+import pytest  # type: ignore
+from tests.utils import TEST_URL  # type: ignore
+from redismq import Client, Tracer
+from redismq.tracing import new_traceparent, child_traceparent, parse_traceparent
+
+
+def test_traceparent() -> None:
+    "test making and continuing W3C traceparent values"
+    traceparent = new_traceparent()
+    fields = parse_traceparent(traceparent)
+    assert fields is not None
+    assert fields["version"] == "00"
+    assert fields["flags"] == 1
+
+    child = child_traceparent(traceparent)
+    child_fields = parse_traceparent(child)
+    assert child_fields is not None
+    assert child_fields["trace_id"] == fields["trace_id"]
+    assert child_fields["parent_id"] != fields["parent_id"]
+
+    assert parse_traceparent("00-%s-%s-01" % ("0" * 32, "1" * 16)) is None
+    assert parse_traceparent("not a traceparent") is None
+
+
+def test_sampling() -> None:
+    "test the sample rate and the sampled flag of the parent"
+    assert Tracer(sample_rate=0.0).start() is None
+    assert Tracer(sample_rate=1.0).start() is not None
+
+    # the decision of the parent wins
+    unsampled = new_traceparent(sampled=False)
+    assert Tracer(sample_rate=1.0).start(unsampled) is None
+    sampled = new_traceparent()
+    trace = Tracer(sample_rate=0.0).start(sampled)
+    assert trace is not None
+    assert trace["traceparent"].split("-")[1] == sampled.split("-")[1]
+    assert "enqueue" in trace["timeline"]
+
+
+async def ack_traced_messages(my_consumer) -> None:
+    "ack messages, noting when the handler starts"
+    while True:
+        payload = await my_consumer.read()
+        payload.start()
+        await payload.ack(f"Acknowledged {payload.message}")
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_traced_confirmed() -> None:
+    "test the timeline of a confirmed message comes back with the response"
+    produced = []
+    consumed = []
+
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("tracestream")
+    my_producer = await p_connection.producer(
+        "tracestream", tracer=Tracer(sink=produced.append)
+    )
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer(
+        "tracestream", "mygroup", "consumer1", tracer=Tracer(sink=consumed.append)
+    )
+    ack_task = asyncio.create_task(ack_traced_messages(my_consumer))
+
+    traceparent = new_traceparent()
+    response = await my_producer.addConfirmedMessage("hi", traceparent=traceparent)
+    assert response["message"] == "Acknowledged hi"
+
+    trace = response["trace"]
+    assert trace["traceparent"].split("-")[1] == traceparent.split("-")[1]
+    timeline = trace["timeline"]
+    events = ["enqueue", "delivered", "handler_start", "handler_end", "publish"]
+    events.append("response")
+    assert [event for event in events if event in timeline] == events
+    assert sorted(timeline.values()) == [timeline[event] for event in events]
+    assert set(Tracer.durations(trace)) == {
+        "enqueue-delivered",
+        "delivered-handler_start",
+        "handler_start-handler_end",
+        "handler_end-publish",
+        "publish-response",
+    }
+    assert produced == [trace]
+    assert len(consumed) == 1
+
+    # not sampled
+    my_producer.tracer = Tracer(sample_rate=0.0, sink=produced.append)
+    response = await my_producer.addConfirmedMessage("bye")
+    assert response["message"] == "Acknowledged bye"
+    assert "trace" not in response
+    assert len(produced) == 1
+    ack_task.cancel()
+
+    await p_connection.close()
+    await q_connection.close()
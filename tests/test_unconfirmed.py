@@ -1,9 +1,10 @@
 """
 Test Unconfirmed Messages
 """
+import asyncio
 import pytest  # type: ignore
 
-from redismq import Client
+from redismq import Client, BackpressureError
 from tests.utils import TEST_URL  # type: ignore
 
 
@@ -25,3 +26,106 @@ async def test_same_producer_twice() -> None:
     your_producer = await mq_connection.producer("mystream")
     assert my_producer is your_producer
     await mq_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_backpressure_reject() -> None:
+    "messages are rejected rather than trimmed unread"
+    mq_connection = await Client.connect(TEST_URL)
+    await mq_connection.redis.delete("bpstream")
+    await mq_connection.consumer("bpstream", "mygroup", "consumer1")
+    my_producer = await mq_connection.producer(
+        "bpstream", maxlen=3, backpressure="reject", backpressure_interval=0.0
+    )
+    for i in range(3):
+        await my_producer.addUnconfirmedMessage(f"message {i}")
+    with pytest.raises(BackpressureError):
+        await my_producer.addUnconfirmedMessage("one too many")
+    assert await mq_connection.redis.xlen("bpstream") == 3
+    await mq_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_backpressure_block() -> None:
+    "messages wait for the consumers to catch up"
+    mq_connection = await Client.connect(TEST_URL)
+    await mq_connection.redis.delete("bpstream")
+    my_consumer = await mq_connection.consumer("bpstream", "mygroup", "consumer1")
+    my_producer = await mq_connection.producer(
+        "bpstream", maxlen=2, backpressure="block", backpressure_interval=0.05
+    )
+    for i in range(2):
+        await my_producer.addUnconfirmedMessage(f"message {i}")
+
+    async def read_one() -> None:
+        await asyncio.sleep(0.2)
+        payload = await my_consumer.read()
+        await payload.ack()
+
+    read_task = asyncio.create_task(read_one())
+    await my_producer.addUnconfirmedMessage("after the read")
+    assert read_task.done()
+    await mq_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_retention_trimming() -> None:
+    "messages older than the retention period are trimmed"
+    mq_connection = await Client.connect(TEST_URL)
+    await mq_connection.redis.delete("retstream")
+    my_producer = await mq_connection.producer(
+        "retstream", retention=0.1, approximate=False
+    )
+    await my_producer.addUnconfirmedMessage("old")
+    await asyncio.sleep(0.2)
+    await my_producer.addUnconfirmedMessage("new")
+    assert await mq_connection.redis.xlen("retstream") == 1
+    await mq_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_noack_consumer() -> None:
+    "messages read without the pending list are still answered"
+    mq_connection = await Client.connect(TEST_URL)
+    await mq_connection.redis.delete("noackstream")
+    my_consumer = await mq_connection.consumer(
+        "noackstream", "mygroup", "consumer1", noack=True
+    )
+    my_producer = await mq_connection.producer("noackstream")
+
+    await my_producer.addUnconfirmedMessage("telemetry")
+    payload = await my_consumer.read()
+    assert payload.message == "telemetry"
+    pending = await mq_connection.redis.xpending("noackstream", "mygroup")
+    assert pending["pending"] == 0
+    await payload.ack()
+    with pytest.raises(RuntimeError):
+        await payload.nack()
+
+    async def answer() -> None:
+        payload = await my_consumer.read()
+        await payload.ack(payload.message.upper())
+
+    answer_task = asyncio.create_task(answer())
+    response = await my_producer.addConfirmedMessage("hello")
+    assert response["message"] == "HELLO"
+    await answer_task
+    await mq_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_payload_slots() -> None:
+    "payloads and consumers have no instance dict"
+    mq_connection = await Client.connect(TEST_URL)
+    await mq_connection.redis.delete("slotstream")
+    my_consumer = await mq_connection.consumer("slotstream", "mygroup", "consumer1")
+    my_producer = await mq_connection.producer("slotstream")
+    await my_producer.addUnconfirmedMessage({"hello": "there"})
+    payload = await my_consumer.read()
+    assert payload.message == {"hello": "there"}
+    assert not hasattr(payload, "__dict__")
+    assert not hasattr(my_consumer, "__dict__")
+    with pytest.raises(AttributeError):
+        payload.extra = True  # type: ignore[attr-defined]
+    await payload.ack()
+    await mq_connection.close()
@@ -0,0 +1,185 @@
+"""
+Test Worker Processes
+"""
+import os
+import signal
+import asyncio
+import pytest  # type: ignore
+from redis import exceptions # type: ignore[attr-defined]
+from tests.utils import TEST_URL  # type: ignore
+from redismq import Client
+from redismq.worker import Supervisor, load_handler
+
+
+async def shout(payload) -> str:
+    "handler used by the tests and the worker processes"
+    if payload.message == "fail":
+        raise RuntimeError("failed")
+    await asyncio.sleep(0.01)
+    return payload.message.upper()
+
+
+def test_load_handler() -> None:
+    "test importing a handler"
+    assert load_handler("tests.test_worker:shout").__name__ == "shout"
+    assert load_handler("os.path:join") is os.path.join
+    with pytest.raises(ValueError):
+        load_handler("tests.test_worker")
+    with pytest.raises(AttributeError):
+        load_handler("tests.test_worker:nothing")
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_serve() -> None:
+    "test serving a stream with concurrent handlers"
+    p_connection = await Client.connect(TEST_URL)
+    await p_connection.redis.delete("servestream")
+    my_producer = await p_connection.producer("servestream")
+    q_connection = await Client.connect(TEST_URL)
+    my_consumer = await q_connection.consumer("servestream", "mygroup", "consumer1")
+    serve_task = asyncio.create_task(my_consumer.serve(shout, concurrency=4))
+
+    responses = await asyncio.gather(
+        *[my_producer.addConfirmedMessage("message %d" % i) for i in range(8)]
+    )
+    assert [resp["message"] for resp in responses] == [
+        "MESSAGE %d" % i for i in range(8)
+    ]
+    response = await my_producer.addConfirmedMessage("fail")
+    assert response["error"] == "failed"
+
+    my_consumer.stop()
+    await asyncio.wait_for(serve_task, 1.0)
+    pending = await p_connection.redis.xpending("servestream", "mygroup")
+    assert pending["pending"] == 0
+
+    await p_connection.close()
+    await q_connection.close()
+
+
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_hand_over() -> None:
+    "test the pending messages of a dead consumer go to its replacement"
+    mq_connection = await Client.connect(TEST_URL)
+    await mq_connection.redis.delete("handstream")
+    await mq_connection.consumer("handstream", "mygroup", "dead")
+    my_producer = await mq_connection.producer("handstream")
+    await my_producer.addUnconfirmedMessage("left behind")
+    await mq_connection.redis.xreadgroup(
+        "mygroup", "dead", {"handstream": ">"}, count=1
+    )
+
+    supervisor = Supervisor(
+        "tests.test_worker:shout", TEST_URL, "handstream", "mygroup"
+    )
+    assert not await supervisor.hand_over(mq_connection, "dead", None)
+
+    # the connection drops while the messages are handed over
+    redis = mq_connection.redis
+    xclaim = redis.xclaim
+    failures = []
+
+    async def flaky_xclaim(*args, **kwargs):
+        if not failures:
+            failures.append(True)
+            raise exceptions.ConnectionError("connection lost")
+        return await xclaim(*args, **kwargs)
+
+    redis.xclaim = flaky_xclaim
+    assert await supervisor.hand_over(mq_connection, "dead", "alive")
+    redis.xclaim = xclaim
+    assert failures
+
+    pending = await mq_connection.redis.xpending_range(
+        "handstream", "mygroup", min="-", max="+", count=10
+    )
+    assert [info["consumer"] for info in pending] == ["alive"]
+    consumers = await mq_connection.redis.xinfo_consumers("handstream", "mygroup")
+    assert [info["name"] for info in consumers] == ["alive"]
+
+    await mq_connection.close()
+
+
+@pytest.mark.skipif(
+    TEST_URL.startswith("memory:"), reason="worker processes need a redis server"
+)
+@pytest.mark.execution_timeout(60)
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_supervisor() -> None:
+    "test worker processes are restarted and cleaned up"
+    mq_connection = await Client.connect(TEST_URL)
+    await mq_connection.redis.delete("workerstream")
+    await mq_connection.consumer("workerstream", "workergroup", "setup")
+    await mq_connection.redis.xgroup_delconsumer("workerstream", "workergroup", "setup")
+    my_producer = await mq_connection.producer("workerstream", timeout=30.0)
+
+    supervisor = Supervisor(
+        "tests.test_worker:shout",
+        TEST_URL,
+        "workerstream",
+        "workergroup",
+        processes=2,
+        concurrency=2,
+        prefix="test",
+    )
+    run_task = asyncio.create_task(supervisor.run())
+
+    response = await my_producer.addConfirmedMessage("hello")
+    assert response["message"] == "HELLO"
+
+    # crash a worker and wait for its replacement
+    old_names = dict(supervisor.names)
+    os.kill(supervisor.workers[0].pid, signal.SIGKILL)
+    while supervisor.names[0] == old_names[0]:
+        await asyncio.sleep(0.1)
+    assert supervisor.names[1] == old_names[1]
+
+    responses = await asyncio.gather(
+        *[my_producer.addConfirmedMessage("again %d" % i) for i in range(4)]
+    )
+    assert [resp["message"] for resp in responses] == ["AGAIN %d" % i for i in range(4)]
+
+    supervisor.stop()
+    await run_task
+    assert not any(process.is_alive() for process in supervisor.workers.values())
+    consumers = await mq_connection.redis.xinfo_consumers("workerstream", "workergroup")
+    assert consumers == []
+
+    await mq_connection.close()
+
+
+@pytest.mark.skipif(
+    TEST_URL.startswith("memory:"), reason="worker processes need a redis server"
+)
+@pytest.mark.execution_timeout(60)
+@pytest.mark.asyncio  # type: ignore[misc]
+async def test_supervisor_failure() -> None:
+    "test the workers are shut down when the supervisor fails"
+    mq_connection = await Client.connect(TEST_URL)
+    await mq_connection.redis.delete("workerstream")
+    await mq_connection.consumer("workerstream", "workergroup", "setup")
+    await mq_connection.redis.xgroup_delconsumer("workerstream", "workergroup", "setup")
+
+    supervisor = Supervisor(
+        "tests.test_worker:shout",
+        TEST_URL,
+        "workerstream",
+        "workergroup",
+        processes=2,
+        prefix="test",
+    )
+
+    async def broken_restart(*args) -> None:
+        raise exceptions.ConnectionError("connection lost")
+
+    supervisor.restart = broken_restart  # type: ignore[assignment]
+    run_task = asyncio.create_task(supervisor.run())
+    while len(supervisor.workers) < 2:
+        await asyncio.sleep(0.1)
+    os.kill(supervisor.workers[0].pid, signal.SIGKILL)
+
+    with pytest.raises(exceptions.ConnectionError):
+        await run_task
+    assert not any(process.is_alive() for process in supervisor.workers.values())
+
+    await mq_connection.close()